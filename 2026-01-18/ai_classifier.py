@@ -1,3 +1,4 @@
+import asyncio
 import openai
 import json
 import logging
@@ -7,20 +8,37 @@ import hashlib
 import sqlite3
 import os
 
+from classification_cache import ClassificationCache, normalize_text, text_hash
+
 logger = logging.getLogger(__name__)
 
 class AIClassifier:
-    def __init__(self, api_key: str, cache_duration: int = 3600):
+    def __init__(self, api_key: str, cache_duration: int = 86400, batch_size: int = 8,
+                 batch_window: float = 0.3, max_concurrent_requests: int = 4, request_timeout: float = 30.0):
         """
         Инициализация AI классификатора с системой обучения
         
         Args:
             api_key: OpenAI API ключ
-            cache_duration: Время кэширования результатов в секундах (по умолчанию 1 час)
+            cache_duration: Время кэширования результатов в секундах (по умолчанию 24 часа)
+            batch_size: Максимум сообщений в одном запросе к OpenAI
+            batch_window: Сколько секунд собирать пачку после первого сообщения
+            max_concurrent_requests: Максимум одновременных запросов к OpenAI
+            request_timeout: Таймаут одного запроса в секундах
         """
         self.api_key = api_key
         self.cache_duration = cache_duration
-        self.cache: Dict[str, Tuple[Dict, datetime]] = {}
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.max_concurrent_requests = max_concurrent_requests
+        self.request_timeout = request_timeout
+        self._client = None
+        self._request_semaphore: Optional[asyncio.Semaphore] = None
+        self._pending_batch: List[Tuple] = []  # (ключ, исходный текст, обрезанный текст, future)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._flush_handle = None
+        # Общий для процессов кэш (SQLite + LRU), находит и почти-дубликаты объявлений
+        self.cache = ClassificationCache(ttl=cache_duration)
         
         # Настройка OpenAI
         openai.api_key = api_key
@@ -69,43 +87,8 @@ class AIClassifier:
             
             conn.commit()
 
-    def _create_message_hash(self, message_text: str) -> str:
-        """Создает хеш сообщения для кэширования"""
-        normalized_text = ' '.join(message_text.lower().split())
-        return hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
-
-    def _is_cache_valid(self, message_hash: str) -> bool:
-        """Проверяет, действителен ли кэш для сообщения"""
-        if message_hash not in self.cache:
-            return False
-        
-        cached_result, timestamp = self.cache[message_hash]
-        return (datetime.now() - timestamp).total_seconds() < self.cache_duration
-
-    def _get_cached_result(self, message_hash: str) -> Optional[Dict]:
-        """Получает результат из кэша"""
-        if self._is_cache_valid(message_hash):
-            result, _ = self.cache[message_hash]
-            logger.info(f"📋 Использован кэшированный результат для сообщения")
-            return result
-        return None
-
-    def _cache_result(self, message_hash: str, result: Dict):
-        """Сохраняет результат в кэш"""
-        self.cache[message_hash] = (result, datetime.now())
-        
-        # Очистка старых записей кэша
-        current_time = datetime.now()
-        expired_hashes = []
-        for hash_key, (_, timestamp) in self.cache.items():
-            if (current_time - timestamp).total_seconds() > self.cache_duration:
-                expired_hashes.append(hash_key)
-        
-        for hash_key in expired_hashes:
-            del self.cache[hash_key]
-
-    def _create_enhanced_prompt(self, message_text: str) -> str:
-        """Создает краткий оптимизированный промпт для классификации"""
+    def _classification_rules(self) -> str:
+        """Общая часть промпта: роль, список ниш и правила классификации"""
         return f"""
 Ты - эксперт по классификации сообщений в Telegram.
 Твоя задача: определить, относится ли сообщение к одной из ниш списка, и выявить тип (ПОИСК, ПРЕДЛОЖЕНИЕ, ОБЩЕНИЕ, СПАМ).
@@ -124,7 +107,11 @@ class AIClassifier:
    - ПОИСК: Автор ищет услугу/товар (готов платить).
    - ПРЕДЛОЖЕНИЕ: Автор предлагает услугу/товар.
    - ОБЩЕНИЕ: Вопросы, обсуждения, продажа личных вещей (не профильных).
+"""
 
+    def _create_enhanced_prompt(self, message_text: str) -> str:
+        """Создает краткий оптимизированный промпт для классификации"""
+        return self._classification_rules() + f"""
 ТВОЙ ОТВЕТ ДОЛЖЕН БЫТЬ СТРОГИМ JSON:
 {{
     "message_type": "ПОИСК|ПРЕДЛОЖЕНИЕ|ОБЩЕНИЕ|СПАМ",
@@ -139,9 +126,42 @@ class AIClassifier:
 
 Сообщение для анализа: "{message_text}"
 """
+
+    def _create_batch_prompt(self, message_texts: List[str]) -> str:
+        """Промпт для классификации нескольких сообщений одним запросом"""
+        numbered = json.dumps(
+            [{"index": i, "text": text} for i, text in enumerate(message_texts)],
+            ensure_ascii=False
+        )
+        return self._classification_rules() + f"""
+Классифицируй КАЖДОЕ сообщение отдельно, независимо от остальных.
+
+ТВОЙ ОТВЕТ ДОЛЖЕН БЫТЬ СТРОГИМ JSON:
+{{
+    "results": [
+        {{
+            "index": номер сообщения,
+            "message_type": "ПОИСК|ПРЕДЛОЖЕНИЕ|ОБЩЕНИЕ|СПАМ",
+            "is_spam": true/false,
+            "niches": ["Название ниши" или пусто],
+            "confidence": 0-100,
+            "reason": "Краткая причина",
+            "context": "",
+            "urgency": "не срочно",
+            "budget": ""
+        }}
+    ]
+}}
+
+Сообщения для анализа ({len(message_texts)} шт.): {numbered}
+"""
+
     async def classify_message(self, message_text: str) -> Dict:
         """
         Классифицирует сообщение с помощью ChatGPT с улучшенным промптом
+
+        Сообщения, пришедшие в течение batch_window, отправляются одним запросом
+        (до batch_size штук), результат возвращается каждому вызывающему.
         
         Returns:
             Dict с полями:
@@ -159,102 +179,192 @@ class AIClassifier:
         # Это страховка от длинных лонгридов и пересылок
         truncated_text = message_text[:800]
         
-        message_hash = self._create_message_hash(truncated_text)  # Используем обрезанный текст для хеша
-        
-        # Проверяем кэш
-        cached_result = self._get_cached_result(message_hash)
+        # Проверяем кэш (по обрезанному тексту: точное совпадение или почти-дубликат)
+        cached_result = await self.cache.get_async(truncated_text)
         if cached_result:
+            logger.info(f"📋 Использован кэшированный результат для сообщения")
             return cached_result
 
+        # Тот же текст уже ждет ответа - не отправляем его повторно
+        inflight_key = text_hash(normalize_text(truncated_text))
+        future = self._inflight.get(inflight_key)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._inflight[inflight_key] = future
+            self._pending_batch.append((inflight_key, message_text, truncated_text, future))
+            self._schedule_batch_flush()
+        return dict(await asyncio.shield(future))
+
+    def _schedule_batch_flush(self):
+        """Отправить пачку сразу при batch_size сообщений, иначе через batch_window"""
+        loop = asyncio.get_event_loop()
+        if len(self._pending_batch) >= self.batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._flush_batch()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush_batch)
+
+    def _flush_batch(self):
+        self._flush_handle = None
+        while self._pending_batch:
+            batch = self._pending_batch[:self.batch_size]
+            self._pending_batch = self._pending_batch[self.batch_size:]
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple]):
+        """Классифицирует пачку и раздает результаты ожидающим вызовам"""
+        if self._request_semaphore is None:
+            self._request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
         try:
-            # Используем улучшенный промпт с обрезанным текстом
-            prompt = self._create_enhanced_prompt(truncated_text)
-
-            # Отправляем запрос к ChatGPT
-            # 🔄 СМЕНА МОДЕЛИ на gpt-4o-mini - цена упадет в 3-4 раза
-            client = openai.OpenAI(api_key=self.api_key)
-            # 🚫 Отключение истории - messages создается заново для каждого вызова (правильно)
-            messages = [
-                {"role": "system", "content": "Ты - эксперт по анализу сообщений в Telegram. Анализируй объективно и точно. Всегда отвечай в формате JSON."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            # Логирование перед отправкой запроса для отладки
-            model_name = "gpt-4o-mini"
-            logger.info(f"🚀 ОТПРАВЛЯЮ ЗАПРОС. МОДЕЛЬ: {model_name}")
-            print(f"🚀 ОТПРАВЛЯЮ ЗАПРОС. МОДЕЛЬ: {model_name}")
-            
-            response = client.chat.completions.create(
+            async with self._request_semaphore:
+                results: List[Optional[Dict]] = [None] * len(batch)
+                if len(batch) > 1:
+                    try:
+                        results = await self._request_batch([item[2] for item in batch])
+                        logger.info(f"📦 AI классификация пачкой: {len(batch)} сообщений одним запросом")
+                    except Exception as e:
+                        logger.warning(f"⚠️ Ошибка пакетной AI классификации ({len(batch)} сообщений), классифицируем по одному: {e}")
+                        results = [None] * len(batch)
+
+                missing = [i for i, result in enumerate(results) if result is None]
+                if missing:
+                    singles = await asyncio.gather(
+                        *(self._request_single(batch[i][2]) for i in missing),
+                        return_exceptions=True
+                    )
+                    for i, result in zip(missing, singles):
+                        results[i] = result
+
+            for (inflight_key, message_text, truncated_text, future), result in zip(batch, results):
+                self._inflight.pop(inflight_key, None)
+                if isinstance(result, Exception):
+                    result = self._error_result(result)
+                    # НЕ кэшируем результат при ошибке, чтобы при следующем запросе попробовать снова
+                else:
+                    try:
+                        result = self._validate_and_normalize_result(result)
+                    except Exception as e:
+                        # Корректный JSON, но не объект классификации (например, список строк)
+                        result = self._error_result(ValueError(f"некорректный ответ: {e}"))
+                    else:
+                        try:
+                            # Кэшируем результат
+                            await self.cache.put_async(truncated_text, result)
+
+                            # Сохраняем пример для обучения
+                            self._save_classification_example(message_text, result)
+                        except Exception as e:
+                            logger.error(f"❌ Ошибка сохранения результата AI классификации: {e}")
+
+                        logger.info(f"🤖 AI классификация: тип={result.get('message_type')}, спам={result.get('is_spam')}, ниши={result.get('niches')}, уверенность={result.get('confidence')}%")
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # Ни один ожидающий вызов не должен повиснуть, даже если пачка упала или отменена
+            for inflight_key, _, _, future in batch:
+                self._inflight.pop(inflight_key, None)
+                if not future.done():
+                    future.set_result(self._error_result(RuntimeError("классификация пачки прервана")))
+
+    async def _chat_completion(self, prompt: str, max_tokens: int) -> str:
+        """Запрос к ChatGPT с таймаутом, возвращает JSON-текст ответа"""
+        # 🔄 СМЕНА МОДЕЛИ на gpt-4o-mini - цена упадет в 3-4 раза
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(api_key=self.api_key)
+        # 🚫 Отключение истории - messages создается заново для каждого вызова (правильно)
+        messages = [
+            {"role": "system", "content": "Ты - эксперт по анализу сообщений в Telegram. Анализируй объективно и точно. Всегда отвечай в формате JSON."},
+            {"role": "user", "content": prompt}
+        ]
+        
+        # Логирование перед отправкой запроса для отладки
+        model_name = "gpt-4o-mini"
+        logger.info(f"🚀 ОТПРАВЛЯЮ ЗАПРОС. МОДЕЛЬ: {model_name}")
+        
+        response = await asyncio.wait_for(
+            self._client.chat.completions.create(
                 model=model_name,  # Заменено с gpt-3.5-turbo-0125 для экономии 3-4x
                 messages=messages,  # Создается заново каждый раз - история не накапливается
-                max_tokens=300,
+                max_tokens=max_tokens,
                 temperature=0.1
-            )
+            ),
+            timeout=self.request_timeout
+        )
 
-            # Парсим ответ
-            response_text = response.choices[0].message.content.strip()
-            
-            # Извлекаем JSON из ответа
-            if response_text.startswith('```json'):
-                response_text = response_text[7:-3]
-            elif response_text.startswith('```'):
-                response_text = response_text[3:-3]
-            
-            result = json.loads(response_text)
-            
-            # Валидация и нормализация результата
-            result = self._validate_and_normalize_result(result)
-            
-            # Кэшируем результат
-            self._cache_result(message_hash, result)
-            
-            # Сохраняем пример для обучения
-            self._save_classification_example(message_text, result)
-            
-            logger.info(f"🤖 AI классификация: тип={result.get('message_type')}, спам={result.get('is_spam')}, ниши={result.get('niches')}, уверенность={result.get('confidence')}%")
-            
-            return result
+        # Парсим ответ
+        response_text = response.choices[0].message.content.strip()
+        
+        # Извлекаем JSON из ответа
+        if response_text.startswith('```json'):
+            response_text = response_text[7:-3]
+        elif response_text.startswith('```'):
+            response_text = response_text[3:-3]
+        return response_text
 
-        except Exception as e:
-            error_str = str(e).lower()
-            logger.error(f"❌ Ошибка AI классификации: {e}")
-            
-            # Проверяем, является ли это критической ошибкой API (недоступность, неверный ключ и т.д.)
-            is_critical_api_error = any(keyword in error_str for keyword in [
-                'api', 'authentication', 'unauthorized', 'invalid', 'key', 'quota', 
-                'rate limit', 'connection', 'timeout', 'network', 'unreachable'
-            ])
-            
-            if is_critical_api_error:
-                logger.warning(f"⚠️ КРИТИЧЕСКАЯ ошибка API OpenAI: {e}. AI классификатор недоступен.")
-                # Возвращаем специальный результат, который указывает на недоступность AI
-                default_result = {
-                    "message_type": "ОБЩЕНИЕ",
-                    "is_spam": False,
-                    "niches": [],
-                    "context": "",
-                    "urgency": "не срочно",
-                    "budget": "",
-                    "confidence": 0,  # Нулевая уверенность = AI недоступен
-                    "reason": f"AI API недоступен: {str(e)[:100]}",
-                    "ai_unavailable": True  # Флаг недоступности AI
-                }
-            else:
-                # Для других ошибок (парсинг, валидация) возвращаем обычный результат
-                default_result = {
-                    "message_type": "ОБЩЕНИЕ",
-                    "is_spam": False,
-                    "niches": [],
-                    "context": "",
-                    "urgency": "не срочно",
-                    "budget": "",
-                    "confidence": 50,
-                    "reason": f"Ошибка AI классификации: {str(e)[:100]}",
-                    "ai_unavailable": False
-                }
-            
-            # НЕ кэшируем результат при ошибке, чтобы при следующем запросе попробовать снова
-            return default_result
+    async def _request_single(self, truncated_text: str) -> Dict:
+        # Используем улучшенный промпт с обрезанным текстом
+        prompt = self._create_enhanced_prompt(truncated_text)
+        return json.loads(await self._chat_completion(prompt, max_tokens=300))
+
+    async def _request_batch(self, truncated_texts: List[str]) -> List[Optional[Dict]]:
+        """Один запрос на пачку; сообщения без ответа в пачке получают None"""
+        prompt = self._create_batch_prompt(truncated_texts)
+        data = json.loads(await self._chat_completion(prompt, max_tokens=300 * len(truncated_texts)))
+        items = data.get("results", []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("в ответе нет списка results")
+
+        results: List[Optional[Dict]] = [None] * len(truncated_texts)
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.pop("index", None)
+            if isinstance(index, int) and 0 <= index < len(results) and results[index] is None:
+                results[index] = item
+        return results
+
+    def _error_result(self, e: Exception) -> Dict:
+        """Результат по умолчанию при ошибке запроса к OpenAI"""
+        error_str = str(e).lower()
+        if isinstance(e, asyncio.TimeoutError):
+            error_str = error_str or "timeout"
+        logger.error(f"❌ Ошибка AI классификации: {e!r}")
+        
+        # Проверяем, является ли это критической ошибкой API (недоступность, неверный ключ и т.д.)
+        is_critical_api_error = any(keyword in error_str for keyword in [
+            'api', 'authentication', 'unauthorized', 'invalid', 'key', 'quota', 
+            'rate limit', 'connection', 'timeout', 'network', 'unreachable'
+        ])
+        
+        if is_critical_api_error:
+            logger.warning(f"⚠️ КРИТИЧЕСКАЯ ошибка API OpenAI: {e}. AI классификатор недоступен.")
+            # Возвращаем специальный результат, который указывает на недоступность AI
+            return {
+                "message_type": "ОБЩЕНИЕ",
+                "is_spam": False,
+                "niches": [],
+                "context": "",
+                "urgency": "не срочно",
+                "budget": "",
+                "confidence": 0,  # Нулевая уверенность = AI недоступен
+                "reason": f"AI API недоступен: {(str(e) or error_str)[:100]}",
+                "ai_unavailable": True  # Флаг недоступности AI
+            }
+        # Для других ошибок (парсинг, валидация) возвращаем обычный результат
+        return {
+            "message_type": "ОБЩЕНИЕ",
+            "is_spam": False,
+            "niches": [],
+            "context": "",
+            "urgency": "не срочно",
+            "budget": "",
+            "confidence": 50,
+            "reason": f"Ошибка AI классификации: {str(e)[:100]}",
+            "ai_unavailable": False
+        }
 
     def _validate_and_normalize_result(self, result: Dict) -> Dict:
         """Валидирует и нормализует результат классификации"""
@@ -341,6 +451,9 @@ class AIClassifier:
                     conn.commit()
                     logger.info(f"✅ Классификация исправлена и сохранена для обучения")
                     
+                    # Исправленный результат заменяет закэшированный ответ модели
+                    self.cache.put(message_text[:800], corrected_result)
+                    
                     # Обновляем статистику точности
                     self._update_accuracy_stats()
                 else:
@@ -413,16 +526,18 @@ class AIClassifier:
 
     def get_cache_stats(self) -> Dict:
         """Возвращает статистику кэша"""
+        cache_size = len(self.cache)
         return {
-            "cache_size": len(self.cache),
+            "cache_size": cache_size,
             "cache_duration": self.cache_duration,
-            "total_cached_results": len(self.cache)
+            "total_cached_results": cache_size,
+            **self.cache.get_stats()
         }
 
-    def clear_cache(self):
-        """Очищает кэш"""
-        self.cache.clear()
-        logger.info("🧹 Кэш AI классификатора очищен")
+    def clear_cache(self, persistent: bool = False):
+        """Очищает кэш в памяти (persistent=True - также сохраненный в БД)"""
+        self.cache.clear(persistent=persistent)
+        logger.info("🧹 Кэш AI классификатора очищен" + (" (включая БД)" if persistent else " (в памяти)"))
 
     def export_learning_data(self, filename: str = "ai_learning_export.json"):
         """Экспортирует данные обучения в JSON файл"""
@@ -1,12 +1,32 @@
+import asyncio
 import numpy as np
+import os
 import re
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 import logging
+from typing import Dict, List, Optional, Tuple
+from embedding_cache import EmbeddingCache, anchors_snapshot_key, load_anchor_snapshot, save_anchor_snapshot
 
 logger = logging.getLogger(__name__)
 
+# Бэкенд инференса: torch (FP32), onnx (ONNX Runtime FP32), onnx-int8 (ONNX + динамическая int8-квантизация)
+SNIPER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+DEFAULT_SNIPER_BACKEND = os.getenv('SNIPER_BACKEND', 'torch')
+# Куда сохраняется экспортированная/квантизованная модель (экспорт выполняется один раз)
+SNIPER_ONNX_DIR = os.getenv('SNIPER_ONNX_DIR', 'models')
+# Набор инструкций для int8-квантизации: avx2 (любой x86), avx512, avx512_vnni, arm64
+SNIPER_QUANTIZATION = os.getenv('SNIPER_QUANTIZATION', 'avx2')
+
+# Кэш векторов сообщений и снимки матрицы эталонов (пустая строка - без кэша)
+SNIPER_CACHE_DIR = os.getenv('SNIPER_CACHE_DIR', os.path.join(SNIPER_ONNX_DIR, 'cache'))
+SNIPER_EMBEDDING_CACHE_SIZE = int(os.getenv('SNIPER_EMBEDDING_CACHE_SIZE', '50000'))
+
+# Порог близости, с которого сообщение становится кандидатом для GPT
+CANDIDATE_SCORE = 0.60
+
 class SemanticSniper:
-    def __init__(self, model_name='cointegrated/rubert-tiny2', threshold=0.55):
+    def __init__(self, model_name='cointegrated/rubert-tiny2', threshold=0.55,
+                 batch_size: int = 32, batch_window: float = 0.02, backend: Optional[str] = None):
         """
         AI Снайпер: Семантический поиск + Фильтр намерений.
         
@@ -15,13 +35,32 @@ class SemanticSniper:
             threshold (0.0 - 1.0): Порог схожести. 
                 0.5 = мягкий поиск, 0.7 = очень точный поиск.
                 0.55 = оптимально для rubert-tiny2
+            batch_size: Максимум сообщений в одном проходе модели (analyze_async)
+            batch_window: Сколько секунд собирать пачку после первого сообщения (analyze_async)
+            backend: torch / onnx / onnx-int8 (по умолчанию SNIPER_BACKEND из окружения)
         """
         logger.info("🎯 Инициализация AI Снайпера...")
         try:
-            self.model = SentenceTransformer(model_name)
+            self.model_name = model_name
+            self.backend = backend or DEFAULT_SNIPER_BACKEND
+            self.model = self._load_model(model_name, self.backend)
             self.threshold = threshold
+            self.batch_size = max(1, batch_size)
+            self.batch_window = batch_window
             self.anchors = {}
             self.anchor_embeddings = {}
+            # Все эталоны одной нормированной матрицей: строки ниши идут подряд с niche_offsets[i]
+            self.niche_names: List[str] = []
+            self.anchor_matrix: Optional[np.ndarray] = None
+            self.niche_offsets: Optional[np.ndarray] = None
+            self._pending_batch: List[Tuple[str, asyncio.Future]] = []
+            self._flush_handle = None
+            # Каталог кэша на пару модель+бэкенд: векторы разных бэкендов немного отличаются
+            self.cache_dir = (
+                os.path.join(SNIPER_CACHE_DIR, f"{model_name.replace('/', '__')}-{self.backend}")
+                if SNIPER_CACHE_DIR else None
+            )
+            self.embedding_cache = self._open_embedding_cache()
             
             # Регулярки для выявления продавцов (Supply)
             self.seller_patterns = [
@@ -39,6 +78,44 @@ class SemanticSniper:
             logger.error(f"❌ Ошибка загрузки AI Снайпера: {e}")
             raise
 
+    def _load_model(self, model_name: str, backend: str) -> SentenceTransformer:
+        """
+        Загрузка модели на выбранном бэкенде
+
+        ONNX-бэкенды используют тот же пайплайн sentence-transformers (токенизатор,
+        пулинг, нормализация), меняется только рантайм трансформера. Если ONNX
+        Runtime/optimum не установлены или экспорт не удался - откат на torch.
+        """
+        if backend not in SNIPER_BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд снайпера: {backend} (доступны: {', '.join(SNIPER_BACKENDS)})")
+        if backend == 'torch':
+            return SentenceTransformer(model_name)
+
+        try:
+            if backend == 'onnx':
+                model = SentenceTransformer(model_name, backend='onnx')
+            else:
+                model = self._load_quantized_model(model_name)
+            logger.info(f"⚡ AI Снайпер: модель {model_name} на бэкенде {backend}")
+            return model
+        except Exception as e:
+            logger.warning(f"⚠️ Бэкенд {backend} недоступен ({e}), используем torch")
+            self.backend = 'torch'
+            return SentenceTransformer(model_name)
+
+    def _load_quantized_model(self, model_name: str) -> SentenceTransformer:
+        """ONNX-модель с динамической int8-квантизацией (экспорт при первом запуске, дальше - с диска)"""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        model_dir = os.path.join(SNIPER_ONNX_DIR, model_name.replace('/', '__'))
+        file_name = f"onnx/model_qint8_{SNIPER_QUANTIZATION}.onnx"
+        if not os.path.exists(os.path.join(model_dir, file_name)):
+            logger.info(f"📦 Экспорт {model_name} в ONNX с int8-квантизацией ({SNIPER_QUANTIZATION}) -> {model_dir}")
+            model = SentenceTransformer(model_name, backend='onnx')
+            model.save_pretrained(model_dir)
+            export_dynamic_quantized_onnx_model(model, SNIPER_QUANTIZATION, model_dir)
+        return SentenceTransformer(model_dir, backend='onnx', model_kwargs={'file_name': file_name})
+
     def _load_anchors(self):
         """
         Загрузка эталонных фраз (Боли клиентов).
@@ -141,20 +218,76 @@ class SemanticSniper:
             ]
         }
         
-        # Предварительная векторизация (один раз при инициализации)
-        logger.info(f"📝 Векторизация эталонов для {len(self.anchors)} ниш...")
-        for niche, phrases in self.anchors.items():
-            if phrases:
-                try:
-                    self.anchor_embeddings[niche] = self.model.encode(phrases, convert_to_numpy=True)
-                    logger.debug(f"✅ Эталоны для '{niche}': {len(phrases)} фраз")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка векторизации для '{niche}': {e}")
-                    # Если не удалось загрузить эталоны для ниши, пропускаем её
-                    continue
-        
-        total_phrases = sum(len(phrases) for phrases in self.anchors.values())
-        logger.info(f"✅ Загружено {total_phrases} эталонных фраз для {len(self.anchor_embeddings)} ниш")
+        # Предварительная векторизация (один раз: дальше матрица берется из снимка для этих модели и эталонов)
+        self.niche_names = [niche for niche, phrases in self.anchors.items() if phrases]
+        phrases = [phrase for niche in self.niche_names for phrase in self.anchors[niche]]
+        snapshot_key = anchors_snapshot_key(f"{self.model_name}:{self.backend}", self.anchors)
+        self.anchor_matrix = load_anchor_snapshot(self.cache_dir, snapshot_key, len(phrases)) if self.cache_dir else None
+        if self.anchor_matrix is not None:
+            logger.info(f"📦 Эталоны загружены из снимка {snapshot_key}")
+        else:
+            logger.info(f"📝 Векторизация эталонов для {len(self.anchors)} ниш...")
+            self.anchor_matrix = self._encode(phrases)
+            if self.cache_dir:
+                save_anchor_snapshot(self.cache_dir, snapshot_key, self.anchor_matrix)
+        counts = [len(self.anchors[niche]) for niche in self.niche_names]
+        self.niche_offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+        self.anchor_embeddings = {
+            niche: self.anchor_matrix[start:start + count]
+            for niche, start, count in zip(self.niche_names, self.niche_offsets, counts)
+        }
+        logger.info(f"✅ Загружено {len(phrases)} эталонных фраз для {len(self.anchor_embeddings)} ниш")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Векторы текстов (float32, нормированные - скалярное произведение равно косинусу)"""
+        return self.model.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32, copy=False)
+
+    def _open_embedding_cache(self) -> Optional[EmbeddingCache]:
+        if not self.cache_dir:
+            return None
+        try:
+            return EmbeddingCache(
+                self.cache_dir, self.model.get_sentence_embedding_dimension(), capacity=SNIPER_EMBEDDING_CACHE_SIZE
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Кэш эмбеддингов недоступен ({e}), сообщения кодируются без кэша")
+            return None
+
+    def _encode_cached(self, texts: List[str]) -> np.ndarray:
+        """Векторы сообщений: повторы (в том числе внутри пачки) берутся из кэша, модель кодирует только новые"""
+        if self.embedding_cache is None:
+            return self._encode(texts)
+        found, missing = self.embedding_cache.get_many(texts)
+        if missing:
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = self._encode(unique)
+            self.embedding_cache.put_many(unique, encoded)
+            by_text = dict(zip(unique, encoded))
+            for i in missing:
+                found[i] = by_text[texts[i]]
+        return np.stack([found[i] for i in range(len(texts))])
+
+    def close(self):
+        """Сохранить кэш эмбеддингов на диск"""
+        if self.embedding_cache is not None:
+            self.embedding_cache.flush()
+
+    def _score(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Лучшая ниша для каждого сообщения пачки
+
+        Одно матричное умножение (сообщения x эталоны) и максимум по отрезкам
+        строк каждой ниши вместо цикла по нишам.
+
+        Returns:
+            (индексы ниш в niche_names, косинусная близость лучшего эталона)
+        """
+        similarities = embeddings @ self.anchor_matrix.T
+        niche_scores = np.maximum.reduceat(similarities, self.niche_offsets, axis=1)
+        best = np.argmax(niche_scores, axis=1)
+        return best, niche_scores[np.arange(len(best)), best]
 
     def is_seller(self, text: str) -> bool:
         """
@@ -196,6 +329,74 @@ class SemanticSniper:
                 'reason': str          # Причина решения (для логов)
             }
         """
+        return self.analyze_batch([text])[0]
+
+    def analyze_batch(self, texts: List[str]) -> List[Dict]:
+        """
+        Анализ пачки сообщений: один проход модели и одно матричное умножение на всю пачку.
+
+        Returns:
+            Результаты в формате analyze, в порядке texts
+        """
+        results: List[Optional[Dict]] = [self._prefilter(text) for text in texts]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        try:
+            # 2. ВЕКТОРНЫЙ ПОИСК
+            best, scores = self._score(self._encode_cached([texts[i] for i in pending]))
+            for i, niche_index, score in zip(pending, best, scores):
+                results[i] = self._verdict(self.niche_names[niche_index], max(float(score), 0.0))
+        except Exception as e:
+            logger.error(f"❌ Ошибка в analyze: {e}")
+            for i in pending:
+                results[i] = {'is_lead': False, 'niche': None, 'score': 0, 'reason': f'error: {str(e)}'}
+        return results
+
+    async def analyze_async(self, text: str) -> Dict:
+        """
+        analyze для воркеров конвейера: сообщения, пришедшие в течение batch_window,
+        кодируются одной пачкой (до batch_size штук) в отдельном потоке,
+        не блокируя event loop.
+        """
+        result = self._prefilter(text)
+        if result is not None:
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self._pending_batch.append((text, future))
+        self._schedule_batch_flush()
+        return await future
+
+    def _schedule_batch_flush(self):
+        """Запустить пачку сразу при batch_size сообщений, иначе через batch_window"""
+        if len(self._pending_batch) >= self.batch_size:
+            if self._flush_handle:
+                self._flush_handle.cancel()
+            self._flush_batch()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+
+    def _flush_batch(self):
+        self._flush_handle = None
+        while self._pending_batch:
+            batch = self._pending_batch[:self.batch_size]
+            self._pending_batch = self._pending_batch[self.batch_size:]
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            results = await asyncio.to_thread(self.analyze_batch, [text for text, _ in batch])
+        except Exception as e:
+            results = [
+                {'is_lead': False, 'niche': None, 'score': 0, 'reason': f'error: {str(e)}'} for _ in batch
+            ]
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _prefilter(self, text: str) -> Optional[Dict]:
+        """Решение без модели (пустой текст, явный мусор) или None"""
         if not text:
             return {'is_lead': False, 'niche': None, 'score': 0, 'reason': 'empty_text'}
         
@@ -207,45 +408,52 @@ class SemanticSniper:
         hard_spam = ['usdt', 'вакансия', 'менеджер', 'набор', 'заработок', 'bot', 'подпишись']
         if any(w in text_lower for w in hard_spam):
             return {'is_lead': False, 'niche': None, 'score': 0, 'reason': 'hard_spam'}
+        return None
 
-        try:
-            # 2. ВЕКТОРНЫЙ ПОИСК (Как было)
-            msg_embedding = self.model.encode(text, convert_to_numpy=True)
-            best_niche = None
-            max_score = 0
-            
-            for niche, anchor_embs in self.anchor_embeddings.items():
-                scores = util.cos_sim(msg_embedding, anchor_embs)[0]
-                # util.cos_sim возвращает torch.Tensor, преобразуем в numpy для np.max
-                if hasattr(scores, 'cpu'):  # Это torch.Tensor
-                    scores_np = scores.cpu().numpy()
-                else:  # Это уже numpy array
-                    scores_np = scores
-                current_max = float(np.max(scores_np))
-                
-                if current_max > max_score:
-                    max_score = current_max
-                    best_niche = niche
-
-            # 3. ПОРОГ
-            # Ставим 0.60 (60%).
-            # Всё что ниже - точно мусор. Всё что выше - проверит GPT.
-            if max_score < 0.60:
-                return {
-                    'is_lead': False,
-                    'niche': None,
-                    'score': round(max_score * 100, 1),
-                    'reason': 'low_score'
-                }
-
-            # Возвращаем "Кандидата" для проверки в GPT
+    def _verdict(self, best_niche: str, max_score: float) -> Dict:
+        """Решение по лучшему совпадению с эталонами"""
+        # 3. ПОРОГ
+        # Ставим 0.60 (60%).
+        # Всё что ниже - точно мусор. Всё что выше - проверит GPT.
+        if max_score < CANDIDATE_SCORE:
             return {
-                'is_lead': True,  # Это пока предварительно "Да"
-                'niche': best_niche,
+                'is_lead': False,
+                'niche': None,
                 'score': round(max_score * 100, 1),
-                'reason': 'candidate_for_gpt'
+                'reason': 'low_score'
             }
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка в analyze: {e}")
-            return {'is_lead': False, 'niche': None, 'score': 0, 'reason': f'error: {str(e)}'}
+
+        # Возвращаем "Кандидата" для проверки в GPT
+        return {
+            'is_lead': True,  # Это пока предварительно "Да"
+            'niche': best_niche,
+            'score': round(max_score * 100, 1),
+            'reason': 'candidate_for_gpt'
+        }
+
+    def compare_with(self, reference: 'SemanticSniper', texts: List[str], tolerance: float = 0.02) -> Dict:
+        """
+        Сверка решений с эталонным снайпером (обычно torch) на одних и тех же текстах
+
+        Решение (кандидат/нет и ниша) должно совпадать; расхождение допускается
+        только у пограничных сообщений, чья близость в пределах tolerance от
+        порога CANDIDATE_SCORE, или смена ниши при близости в пределах tolerance.
+
+        Returns:
+            {'ok', 'max_score_diff', 'mismatches': [(текст, наш результат, эталон)]}
+        """
+        ours = self.analyze_batch(texts)
+        theirs = reference.analyze_batch(texts)
+        max_diff = 0.0
+        mismatches = []
+        for text, a, b in zip(texts, ours, theirs):
+            diff = abs(a['score'] - b['score']) / 100
+            max_diff = max(max_diff, diff)
+            if (a['is_lead'], a['niche']) == (b['is_lead'], b['niche']):
+                continue
+            borderline = abs(b['score'] / 100 - CANDIDATE_SCORE) <= tolerance
+            if a['is_lead'] and b['is_lead'] and diff <= tolerance:
+                borderline = True  # другая ниша с почти равной близостью
+            if not borderline:
+                mismatches.append((text, a, b))
+        return {'ok': max_diff <= tolerance and not mismatches, 'max_score_diff': round(max_diff, 4), 'mismatches': mismatches}
@@ -7,6 +7,7 @@ from database import Database
 from datetime import datetime, timezone
 from content import get_topic_content, get_available_topics, get_topic_description, get_topic_keywords
 from monitor import MessageMonitor
+from feedback_store import get_feedback_store
 import logging
 from utils import is_message_allowed
 import json
@@ -1658,7 +1659,9 @@ async def cmd_ai_stats(message: Message):
             "🤖 **Статистика AI классификатора**\n\n"
             f"📊 **Кэш:**\n"
             f"• Размер кэша: {cache_stats['cache_size']}\n"
-            f"• Время кэширования: {cache_stats['cache_duration']} сек\n\n"
+            f"• Время кэширования: {cache_stats['cache_duration']} сек\n"
+            f"• Попадания: {cache_stats.get('hit_rate', 0)}% "
+            f"(почти-дубликаты: {cache_stats.get('near_hits', 0)}, промахи: {cache_stats.get('misses', 0)})\n\n"
             f"📚 **Обучение:**\n"
             f"• Всего примеров: {learning_stats.get('total_examples', 0)}\n"
             f"• Исправлений: {learning_stats.get('corrections_count', 0)}\n"
@@ -2001,8 +2004,8 @@ async def cmd_ai_clear(message: Message):
             await message.answer("❌ AI классификатор не инициализирован")
             return
         
-        # Очищаем кэш
-        monitor.ai_classifier.clear_cache()
+        # Очищаем кэш, включая сохраненный в БД
+        monitor.ai_classifier.clear_cache(persistent=True)
         
         await message.answer("🧹 **Кэш AI классификатора очищен!**\n\n"
                            "Следующие запросы будут обрабатываться заново")
@@ -2177,21 +2180,9 @@ def is_message_marked_as_not_relevant(message_id: str, user_id: str) -> bool:
     Проверяет, был ли message_id помечен как нерелевантный для конкретного пользователя
     """
     try:
-        feedback_file = "relevance_feedback.json"
-        try:
-            with open(feedback_file, 'r', encoding='utf-8') as f:
-                feedbacks = json.load(f)
-        except FileNotFoundError:
-            return False
-        
-        # Проверяем, есть ли запись с этим message_id и user_id, где is_relevant = False
-        for feedback in feedbacks:
-            if (feedback.get("message_id") == message_id and 
-                feedback.get("user_id") == str(user_id) and 
-                feedback.get("is_relevant") == False):
-                logger.info(f"🚫 Сообщение {message_id} помечено как нерелевантное для пользователя {user_id}")
-                return True
-        
+        if get_feedback_store().is_marked_as_not_relevant(message_id, user_id):
+            logger.info(f"🚫 Сообщение {message_id} помечено как нерелевантное для пользователя {user_id}")
+            return True
         return False
     except Exception as e:
         logger.error(f"❌ Ошибка проверки релевантности сообщения: {e}")
@@ -2209,82 +2200,33 @@ def is_message_globally_blocked(message_id: str, spam_threshold: int = 2) -> boo
         True если сообщение заблокировано глобально, False иначе
     """
     try:
-        feedback_file = "relevance_feedback.json"
-        try:
-            with open(feedback_file, 'r', encoding='utf-8') as f:
-                feedbacks = json.load(f)
-        except FileNotFoundError:
-            return False
-        
-        # Подсчитываем количество отметок "не релевантно" для этого сообщения
-        not_relevant_count = 0
-        is_spam_marked = False
-        
-        for feedback in feedbacks:
-            if feedback.get("message_id") == message_id:
-                if feedback.get("is_relevant") == False:
-                    not_relevant_count += 1
-                # Проверяем, помечено ли как спам
-                if feedback.get("is_spam", False):
-                    is_spam_marked = True
-        
+        store = get_feedback_store()
+    
         # Если помечено как спам или превышен порог, блокируем глобально
-        if is_spam_marked:
+        if store.is_spam_marked(message_id):
             logger.info(f"🚫 Сообщение {message_id} заблокировано глобально (помечено как спам)")
             return True
-        
+    
+        not_relevant_count = store.not_relevant_count(message_id)
         if not_relevant_count >= spam_threshold:
             logger.info(f"🚫 Сообщение {message_id} заблокировано глобально ({not_relevant_count} отметок 'не релевантно')")
             return True
-        
+    
         return False
     except Exception as e:
         logger.error(f"❌ Ошибка проверки глобальной блокировки сообщения: {e}")
         return False
 
 async def save_relevance_feedback(message_id: str, user_id: str, is_relevant: bool, is_spam: bool = False):
-    """Сохраняет обратную связь о релевантности"""
+    """Сохраняет обратную связь о релевантности (append-only лог, см. feedback_store.py)"""
     try:
-        from datetime import datetime
-        # Здесь можно сохранить в базу данных или файл
-        feedback_data = {
-            "message_id": message_id,
-            "user_id": user_id,
-            "is_relevant": is_relevant,
-            "is_spam": is_spam,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # Сохраняем в файл для простоты (можно заменить на базу данных)
-        feedback_file = "relevance_feedback.json"
-        try:
-            with open(feedback_file, 'r', encoding='utf-8') as f:
-                feedbacks = json.load(f)
-        except FileNotFoundError:
-            feedbacks = []
-        
-        # Проверяем, нет ли уже такой записи (чтобы не дублировать)
-        existing = False
-        for i, fb in enumerate(feedbacks):
-            if (fb.get("message_id") == message_id and 
-                fb.get("user_id") == str(user_id)):
-                # Обновляем существующую запись
-                feedbacks[i] = feedback_data
-                existing = True
-                break
-        
-        if not existing:
-            feedbacks.append(feedback_data)
-        
-        with open(feedback_file, 'w', encoding='utf-8') as f:
-            json.dump(feedbacks, f, ensure_ascii=False, indent=2)
-        
+        feedback_data = get_feedback_store().add(message_id, user_id, is_relevant, is_spam)
         logger.info(f"💾 Сохранена обратная связь: {feedback_data}")
-        
+    
         # Если сообщение помечено как спам, логируем это
         if is_spam:
             logger.warning(f"🚫 Сообщение {message_id} помечено как СПАМ пользователем {user_id}")
-        
+    
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения обратной связи: {e}")
 
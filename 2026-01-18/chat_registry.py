@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from telethon import TelegramClient, utils
+from telethon.tl.functions.messages import ExportChatInviteRequest
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(event) -> Optional[str]:
+    """ID чата события в формате known_chats.json (chat.id без префикса -100) без запросов к API"""
+    peer = getattr(event.message, 'peer_id', None)
+    if peer is None:
+        return None
+    try:
+        return str(utils.get_peer_id(peer, add_mark=False))
+    except (TypeError, ValueError):
+        return None
+
+
+class KnownChats:
+    """
+    Известные чаты из known_chats.json и множество ID для фильтра событий.
+
+    Фильтр (accepts) вызывается Telethon до обработчика и смотрит только в
+    множество ID, поэтому сообщения из исключенных чатов отсекаются без
+    get_chat/get_sender. Новые чаты добавляются в мониторинг сразу, а файл
+    перезаписывается не на каждый новый чат, а один раз через save_delay
+    секунд после последнего изменения, в отдельном потоке.
+
+    Чат исключается из мониторинга флагом "monitored": false в known_chats.json.
+    """
+
+    def __init__(self, path: str = 'known_chats.json', save_delay: float = 5.0):
+        self.path = path
+        self.save_delay = save_delay
+        self.chats: Dict[str, Dict] = {}
+        self.monitored_ids: Set[str] = set()
+        self._save_task: Optional[asyncio.Task] = None
+        self._load()
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self.chats
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def accepts(self, event) -> bool:
+        """Фильтр events.NewMessage: текст есть, чат в мониторинге или еще не известен"""
+        if not event.message.message:
+            return False
+        chat_id = chat_key(event)
+        return chat_id is not None and (chat_id in self.monitored_ids or chat_id not in self.chats)
+
+    def add(self, chat_id: str, title: str, first_seen: str):
+        """Запомнить новый чат и включить его в мониторинг (файл сохраняется отложенно)"""
+        self.chats[chat_id] = {
+            'title': title,
+            'type': 'Private',
+            'first_seen': first_seen
+        }
+        self.monitored_ids.add(chat_id)
+        self._schedule_save()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.chats = json.load(f)
+        except FileNotFoundError:
+            logger.info(f"Файл {self.path} не найден, начинаем с пустого списка чатов")
+            return
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки {self.path}: {e}")
+            return
+        self.monitored_ids = {chat_id for chat_id, chat in self.chats.items() if chat.get('monitored', True)}
+        logger.info(f"Загружено {len(self.monitored_ids)} чатов для мониторинга (известно {len(self.chats)})")
+
+    def _schedule_save(self):
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        await self.save()
+
+    async def save(self):
+        """Сохранить снимок в файл (атомарно через временный файл, запись в отдельном потоке)"""
+        snapshot = dict(self.chats)
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения {self.path}: {e}")
+
+    def _write(self, chats: Dict[str, Dict]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(chats, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        """Сохранить отложенные изменения сразу (при остановке)"""
+        if self._save_task is None or self._save_task.done():
+            return
+        self._save_task.cancel()
+        await asyncio.gather(self._save_task, return_exceptions=True)
+        await self.save()
+
+
+@dataclass
+class ChatMetadata:
+    """Название, username и ссылки чата - все, что нужно для ссылки на сообщение"""
+    title: str
+    username: Optional[str] = None
+    link_id: Optional[str] = None    # ID для ссылок t.me/c/<id>/... (если нет username)
+    join_link: Optional[str] = None
+    loaded_at: float = field(default_factory=time.time)
+
+    def message_link(self, message_id: int, thread_id: Optional[int] = None) -> Optional[str]:
+        base = self.username or (f"c/{self.link_id}" if self.link_id else None)
+        if base is None or message_id is None:
+            return None
+        if thread_id:
+            return f"https://t.me/{base}/{thread_id}/{message_id}"
+        return f"https://t.me/{base}/{message_id}"
+
+
+class ChatMetadataCache:
+    """
+    Метаданные чатов по ID: get_entity и экспорт инвайт-ссылки выполняются один
+    раз на чат (и повторно через ttl, чтобы подхватить смену названия/username),
+    а не на каждое сообщение. Неудачный экспорт ссылки тоже кэшируется.
+    """
+
+    def __init__(self, client: TelegramClient, ttl: float = 24 * 3600):
+        self.client = client
+        self.ttl = ttl
+        self._chats: Dict[str, ChatMetadata] = {}
+        self.stats = {'hits': 0, 'loads': 0}
+
+    def get(self, chat_id: str) -> Optional[ChatMetadata]:
+        meta = self._chats.get(chat_id)
+        if meta is None or time.time() - meta.loaded_at >= self.ttl:
+            return None
+        self.stats['hits'] += 1
+        return meta
+
+    async def load(self, chat_id: str, chat) -> ChatMetadata:
+        """Получить метаданные чата из Telegram и запомнить их"""
+        self.stats['loads'] += 1
+        title = chat.title if hasattr(chat, 'title') else 'Private Chat'
+        try:
+            entity = await self.client.get_entity(chat.id)
+        except Exception as e:
+            logger.warning(f"[Monitor] Не удалось получить entity для чата {chat.id}: {e}")
+            entity = chat
+
+        username = getattr(entity, 'username', None)
+        if username:
+            meta = ChatMetadata(title=title, username=username, join_link=f"https://t.me/{username}")
+            logger.info(f"[Monitor] Публичный чат {title}: @{username}")
+        else:
+            chat_id_int = abs(chat.id)
+            # Убираем префикс -100 для супергрупп
+            link_id = str(chat_id_int)[4:] if chat_id_int >= 1000000000000 else str(chat_id_int)
+            if link_id.isdigit():
+                meta = ChatMetadata(
+                    title=title,
+                    link_id=link_id,
+                    join_link=await _get_join_link_if_available(self.client, chat),
+                )
+                logger.info(f"[Monitor] Приватный чат {title} (ID для ссылок: {link_id})")
+            else:
+                logger.warning(f"[Monitor] Некорректный ID чата для ссылки: {link_id}")
+                meta = ChatMetadata(title=title)
+
+        self._chats[chat_id] = meta
+        return meta
+
+
+async def _get_join_link_if_available(client: TelegramClient, chat) -> Optional[str]:
+    """
+    Пытается получить invite link для приватных чатов (если доступно боту/аккаунту).
+    Возвращает None, если прав нет или ссылка недоступна.
+    """
+    try:
+        exported = await client(ExportChatInviteRequest(peer=chat))
+        return getattr(exported, "link", None)
+    except Exception as e:
+        logger.info(f"[Monitor] Invite link недоступен для чата {getattr(chat, 'id', '')}: {e}")
+    return None
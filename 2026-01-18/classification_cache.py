@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_DIGITS_RE = re.compile(r"\d+")
+_MERSENNE_PRIME = (1 << 61) - 1
+
+# Поля, которые переносятся с почти-дубликата (остальные извлечены из чужого текста)
+NEAR_DUPLICATE_FIELDS = ('message_type', 'is_spam', 'niches', 'confidence')
+
+
+def normalize_text(message_text: str) -> str:
+    return ' '.join(message_text.lower().split())
+
+
+def text_hash(normalized_text: str) -> str:
+    return hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
+
+
+class MinHasher:
+    """
+    MinHash-отпечаток текста по словесным биграммам
+
+    Эмодзи и пунктуация не учитываются, числа заменяются на 0
+    (в повторных объявлениях чаще всего меняются цены и телефоны).
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 42):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    @staticmethod
+    def shingles(normalized_text: str) -> set:
+        tokens = _TOKEN_RE.findall(_DIGITS_RE.sub('0', normalized_text))
+        if len(tokens) < 2:
+            return set(tokens)
+        return {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+    def fingerprint(self, normalized_text: str) -> Optional[Tuple[int, ...]]:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+            for s in self.shingles(normalized_text)
+        ]
+        if not hashes:
+            return None
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        """Оценка коэффициента Жаккара по доле совпавших минимумов"""
+        return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+class ClassificationCache:
+    """
+    Кэш результатов AI классификации: LRU в памяти перед SQLite.
+
+    SQLite-файл общий для всех процессов монитора на сервере и переживает
+    перезапуск. Помимо точного ключа (md5 нормализованного текста) хранится
+    MinHash-отпечаток с LSH-индексом по полосам, поэтому повторно выложенное
+    объявление с мелкими правками (цена, телефон, эмодзи) тоже попадает в кэш,
+    если оценка сходства не ниже similarity_threshold.
+
+    Соединение с SQLite одно на кэш. Из асинхронного кода используются
+    get_async/put_async: попадание в LRU отдается сразу, а запросы к SQLite
+    и MinHash выполняются в отдельном потоке, не блокируя цикл событий.
+    """
+
+    def __init__(self, db_path: str = "ai_cache.db", ttl: float = 86400, lru_size: int = 2000,
+                 similarity_threshold: float = 0.8, num_perm: int = 64, bands: int = 16):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.lru_size = lru_size
+        self.similarity_threshold = similarity_threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.minhasher = MinHasher(num_perm)
+        self._lru: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()  # hash -> (результат, created_at)
+        self._puts_since_purge = 0
+        self.stats = {'lru_hits': 0, 'db_hits': 0, 'near_hits': 0, 'misses': 0}
+        self._lru_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+        self._init_db()
+
+    def _init_db(self):
+        with self._db_lock, self._conn as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS classification_cache (
+                    text_hash TEXT PRIMARY KEY,
+                    fingerprint BLOB,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS classification_cache_bands (
+                    bucket TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_bands_bucket ON classification_cache_bands (bucket)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_created ON classification_cache (created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_bands_created ON classification_cache_bands (created_at)')
+
+    def _band_buckets(self, fingerprint: Tuple[int, ...]) -> List[str]:
+        r = self.rows_per_band
+        return [
+            f"{band}:" + hashlib.md5(struct.pack(f"<{r}Q", *fingerprint[band * r:(band + 1) * r])).hexdigest()[:16]
+            for band in range(self.bands)
+        ]
+
+    def _remember(self, key: str, result: Dict, created_at: float):
+        with self._lru_lock:
+            self._lru[key] = (result, created_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _lru_get(self, key: str, now: float) -> Optional[Dict]:
+        with self._lru_lock:
+            cached = self._lru.get(key)
+            if cached is None:
+                return None
+            if now - cached[1] >= self.ttl:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            self.stats['lru_hits'] += 1
+            return dict(cached[0])
+
+    def get(self, message_text: str) -> Optional[Dict]:
+        """Результат для текста или его почти-дубликата (None - промах)"""
+        normalized = normalize_text(message_text)
+        key = text_hash(normalized)
+        now = time.time()
+        cached = self._lru_get(key, now)
+        if cached is not None:
+            return cached
+        return self._db_get(normalized, key, now)
+
+    async def get_async(self, message_text: str) -> Optional[Dict]:
+        """get без блокировки цикла событий: SQLite и MinHash - в отдельном потоке"""
+        normalized = normalize_text(message_text)
+        key = text_hash(normalized)
+        now = time.time()
+        cached = self._lru_get(key, now)
+        if cached is not None:
+            return cached
+        return await asyncio.to_thread(self._db_get, normalized, key, now)
+
+    def _db_get(self, normalized: str, key: str, now: float) -> Optional[Dict]:
+        try:
+            with self._db_lock, self._conn as conn:
+                row = conn.execute(
+                    'SELECT result, created_at FROM classification_cache WHERE text_hash = ? AND created_at > ?',
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    result = json.loads(row[0])
+                    self._remember(key, result, row[1])
+                    self.stats['db_hits'] += 1
+                    return dict(result)
+
+                fingerprint = self.minhasher.fingerprint(normalized)
+                if fingerprint is not None:
+                    buckets = self._band_buckets(fingerprint)
+                    placeholders = ','.join('?' * len(buckets))
+                    candidates = conn.execute(
+                        f'''
+                        SELECT c.text_hash, c.fingerprint, c.result, c.created_at
+                        FROM classification_cache c
+                        WHERE c.created_at > ? AND c.text_hash IN (
+                            SELECT text_hash FROM classification_cache_bands WHERE bucket IN ({placeholders})
+                        )
+                        ''',
+                        (now - self.ttl, *buckets)
+                    ).fetchall()
+
+                    best = None
+                    for candidate_hash, blob, result_json, created_at in candidates:
+                        if not blob:
+                            continue
+                        similarity = self.minhasher.similarity(
+                            fingerprint, struct.unpack(f"<{self.minhasher.num_perm}Q", blob)
+                        )
+                        if similarity >= self.similarity_threshold and (best is None or similarity > best[0]):
+                            best = (similarity, result_json, created_at)
+
+                    if best is not None:
+                        result = self._near_duplicate_result(json.loads(best[1]))
+                        # Срок жизни считаем от исходной классификации
+                        self._remember(key, result, best[2])
+                        self.stats['near_hits'] += 1
+                        logger.info(f"📋 Найден почти-дубликат в кэше классификации (сходство {best[0]:.2f})")
+                        return dict(result)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка чтения кэша классификации: {e}")
+
+        self.stats['misses'] += 1
+        return None
+
+    @staticmethod
+    def _near_duplicate_result(result: Dict) -> Dict:
+        """
+        Результат почти-дубликата: переносим только классификацию.
+
+        Цифры при сравнении схлопываются, поэтому объявления с разной ценой
+        или датами совпадают - извлеченные поля (бюджет, контекст, срочность)
+        относятся к чужому тексту и сбрасываются.
+        """
+        return {
+            **{field: result[field] for field in NEAR_DUPLICATE_FIELDS if field in result},
+            'context': '',
+            'urgency': 'не срочно',
+            'budget': '',
+            'reason': 'Почти-дубликат ранее классифицированного сообщения',
+        }
+
+    def put(self, message_text: str, result: Dict):
+        """Сохранить результат классификации (перезаписывает прежний для того же текста)"""
+        normalized = normalize_text(message_text)
+        key = text_hash(normalized)
+        now = time.time()
+        self._remember(key, dict(result), now)
+        self._db_put(normalized, key, result, now)
+
+    async def put_async(self, message_text: str, result: Dict):
+        """put без блокировки цикла событий: LRU сразу, SQLite - в отдельном потоке"""
+        normalized = normalize_text(message_text)
+        key = text_hash(normalized)
+        now = time.time()
+        self._remember(key, dict(result), now)
+        await asyncio.to_thread(self._db_put, normalized, key, dict(result), now)
+
+    def _db_put(self, normalized: str, key: str, result: Dict, now: float):
+        fingerprint = self.minhasher.fingerprint(normalized)
+        blob = struct.pack(f"<{self.minhasher.num_perm}Q", *fingerprint) if fingerprint else None
+        try:
+            with self._db_lock, self._conn as conn:
+                conn.execute('DELETE FROM classification_cache_bands WHERE text_hash = ?', (key,))
+                conn.execute(
+                    'INSERT OR REPLACE INTO classification_cache (text_hash, fingerprint, result, created_at) VALUES (?, ?, ?, ?)',
+                    (key, blob, json.dumps(result, ensure_ascii=False), now)
+                )
+                if fingerprint:
+                    conn.executemany(
+                        'INSERT INTO classification_cache_bands (bucket, text_hash, created_at) VALUES (?, ?, ?)',
+                        [(bucket, key, now) for bucket in self._band_buckets(fingerprint)]
+                    )
+                self._puts_since_purge += 1
+                if self._puts_since_purge >= 100:
+                    self._purge_expired(conn, now)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка записи в кэш классификации: {e}")
+
+    def _purge_expired(self, conn: sqlite3.Connection, now: float):
+        """Удаление просроченных записей (раз в 100 вставок, по индексу created_at)"""
+        self._puts_since_purge = 0
+        cutoff = now - self.ttl
+        deleted = conn.execute('DELETE FROM classification_cache WHERE created_at < ?', (cutoff,)).rowcount
+        conn.execute('DELETE FROM classification_cache_bands WHERE created_at < ?', (cutoff,))
+        if deleted:
+            logger.info(f"🧹 Из кэша классификации удалено {deleted} устаревших записей")
+
+    def __len__(self) -> int:
+        try:
+            with self._db_lock, self._conn as conn:
+                return conn.execute('SELECT COUNT(*) FROM classification_cache').fetchone()[0]
+        except sqlite3.Error:
+            return len(self._lru)
+
+    def get_stats(self) -> Dict:
+        hits = self.stats['lru_hits'] + self.stats['db_hits'] + self.stats['near_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': round(hits / total * 100, 1) if total else 0.0,
+            'lru_size': len(self._lru),
+        }
+
+    def clear(self, persistent: bool = False):
+        """
+        Очистить LRU в памяти; с persistent=True - еще и таблицы SQLite
+        (только явным действием администратора: кэш должен переживать рестарты)
+        """
+        with self._lru_lock:
+            self._lru.clear()
+        if not persistent:
+            return
+        try:
+            with self._db_lock, self._conn as conn:
+                conn.execute('DELETE FROM classification_cache')
+                conn.execute('DELETE FROM classification_cache_bands')
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка очистки кэша классификации: {e}")
@@ -263,3 +263,12 @@ NOTIFICATION_SETTINGS = {
 }
 
 TRIAL_DAYS = 7  # или другое нужное вам значение
+
+# Конвейер обработки входящих сообщений монитора: воркеры и размер очереди каждой стадии
+PIPELINE_CONFIG = {
+    "ingest": {"workers": int(os.getenv('PIPELINE_INGEST_WORKERS', '4')), "queue_size": 1000},
+    "prefilter": {"workers": 1, "queue_size": 500},
+    "classify": {"workers": int(os.getenv('PIPELINE_CLASSIFY_WORKERS', '4')), "queue_size": 200},
+    "route": {"workers": 2, "queue_size": 200},
+    "deliver": {"workers": 1, "queue_size": 200},
+}
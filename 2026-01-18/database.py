@@ -5,6 +5,9 @@ from typing import List
 
 logger = logging.getLogger(__name__)
 
+# Канал LISTEN/NOTIFY: payload - user_id, у которого изменились ниши/страны
+SUBSCRIBERS_CHANNEL = "subscribers_changed"
+
 class Database:
     def __init__(self, dsn):
         self.dsn = dsn
@@ -72,6 +75,7 @@ class Database:
                         user_id, json.dumps(categories)
                     )
                     logger.info(f"✅ Обновлены категории для существующего пользователя {user_id}")
+                    await self._notify_subscriber_changed(conn, user_id)
                 else:
                     # Новый пользователь - создаем с триалом
                     trial_until = datetime.now(timezone.utc) + timedelta(days=TRIAL_DAYS)
@@ -83,6 +87,7 @@ class Database:
                         user_id, json.dumps(categories), json.dumps([]), json.dumps({}), trial_until
                     )
                     logger.info(f"✅ Новый пользователь {user_id} создан с триалом на {TRIAL_DAYS} дней (до {trial_until})")
+                    await self._notify_subscriber_changed(conn, user_id)
             except Exception as e:
                 logger.error(f"❌ Ошибка при создании/обновлении пользователя {user_id}: {e}")
                 # Пробуем создать без дополнительных полей (для обратной совместимости)
@@ -100,6 +105,7 @@ class Database:
                             ''',
                             user_id, json.dumps(categories)
                         )
+                        await self._notify_subscriber_changed(conn, user_id)
                     else:
                         # Новый пользователь - создаем с триалом
                         trial_until = datetime.now(timezone.utc) + timedelta(days=TRIAL_DAYS)
@@ -111,6 +117,7 @@ class Database:
                             user_id, json.dumps(categories), trial_until
                         )
                         logger.info(f"✅ Пользователь {user_id} создан в упрощенном режиме с триалом на {TRIAL_DAYS} дней")
+                        await self._notify_subscriber_changed(conn, user_id)
                 except Exception as e2:
                     logger.error(f"❌ Критическая ошибка при создании пользователя {user_id}: {e2}")
                     raise
@@ -290,6 +297,27 @@ class Database:
             logger.error(f"❌ Ошибка при получении подписчиков для ниши {niche}: {e}")
             return []
 
+    async def get_subscriber_routing_rows(self, user_ids: List[int] = None):
+        """Ниши, страны и статус подписки для индекса маршрутизации (все пользователи или user_ids)"""
+        async with self.pool.acquire() as conn:
+            query = 'SELECT user_id, categories, countries, subscription_active, subscription_until, trial_until FROM subscribers'
+            if user_ids is None:
+                return await conn.fetch(query)
+            return await conn.fetch(query + ' WHERE user_id = ANY($1::bigint[])', list(user_ids))
+
+    async def listen_subscriber_changes(self, callback):
+        """Отдельное соединение, слушающее изменения подписчиков (callback как в asyncpg add_listener)"""
+        conn = await asyncpg.connect(dsn=self.dsn)
+        await conn.add_listener(SUBSCRIBERS_CHANNEL, callback)
+        return conn
+
+    async def _notify_subscriber_changed(self, conn, user_id):
+        """Сообщает индексам маршрутизации (во всех процессах), что подписчик изменился"""
+        try:
+            await conn.execute('SELECT pg_notify($1, $2)', SUBSCRIBERS_CHANNEL, str(user_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось отправить уведомление об изменении подписчика {user_id}: {e}")
+
     async def add_user_niche(self, user_id, niche):
         async with self.pool.acquire() as conn:
             row = await conn.fetchrow('SELECT categories FROM subscribers WHERE user_id = $1', user_id)
@@ -301,6 +329,7 @@ class Database:
                 categories.append(niche)
                 await conn.execute('UPDATE subscribers SET categories = $1 WHERE user_id = $2', json.dumps(categories), user_id)
                 logger.info(f"✅ Добавлена ниша '{niche}' пользователю {user_id}")
+                await self._notify_subscriber_changed(conn, user_id)
             else:
                 logger.info(f"ℹ️ Ниша '{niche}' уже есть у пользователя {user_id}")
 
@@ -317,6 +346,7 @@ class Database:
             if len(categories) < original_length:
                 await conn.execute('UPDATE subscribers SET categories = $1 WHERE user_id = $2', json.dumps(categories), user_id)
                 logger.info(f"✅ Удалена ниша '{niche}' у пользователя {user_id} (удалено {original_length - len(categories)} дубликатов)")
+                await self._notify_subscriber_changed(conn, user_id)
             else:
                 logger.warning(f"⚠️ Ниша '{niche}' не найдена у пользователя {user_id} (категории: {categories})")
 
@@ -394,6 +424,7 @@ class Database:
                     user_id, json.dumps(niches)
                 )
                 logger.info(f"👤 Создан новый пользователь {user_id} с нишами: {niches}")
+            await self._notify_subscriber_changed(conn, user_id)
 
     # ==================== МЕТОДЫ ДЛЯ РАБОТЫ СО СТРАНАМИ ====================
     
@@ -500,6 +531,7 @@ class Database:
                     user_id, json.dumps(countries)
                 )
                 logger.info(f"👤 Создан новый пользователь {user_id} со странами: {countries}")
+            await self._notify_subscriber_changed(conn, user_id)
 
     # ==================== МЕТОДЫ ДЛЯ РЕФЕРАЛЬНОЙ СИСТЕМЫ ====================
     
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Версия формата снимков эталонов: при изменении кодирования/нормализации старые снимки не подхватываются
+ANCHOR_SNAPSHOT_VERSION = 1
+
+_KEY_SIZE = 16  # blake2b-128 от текста
+
+
+def text_key(text: str) -> bytes:
+    """Ключ кэша - хэш содержимого текста"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=_KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    Кэш векторов текстов (хэш текста -> вектор) в memory-mapped файлах.
+
+    Векторы лежат в vectors.f32 (capacity x dim, float32), ключи - в keys.bin,
+    оба файла отображены в память, поэтому после рестарта кэш доступен сразу
+    без чтения в RAM. Индекс ключ -> строка строится при открытии. Файл
+    заполняется по кругу: при переполнении перезаписываются самые старые
+    строки. Кэш привязан к модели и бэкенду (каталог на пару), потому что
+    векторы разных бэкендов немного отличаются.
+    """
+
+    def __init__(self, directory: str, dim: int, capacity: int = 50000, flush_every: int = 200):
+        """
+        Args:
+            directory: Каталог файлов кэша
+            dim: Размерность векторов модели
+            capacity: Сколько векторов хранить
+            flush_every: Через сколько новых векторов сохранять указатель записи на диск
+        """
+        self.directory = directory
+        self.dim = dim
+        self.capacity = max(1, capacity)
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._index: Dict[bytes, int] = {}
+        self._next = 0
+        self._unflushed = 0
+        self.stats = {'hits': 0, 'misses': 0}
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        vectors_path = os.path.join(self.directory, 'vectors.f32')
+        keys_path = os.path.join(self.directory, 'keys.bin')
+
+        meta = None
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ Кэш эмбеддингов {self.directory}: не удалось прочитать meta.json ({e})")
+        fresh = not (
+            meta and meta.get('dim') == self.dim and meta.get('capacity') == self.capacity
+            and os.path.exists(vectors_path) and os.path.exists(keys_path)
+        )
+        mode = 'w+' if fresh else 'r+'
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(self.capacity, self.dim))
+        self._keys = np.memmap(keys_path, dtype=np.uint8, mode=mode, shape=(self.capacity, _KEY_SIZE))
+        if fresh:
+            self._next = 0
+            self._write_meta()
+            logger.info(f"📦 Кэш эмбеддингов создан: {self.directory} ({self.capacity} x {self.dim})")
+            return
+
+        self._next = int(meta.get('next', 0)) % self.capacity
+        rows = np.flatnonzero(self._keys.any(axis=1))
+        self._index = {self._keys[row].tobytes(): int(row) for row in rows}
+        logger.info(f"📦 Кэш эмбеддингов загружен: {self.directory} ({len(self._index)} векторов)")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, texts: Sequence[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        """
+        Returns:
+            ({позиция текста: вектор} для найденных, позиции текстов без вектора)
+        """
+        found: Dict[int, np.ndarray] = {}
+        missing: List[int] = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self._index.get(text_key(text))
+                if row is None:
+                    missing.append(i)
+                else:
+                    found[i] = np.array(self._vectors[row])
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(missing)
+        return found, missing
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """Запомнить векторы текстов (строки перезаписываются по кругу)"""
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self._index:
+                    continue
+                row = self._next
+                old_key = self._keys[row].tobytes()
+                if self._index.get(old_key) == row:
+                    del self._index[old_key]
+                self._vectors[row] = vector
+                self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+                self._index[key] = row
+                self._next = (row + 1) % self.capacity
+                self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._unflushed:
+            return
+        self._vectors.flush()
+        self._keys.flush()
+        self._write_meta()
+        self._unflushed = 0
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.directory, 'meta.json')
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'capacity': self.capacity, 'next': self._next}, f)
+        os.replace(tmp_path, meta_path)
+
+
+def anchors_snapshot_key(model_id: str, anchors: Dict[str, List[str]]) -> str:
+    """Версия снимка: модель (с бэкендом) + хэш эталонных фраз в порядке ниш"""
+    payload = json.dumps(
+        {'version': ANCHOR_SNAPSHOT_VERSION, 'model': model_id, 'anchors': list(anchors.items())},
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def load_anchor_snapshot(directory: str, key: str, rows: int) -> Optional[np.ndarray]:
+    """Матрица эталонов из снимка (memory-mapped) или None, если снимка этой версии нет"""
+    path = os.path.join(directory, f"anchors-{key}.npy")
+    if not os.path.exists(path):
+        return None
+    try:
+        matrix = np.load(path, mmap_mode='r')
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать снимок эталонов {path}: {e}")
+        return None
+    if matrix.ndim != 2 or matrix.shape[0] != rows:
+        return None
+    return matrix
+
+
+def save_anchor_snapshot(directory: str, key: str, matrix: np.ndarray):
+    """Сохранить матрицу эталонов (атомарно через временный файл)"""
+    path = os.path.join(directory, f"anchors-{key}.npy")
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось сохранить снимок эталонов {path}: {e}")
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEGACY_FEEDBACK_FILE = "relevance_feedback.json"
+FEEDBACK_LOG_FILE = "relevance_feedback.jsonl"
+
+
+class RelevanceFeedbackStore:
+    """
+    Хранилище обратной связи о релевантности (кнопки "релевантно / не релевантно / спам").
+
+    Данные пишутся в append-only лог (одна JSON-запись на строку), а в памяти
+    держатся индексы по (message_id, user_id) и счетчики по message_id, поэтому
+    проверки при рассылке - это поиск в словаре без чтения файла.
+
+    Лог дописывают разные процессы (bot.py и user_monitor_bot.py), поэтому
+    перед проверками новые строки дочитываются с последней позиции
+    (не чаще refresh_interval секунд).
+    """
+
+    def __init__(self, log_file: str = FEEDBACK_LOG_FILE, legacy_file: str = LEGACY_FEEDBACK_FILE,
+                 refresh_interval: float = 1.0):
+        self.log_file = log_file
+        self.legacy_file = legacy_file
+        self.refresh_interval = refresh_interval
+
+        self._feedback: Dict[Tuple[str, str], Dict] = {}  # (message_id, user_id) -> последняя запись
+        self._not_relevant_count: Dict[str, int] = {}     # message_id -> число отметок "не релевантно"
+        self._spam_count: Dict[str, int] = {}             # message_id -> число отметок "спам"
+        self._offset = 0
+        self._last_refresh = 0.0
+
+        self._migrate_legacy_file()
+        self.refresh(force=True)
+
+    def _migrate_legacy_file(self):
+        """Переносит записи из старого relevance_feedback.json в лог (один раз)"""
+        if os.path.exists(self.log_file) or not os.path.exists(self.legacy_file):
+            return
+        try:
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                feedbacks = json.load(f)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                for feedback in feedbacks:
+                    f.write(json.dumps(feedback, ensure_ascii=False) + "\n")
+            logger.info(f"📦 Перенесено {len(feedbacks)} записей из {self.legacy_file} в {self.log_file}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка миграции {self.legacy_file}: {e}")
+
+    def _apply(self, feedback: Dict):
+        """Обновляет индексы и счетчики новой записью (заменяет прошлую запись той же пары)"""
+        message_id = feedback.get("message_id")
+        key = (message_id, str(feedback.get("user_id")))
+
+        previous = self._feedback.get(key)
+        if previous is not None:
+            if previous.get("is_relevant") is False:
+                self._not_relevant_count[message_id] -= 1
+            if previous.get("is_spam", False):
+                self._spam_count[message_id] -= 1
+
+        self._feedback[key] = feedback
+        if feedback.get("is_relevant") is False:
+            self._not_relevant_count[message_id] = self._not_relevant_count.get(message_id, 0) + 1
+        if feedback.get("is_spam", False):
+            self._spam_count[message_id] = self._spam_count.get(message_id, 0) + 1
+
+    def refresh(self, force: bool = False):
+        """Дочитывает новые строки лога (в том числе записанные другими процессами)"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return
+
+        if size < self._offset:
+            # Лог пересоздан - перечитываем с начала
+            self._feedback.clear()
+            self._not_relevant_count.clear()
+            self._spam_count.clear()
+            self._offset = 0
+        if size == self._offset:
+            return
+
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(self._offset)
+                chunk = f.read(size - self._offset)
+        except OSError as e:
+            logger.error(f"❌ Ошибка чтения {self.log_file}: {e}")
+            return
+
+        # Недописанную последнюю строку оставляем до следующего раза
+        complete = chunk.rfind(b"\n") + 1
+        for line in chunk[:complete].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, TypeError) as e:
+                logger.warning(f"⚠️ Пропущена битая строка в {self.log_file}: {e}")
+        self._offset += complete
+
+    def add(self, message_id: str, user_id: str, is_relevant: bool, is_spam: bool = False) -> Dict:
+        """Добавляет (или заменяет) отметку пользователя для сообщения"""
+        feedback = {
+            "message_id": message_id,
+            "user_id": user_id,
+            "is_relevant": is_relevant,
+            "is_spam": is_spam,
+            "timestamp": datetime.now().isoformat()
+        }
+        with open(self.log_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(feedback, ensure_ascii=False) + "\n")
+        # Дочитываем лог: новая запись и чужие записи, появившиеся с прошлого раза
+        self.refresh(force=True)
+        return feedback
+
+    def is_marked_as_not_relevant(self, message_id: str, user_id: str) -> bool:
+        """Помечено ли сообщение как нерелевантное конкретным пользователем"""
+        self.refresh()
+        feedback = self._feedback.get((message_id, str(user_id)))
+        return feedback is not None and feedback.get("is_relevant") is False
+
+    def not_relevant_count(self, message_id: str) -> int:
+        self.refresh()
+        return self._not_relevant_count.get(message_id, 0)
+
+    def is_spam_marked(self, message_id: str) -> bool:
+        self.refresh()
+        return self._spam_count.get(message_id, 0) > 0
+
+    def all_feedback(self) -> List[Dict]:
+        """Последние отметки по всем парам (сообщение, пользователь)"""
+        self.refresh()
+        return list(self._feedback.values())
+
+
+_store: Optional[RelevanceFeedbackStore] = None
+
+
+def get_feedback_store() -> RelevanceFeedbackStore:
+    """Общий экземпляр хранилища для процесса"""
+    global _store
+    if _store is None:
+        _store = RelevanceFeedbackStore()
+    return _store
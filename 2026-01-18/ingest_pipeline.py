@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Политики переполнения очереди стадии
+OVERFLOW_BLOCK = 'block'              # ждать места: предыдущая стадия притормаживает (backpressure)
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # выбросить самый старый элемент и поставить новый
+OVERFLOW_DROP_NEW = 'drop_new'        # выбросить новый элемент
+
+
+@dataclass
+class Stage:
+    """
+    Стадия конвейера
+
+    handler получает элемент и возвращает элемент для следующей стадии
+    (или None, если элемент отфильтрован/обработан окончательно).
+    """
+    name: str
+    handler: Callable[[Any], Awaitable[Any]]
+    workers: int = 1
+    queue_size: int = 100
+    overflow: str = OVERFLOW_BLOCK
+    timeout: Optional[float] = None  # лимит обработки одного элемента (сек)
+    stats: Dict[str, float] = field(default_factory=lambda: {
+        'queued': 0, 'processed': 0, 'passed': 0, 'dropped': 0,
+        'failed': 0, 'timeouts': 0, 'busy_total': 0.0,
+    })
+
+
+class IngestPipeline:
+    """
+    Конвейер обработки входящих сообщений: стадии, связанные ограниченными очередями.
+
+    У каждой стадии свой пул воркеров, поэтому медленная стадия (например,
+    классификация через OpenAI) масштабируется отдельно и не задерживает
+    остальные. Прием сообщений (submit) никогда не ждет: при переполнении
+    первой очереди срабатывает ее политика отбрасывания. Между стадиями по
+    умолчанию действует backpressure (OVERFLOW_BLOCK) - воркер предыдущей
+    стадии ждет места, и очередь перед медленной стадией копится выше по
+    конвейеру, пока не упрется в первую.
+    """
+
+    def __init__(self, stages: List[Stage], stats_interval: float = 60.0):
+        if not stages:
+            raise ValueError("Конвейер должен содержать хотя бы одну стадию")
+        self.stages = stages
+        self.stats_interval = stats_interval
+        self._queues: List[asyncio.Queue] = []
+        self._tasks = []
+        self._last_stats_log = time.monotonic()
+
+    def start(self):
+        """Запустить воркеров всех стадий (повторный вызов ничего не делает)"""
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=max(1, stage.queue_size)) for stage in self.stages]
+        for index, stage in enumerate(self.stages):
+            for worker_id in range(max(1, stage.workers)):
+                self._tasks.append(asyncio.create_task(self._worker(index, worker_id)))
+        logger.info(
+            "🧵 Конвейер сообщений запущен: "
+            + " → ".join(f"{stage.name}[{max(1, stage.workers)}]" for stage in self.stages)
+        )
+
+    def submit(self, item: Any) -> bool:
+        """
+        Поставить элемент в первую стадию (не ждет)
+
+        Returns:
+            False, если элемент отброшен из-за переполнения
+        """
+        self.start()
+        return self._put_nowait(0, item)
+
+    def _put_nowait(self, index: int, item: Any) -> bool:
+        stage = self.stages[index]
+        queue = self._queues[index]
+        if queue.full():
+            stage.stats['dropped'] += 1
+            if stage.overflow == OVERFLOW_DROP_OLDEST:
+                logger.warning(f"⚠️ Очередь стадии {stage.name} переполнена ({queue.qsize()}), отброшено самое старое сообщение")
+                try:
+                    queue.get_nowait()
+                    queue.task_done()
+                except asyncio.QueueEmpty:
+                    pass
+            else:
+                # OVERFLOW_DROP_NEW (и OVERFLOW_BLOCK для submit - прием не должен ждать)
+                logger.warning(f"⚠️ Очередь стадии {stage.name} переполнена ({queue.qsize()}), сообщение отброшено")
+                return False
+        queue.put_nowait(item)
+        stage.stats['queued'] += 1
+        return True
+
+    async def _put(self, index: int, item: Any):
+        """Передать элемент в стадию index с учетом ее политики переполнения"""
+        stage = self.stages[index]
+        if stage.overflow == OVERFLOW_BLOCK:
+            await self._queues[index].put(item)
+            stage.stats['queued'] += 1
+        else:
+            self._put_nowait(index, item)
+
+    async def _worker(self, index: int, worker_id: int):
+        stage = self.stages[index]
+        queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            item = await queue.get()
+            started = time.monotonic()
+            try:
+                if stage.timeout:
+                    result = await asyncio.wait_for(stage.handler(item), stage.timeout)
+                else:
+                    result = await stage.handler(item)
+                stage.stats['processed'] += 1
+                if result is not None and not is_last:
+                    stage.stats['passed'] += 1
+                    await self._put(index + 1, result)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                stage.stats['timeouts'] += 1
+                logger.warning(f"⏱️ Стадия {stage.name}: обработка дольше {stage.timeout:g}с, сообщение пропущено")
+            except Exception as e:
+                stage.stats['failed'] += 1
+                logger.error(f"❌ Стадия {stage.name} (воркер {worker_id}): {e}")
+            finally:
+                stage.stats['busy_total'] += time.monotonic() - started
+                queue.task_done()
+            self._maybe_log_stats()
+
+    def get_stats(self) -> dict:
+        stats = {}
+        for index, stage in enumerate(self.stages):
+            processed = stage.stats['processed']
+            stats[stage.name] = {
+                'queue_depth': self._queues[index].qsize() if self._queues else 0,
+                'queue_size': stage.queue_size,
+                'workers': stage.workers,
+                'avg_time': round(stage.stats['busy_total'] / processed, 3) if processed else 0.0,
+                **{k: v for k, v in stage.stats.items() if k != 'busy_total'},
+            }
+        return stats
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log < self.stats_interval:
+            return
+        self._last_stats_log = now
+        logger.info(
+            "🧵 Конвейер: "
+            + ", ".join(
+                f"{name} {s['queue_depth']}/{s['queue_size']} "
+                f"(обработано {s['processed']}, отброшено {s['dropped']}, ошибок {s['failed']}, ср. {s['avg_time']}с)"
+                for name, s in self.get_stats().items()
+            )
+        )
+
+    async def close(self, drain_timeout: float = 30.0):
+        """Дообработать очереди по стадиям (не дольше drain_timeout) и остановить воркеров"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + drain_timeout
+        try:
+            for queue in self._queues:
+                await asyncio.wait_for(queue.join(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            pending = sum(queue.qsize() for queue in self._queues)
+            logger.warning(f"⚠️ Не обработано {pending} сообщений конвейера при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -7,14 +7,21 @@ from datetime import datetime
 import asyncio
 import logging
 import json
+from dataclasses import dataclass, field
 from config import API_ID, API_HASH, PHONE_NUMBER, MONITORING_CONFIG, BOT_TOKEN, DB_DSN
 from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher.filters import Command
 from aiogram.types import Message
 from database import Database
 from content import MONITORING_TOPICS
-from typing import Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set
 from ai_classifier import AIClassifier
+from niche_matcher import NicheMatcher
+from feedback_store import get_feedback_store
+from subscriber_index import SubscriberIndex
+from notification_dispatcher import NotificationDispatcher
+from ingest_pipeline import IngestPipeline
+from ttl_cache import TTLCache
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.exceptions import TelegramAPIError
 
@@ -123,6 +130,151 @@ BIKE_STRONG_KEYWORDS = {
     "adv",
 }
 
+# Информационные сообщения ботов (правила чата, инструкции)
+_INFORMATIONAL_PATTERNS = [
+    r"уважаемые\s+участники\s+чата",
+    r"наш\s+чат\s+—\s+площадка",
+    r"правила\s+публикации",
+    r"правила\s+чата",
+    r"соблюдайте.*правила",
+    r"бот.*поможет",
+    r"ботик.*помоги",
+    r"наш\s+помощник.*бот",
+    r"для\s+безопасности\s+введены\s+меры",
+    r"автоматизированная\s+модерация",
+    r"профессиональные\s+участники",
+    r"платные\s+пакеты",
+    r"бесплатных\s+тариф",
+    r"информация\s+о\s+правилах",
+]
+
+# Спам о работе
+_WORK_SPAM_PATTERNS = [
+    r"шабашк.*на\s+сейчас",
+    r"зп\s+\d+.*р.*день",
+    r"закину\s+на\s+такс",
+    r"ставь\s*\+\s*менеджер",
+    r"без\s+сложност",
+    r"шабашк.*зп",
+    r"зп.*\d+.*день.*без",
+    r"шабашк.*зп.*\d+.*р",
+]
+
+# Спам о репликах/копиях брендов
+_REPLICA_SPAM_PATTERNS = [
+    r"реплик.*lux.*бренд",
+    r"1:1\s*реплик",
+    r"копии\s*ааа",
+    r"копии\s*аа\b",
+    r"реплик.*бренд",
+    r"worldwide\s+shipping",
+    r"прямые\s+поставщики",
+    r"поиск\s+по\s+фото",
+    r"полное\s+сопровождени",
+]
+
+# Маркеры поиска/коммерции (intent)
+_INTENT_PATTERNS = [
+    # RU: поиск/потребность
+    r"ищ[уею]",
+    r"нужен",
+    r"нужна",
+    r"нужны",
+    r"требуется",
+    r"посоветуйте",
+    r"нужно",
+    r"\bхочу\b",
+    r"\bхотим\b",
+    r"хотел(а|и|ось)?",
+    r"подскажите",
+    r"где\s+найти",
+    r"кто\s+знает",
+    r"есть\s+ли",
+    r"контакт(ы)?",
+    r"как\s+связаться",
+    r"подскажите\s+контакт(ы)?",
+    r"в\s+лс",
+    r"в\s+личк",
+    r"в\s+директ",
+    # RU: коммерция
+    r"куплю",
+    r"продам",
+    r"сдам",
+    r"сниму",
+    r"аренд[ау]",
+    r"цена",
+    r"стоимость",
+    r"бюджет",
+    r"прайс",
+    r"услуг[аи]",
+    r"заказ",
+    r"обмен",
+    r"сколько\s+стоит",
+    # EN: intent/commerce
+    r"\blooking for\b",
+    r"\bneed\b",
+    r"\bwant\b",
+    r"\brent\b",
+    r"\bbuy\b",
+    r"\bsell\b",
+    r"\bprice\b",
+    r"\bcost\b",
+    r"\bbudget\b",
+    # Срочность/контакты/деньги
+    r"срочно",
+    r"сегодня",
+    r"сейчас",
+    r"\$",
+    r"\busd\b",
+    r"\bidr\b",
+    r"₽",
+]
+
+
+def _compile_any(patterns: List[str], flags: int = re.IGNORECASE) -> re.Pattern:
+    """Склеивает список паттернов в одно выражение (совпадение с любым из них)."""
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), flags)
+
+
+_INFORMATIONAL_RE = _compile_any(_INFORMATIONAL_PATTERNS)
+_WORK_SPAM_RE = _compile_any(_WORK_SPAM_PATTERNS)
+_REPLICA_SPAM_RE = _compile_any(_REPLICA_SPAM_PATTERNS)
+_REPLICA_RE = re.compile(r"реплик|копии.*аа", re.IGNORECASE)
+_DELIVERY_RE = re.compile(r"доставк|shipping", re.IGNORECASE)
+_INTENT_RE = _compile_any(_INTENT_PATTERNS)
+_FREELANCER_RE = re.compile(
+    r"фрілансер|фрилансер|переводчик|перекладач|дизайнер|таргетолог|"
+    r"оформлювати|контент|пости|каруселі|canva|instagram",
+    re.IGNORECASE,
+)
+_REAL_ESTATE_CONTEXT_RE = re.compile(r"нерухомість|недвижимость|инвестиц", re.IGNORECASE)
+_PHONE_SALE_RE = re.compile(
+    r"iphone|айфон|телефон|смартфон|продам.*\d+\s*(gb|гб|mln|млн)",
+    re.IGNORECASE,
+)
+_CAMERA_RE = re.compile(r"камер(а|ы|е|ой|у|ах)", re.IGNORECASE)
+
+
+@dataclass
+class IncomingMessage:
+    """Сообщение из чата на пути через стадии обработки (prefilter → classify → route → deliver)"""
+    message_text: str
+    chat_title: Optional[str] = None
+    message_link: Optional[str] = None
+    chat_username: Optional[str] = None
+    chat_join_link: Optional[str] = None
+    sender_username: Optional[str] = None
+    sender_id: Optional[int] = None
+    sender_first_name: Optional[str] = None
+    sender_last_name: Optional[str] = None
+    sender_is_bot: bool = False
+    # Заполняются стадиями classify и route
+    classification: Dict[str, Any] = field(default_factory=dict)
+    niches: Set[str] = field(default_factory=set)
+    subscribers: Dict[int, Set[str]] = field(default_factory=dict)
+    message_id: Optional[str] = None
+
+
 class MessageMonitor:
     def __init__(self, bot: Bot, db, openai_api_key: str = None):
         self.bot = bot
@@ -138,11 +290,25 @@ class MessageMonitor:
         self.message_cache: Dict[str, Set[int]] = {}  # Cache for processed messages
         self.subscribers: Dict[int, Set[str]] = {}  # user_id -> set of niches
         self.patterns = NICHES_KEYWORDS  # Используем NICHES_KEYWORDS вместо PATTERNS
+        # Все паттерны ниш в одном скомпилированном выражении (с перезагрузкой при изменении patterns.py)
+        self.niche_matcher = NicheMatcher()
+        # Маршрутизация ниша -> страна -> подписчики в памяти (без запросов к БД при рассылке)
+        self.subscriber_index = SubscriberIndex(db)
+        # Уведомления отправляются воркерами с учетом лимитов Bot API, не блокируя обработку сообщений
+        self.notifier = NotificationDispatcher(bot)
+        # Конвейер входящих сообщений (создается в user_monitor_bot.py, здесь - для статуса и остановки)
+        self.pipeline: Optional[IngestPipeline] = None
         self._load_topics()
         
-        # Улучшенная дедупликация сообщений
-        self.message_hashes: Dict[str, datetime] = {}  # message_hash -> timestamp
+        # Улучшенная дедупликация сообщений (TTL-кэши с LRU-лимитом, переживают перезапуск)
         self.duplicate_window = 3600  # 1 час - окно для дедупликации
+        self.message_hashes = TTLCache(
+            ttl=self.duplicate_window, persist_path="message_hashes.json", name="Дедупликация сообщений"
+        )
+        # Сообщения ботов дедуплицируются строже: только по тексту и на 24 часа
+        self.bot_message_hashes = TTLCache(
+            ttl=self.duplicate_window * 24, persist_path="bot_message_hashes.json", name="Дедупликация ботов"
+        )
         
         # AI классификатор (опционально)
         self.ai_classifier = None
@@ -214,27 +380,9 @@ class MessageMonitor:
         Проверяет, является ли сообщение дубликатом
         """
         message_hash = self._create_message_hash(message_text, sender_id)
-        current_time = datetime.now()
-        
-        # Проверяем, есть ли такой хеш в кэше
-        if message_hash in self.message_hashes:
-            # Проверяем, не устарел ли хеш
-            if (current_time - self.message_hashes[message_hash]).total_seconds() < self.duplicate_window:
-                logger.info(f"🔄 Найден дубликат сообщения от пользователя {sender_id}")
-                return True
-        
-        # Если хеша нет или он устарел, обновляем кэш
-        self.message_hashes[message_hash] = current_time
-        
-        # Очищаем старые хеши (старше 24 часов)
-        old_hashes = []
-        for hash_key, timestamp in self.message_hashes.items():
-            if (current_time - timestamp).total_seconds() > 86400:  # 24 часа
-                old_hashes.append(hash_key)
-        
-        for hash_key in old_hashes:
-            del self.message_hashes[hash_key]
-        
+        if self.message_hashes.check_and_add(message_hash):
+            logger.info(f"🔄 Найден дубликат сообщения от пользователя {sender_id}")
+            return True
         return False
 
     async def _hybrid_classify_message(self, message_text: str, sender_username: str = None) -> Dict:
@@ -259,28 +407,7 @@ class MessageMonitor:
 
         # 1.1. Проверка на информационные сообщения от ботов (правила чата, инструкции)
         text_lower = message_text.lower()
-        informational_patterns = [
-            r"уважаемые\s+участники\s+чата",
-            r"наш\s+чат\s+—\s+площадка",
-            r"правила\s+публикации",
-            r"правила\s+чата",
-            r"соблюдайте.*правила",
-            r"бот.*поможет",
-            r"ботик.*помоги",
-            r"наш\s+помощник.*бот",
-            r"для\s+безопасности\s+введены\s+меры",
-            r"автоматизированная\s+модерация",
-            r"профессиональные\s+участники",
-            r"платные\s+пакеты",
-            r"бесплатных\s+тариф",
-            r"информация\s+о\s+правилах",
-        ]
-
-        is_informational = False
-        for pattern in informational_patterns:
-            if re.search(pattern, text_lower, re.IGNORECASE):
-                is_informational = True
-                break
+        is_informational = bool(_INFORMATIONAL_RE.search(text_lower))
 
         if is_informational and sender_username:
             username_lower = sender_username.lower()
@@ -300,51 +427,23 @@ class MessageMonitor:
         text = text_lower
 
         # 1.2. Спам о работе (до паттернов/AI)
-        work_spam_patterns = [
-            r"шабашк.*на\s+сейчас",
-            r"зп\s+\d+.*р.*день",
-            r"закину\s+на\s+такс",
-            r"ставь\s*\+\s*менеджер",
-            r"без\s+сложност",
-            r"шабашк.*зп",
-            r"зп.*\d+.*день.*без",
-            r"шабашк.*зп.*\d+.*р",
-        ]
-
-        for pattern in work_spam_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                logger.info(f"🚫 Спам о работе обнаружен: {pattern}")
-                return {
-                    "message_type": "СПАМ",
-                    "is_spam": True,
-                    "niches": [],
-                    "context": "Спам о работе",
-                    "urgency": "не срочно",
-                    "budget": "",
-                    "confidence": 95,
-                    "reason": "Спам о работе (шабашка, зп, такси)",
-                }
+        work_spam_match = _WORK_SPAM_RE.search(text)
+        if work_spam_match:
+            logger.info(f"🚫 Спам о работе обнаружен: {work_spam_match.group(0)[:50]}")
+            return {
+                "message_type": "СПАМ",
+                "is_spam": True,
+                "niches": [],
+                "context": "Спам о работе",
+                "urgency": "не срочно",
+                "budget": "",
+                "confidence": 95,
+                "reason": "Спам о работе (шабашка, зп, такси)",
+            }
 
         # 1.3. Спам о репликах/копиях брендов (до паттернов/AI)
-        replica_spam_patterns = [
-            r"реплик.*lux.*бренд",
-            r"1:1\s*реплик",
-            r"копии\s*ааа",
-            r"копии\s*аа\b",
-            r"реплик.*бренд",
-            r"worldwide\s+shipping",
-            r"прямые\s+поставщики",
-            r"поиск\s+по\s+фото",
-            r"полное\s+сопровождени",
-        ]
-
-        has_replica_keywords = any(
-            re.search(pattern, text, re.IGNORECASE) for pattern in replica_spam_patterns
-        )
-        has_replica_and_delivery = bool(
-            re.search(r"реплик|копии.*аа", text, re.IGNORECASE)
-            and re.search(r"доставк|shipping", text, re.IGNORECASE)
-        )
+        has_replica_keywords = bool(_REPLICA_SPAM_RE.search(text))
+        has_replica_and_delivery = bool(_REPLICA_RE.search(text) and _DELIVERY_RE.search(text))
 
         if has_replica_keywords or has_replica_and_delivery:
             logger.info("🚫 Спам о репликах/копиях брендов обнаружен")
@@ -359,28 +458,18 @@ class MessageMonitor:
                 "reason": "Спам о репликах/копиях брендов (не транспорт)",
             }
 
-        # 2. PRE-FILTER: паттерны (бесплатно)
-        found_niches = set()
-        for niche, patterns in self.patterns.items():
-            for pattern in patterns:
-                try:
-                    if re.search(pattern, text):
-                        if niche == "Продажа недвижимости" and self._is_freelancer_context(text):
-                            logger.info(
-                                f"🔍 Пропускаем нишу '{niche}' - это поиск фрилансера, а не недвижимости"
-                            )
-                            continue
-                        if niche == "Фотограф" and self._is_phone_sale_context(text):
-                            logger.info(
-                                f"🔍 Пропускаем нишу '{niche}' - это продажа телефона, а не поиск фотографа"
-                            )
-                            continue
-                        found_niches.add(niche)
-                        break
-                except Exception as e:
-                    logger.error(
-                        f"❌ Ошибка при проверке паттерна '{pattern}' для ниши '{niche}': {e}"
-                    )
+        # 2. PRE-FILTER: паттерны (бесплатно, один проход по тексту)
+        found_niches = self.niche_matcher.find_niches(text)
+        if "Продажа недвижимости" in found_niches and self._is_freelancer_context(text):
+            logger.info(
+                "🔍 Пропускаем нишу 'Продажа недвижимости' - это поиск фрилансера, а не недвижимости"
+            )
+            found_niches.discard("Продажа недвижимости")
+        if "Фотограф" in found_niches and self._is_phone_sale_context(text):
+            logger.info(
+                "🔍 Пропускаем нишу 'Фотограф' - это продажа телефона, а не поиск фотографа"
+            )
+            found_niches.discard("Фотограф")
 
         if found_niches:
             found_niches = self._filter_real_estate_niches_by_negative_keywords(
@@ -415,63 +504,7 @@ class MessageMonitor:
             }
 
         # 3. INTENT FILTER (бесплатно)
-        intent_keywords = [
-            # RU: поиск/потребность
-            r"ищ[уею]",
-            r"нужен",
-            r"нужна",
-            r"нужны",
-            r"требуется",
-            r"посоветуйте",
-            r"нужно",
-            r"\bхочу\b",
-            r"\bхотим\b",
-            r"хотел(а|и|ось)?",
-            r"подскажите",
-            r"где\s+найти",
-            r"кто\s+знает",
-            r"есть\s+ли",
-            r"контакт(ы)?",
-            r"как\s+связаться",
-            r"подскажите\s+контакт(ы)?",
-            r"в\s+лс",
-            r"в\s+личк",
-            r"в\s+директ",
-            # RU: коммерция
-            r"куплю",
-            r"продам",
-            r"сдам",
-            r"сниму",
-            r"аренд[ау]",
-            r"цена",
-            r"стоимость",
-            r"бюджет",
-            r"прайс",
-            r"услуг[аи]",
-            r"заказ",
-            r"обмен",
-            r"сколько\s+стоит",
-            # EN: intent/commerce
-            r"\blooking for\b",
-            r"\bneed\b",
-            r"\bwant\b",
-            r"\brent\b",
-            r"\bbuy\b",
-            r"\bsell\b",
-            r"\bprice\b",
-            r"\bcost\b",
-            r"\bbudget\b",
-            # Срочность/контакты/деньги
-            r"срочно",
-            r"сегодня",
-            r"сейчас",
-            r"\$",
-            r"\busd\b",
-            r"\bidr\b",
-            r"₽",
-        ]
-
-        has_intent = any(re.search(kw, text, re.IGNORECASE) for kw in intent_keywords)
+        has_intent = bool(_INTENT_RE.search(text))
         if not has_intent:
             return {
                 "message_type": "ОБЩЕНИЕ",
@@ -524,27 +557,16 @@ class MessageMonitor:
         """
         Признаки поиска фрилансера/исполнителя в контексте тематики (не поиск недвижимости).
         """
-        is_freelancer_search = re.search(
-            r"фрілансер|фрилансер|переводчик|перекладач|дизайнер|таргетолог|"
-            r"оформлювати|контент|пости|каруселі|canva|instagram",
-            text_lower,
-            re.IGNORECASE,
-        )
-        has_real_estate_in_context = re.search(
-            r"нерухомість|недвижимость|инвестиц", text_lower, re.IGNORECASE
-        )
+        is_freelancer_search = _FREELANCER_RE.search(text_lower)
+        has_real_estate_in_context = _REAL_ESTATE_CONTEXT_RE.search(text_lower)
         return bool(is_freelancer_search and has_real_estate_in_context)
 
     def _is_phone_sale_context(self, text_lower: str) -> bool:
         """
         Продажа телефона/техники с упоминанием камеры (не запрос фотографа).
         """
-        is_phone_sale = re.search(
-            r"iphone|айфон|телефон|смартфон|продам.*\d+\s*(gb|гб|mln|млн)",
-            text_lower,
-            re.IGNORECASE,
-        )
-        has_camera = re.search(r"камер(а|ы|е|ой|у|ах)", text_lower, re.IGNORECASE)
+        is_phone_sale = _PHONE_SALE_RE.search(text_lower)
+        has_camera = _CAMERA_RE.search(text_lower)
         return bool(is_phone_sale and has_camera)
 
     def _load_topics(self):
@@ -586,15 +608,9 @@ class MessageMonitor:
         found_niches = set()
 
         # Поиск по паттернам
-        for niche, patterns in self.patterns.items():
-            for pattern in patterns:
-                try:
-                    if re.search(pattern, text):
-                        found_niches.add(niche)
-                        logger.info(f"✅ Найдена ниша: {niche}")
-                        break
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при проверке паттерна '{pattern}' для ниши '{niche}': {e}")
+        found_niches = self.niche_matcher.find_niches(text)
+        for niche in found_niches:
+            logger.info(f"✅ Найдена ниша: {niche}")
 
         if not found_niches:
             logger.info("❌ Категории не найдены, сообщение не будет разослано")
@@ -1178,6 +1194,7 @@ class MessageMonitor:
             niches = await self.db.get_user_niches(user_id)
             self.subscribers[user_id] = set(niches)
         logger.info(f"Загружено {len(self.subscribers)} подписчиков")
+        await self.subscriber_index.start()
         await self.update_user_data()
         await self.update_user_keywords()
         logger.info("=== Монитор успешно инициализирован ===")
@@ -1187,8 +1204,10 @@ class MessageMonitor:
         return {
             "active_subscribers": len(self.subscribers),
             "monitored_topics": list(self.topic_keywords.keys()),
-            "active_patterns": len(self.patterns),
+            "active_patterns": len(self.niche_matcher.niches_keywords),
             "message_cache_size": len(self.message_cache),
+            "notifications": self.notifier.get_stats(),
+            "pipeline": self.pipeline.get_stats() if self.pipeline else None,
             "is_initialized": bool(self.subscribers)
         }
 
@@ -1218,25 +1237,49 @@ class MessageMonitor:
         sender_last_name: str = None,
         sender_is_bot: bool = False,
     ):
-        """Обработка сообщения, полученного от подписчика"""
+        """Обработка сообщения, полученного от подписчика (все стадии последовательно)"""
+        lead = IncomingMessage(
+            message_text=message_text,
+            chat_title=chat_title,
+            message_link=message_link,
+            chat_username=chat_username,
+            chat_join_link=chat_join_link,
+            sender_username=sender_username,
+            sender_id=sender_id,
+            sender_first_name=sender_first_name,
+            sender_last_name=sender_last_name,
+            sender_is_bot=sender_is_bot,
+        )
+        if not self.prefilter_message(lead):
+            return
+        if not await self.classify_message(lead):
+            return
+        if not await self.route_message(lead):
+            return
+        self.deliver_message(lead)
+
+    def prefilter_message(self, lead: IncomingMessage) -> bool:
+        """Стадия prefilter: дешевые проверки без сети (боты, стоп-фразы, дубликаты)"""
+        message_text = lead.message_text
+        sender_username = lead.sender_username
         if not message_text:
             logger.warning("❌ Пустое сообщение, пропускаем")
-            return
+            return False
 
         logger.info("=== Начало обработки сообщения ===")
         logger.info(f"📝 Текст сообщения: {message_text[:100]}...")
-        logger.info(f"💬 Чат: {chat_title}")
-        logger.info(f"👤 Отправитель: {sender_username} (ID: {sender_id})")
+        logger.info(f"💬 Чат: {lead.chat_title}")
+        logger.info(f"👤 Отправитель: {sender_username} (ID: {lead.sender_id})")
 
         # 0) Проверка is_bot: сообщения от ботов игнорируем сразу (приветствия/админ-боты)
-        if sender_is_bot:
+        if lead.sender_is_bot:
             logger.info("🚫 Сообщение от бота (sender_is_bot=True), пропускаем")
-            return
+            return False
 
         # 0.1) Стоп-фразы приветствий/вступления
         if any(phrase in message_text.lower() for phrase in STOP_PHRASES):
             logger.info("🚫 Сообщение содержит стоп-фразу (приветствие/бот), пропускаем")
-            return
+            return False
 
         # Проверка на ботов-отправителей (блокируем повторяющиеся сообщения от ботов)
         if sender_username:
@@ -1245,41 +1288,42 @@ class MessageMonitor:
             if 'bot' in username_lower or 'informant' in username_lower or 'keeper' in username_lower or 'hunter' in username_lower:
                 # Для ботов используем более строгую дедупликацию (только по тексту, без sender_id)
                 bot_message_hash = self._create_message_hash(message_text, 0)
-                if bot_message_hash in self.message_hashes:
-                    current_time = datetime.now()
-                    if (current_time - self.message_hashes[bot_message_hash]).total_seconds() < self.duplicate_window * 24:  # 24 часа для ботов
-                        logger.info(f"🔄 Сообщение от бота {sender_username} уже было обработано ранее (дедупликация ботов)")
-                        return
-                self.message_hashes[bot_message_hash] = datetime.now()
+                if self.bot_message_hashes.check_and_add(bot_message_hash):  # 24 часа для ботов
+                    logger.info(f"🔄 Сообщение от бота {sender_username} уже было обработано ранее (дедупликация ботов)")
+                    return False
 
         # Проверяем на дубликаты с улучшенной логикой
-        if self._is_duplicate_message(message_text, sender_id):
-            logger.info(f"🔄 Сообщение от пользователя {sender_id} уже было обработано ранее")
-            return
+        if self._is_duplicate_message(message_text, lead.sender_id):
+            logger.info(f"🔄 Сообщение от пользователя {lead.sender_id} уже было обработано ранее")
+            return False
+        return True
 
+    async def classify_message(self, lead: IncomingMessage) -> bool:
+        """Стадия classify: гибридная классификация, отсев спама и сообщений без ниш"""
         # Гибридная классификация сообщения
-        classification_result = await self._hybrid_classify_message(message_text, sender_username)
+        classification_result = await self._hybrid_classify_message(lead.message_text, lead.sender_username)
 
         # Проверка на спам
         if classification_result.get('is_spam', False):
             logger.info(f"🚫 Сообщение отфильтровано как спам: {classification_result.get('reason', 'Неизвестная причина')}")
-            return
-
-        # Получаем найденные ниши и дополнительную информацию
-        found_niches = set(classification_result.get('niches', []))
-        confidence = classification_result.get('confidence', 0)
-        reason = classification_result.get('reason', 'Неизвестная причина')
-        message_type = classification_result.get('message_type', 'ОБЩЕНИЕ')
-        context = classification_result.get('context', '')
-        urgency = classification_result.get('urgency', 'не срочно')
-        budget = classification_result.get('budget', '')
+            return False
 
-        if not found_niches:
+        lead.classification = classification_result
+        lead.niches = set(classification_result.get('niches', []))
+        if not lead.niches:
             logger.info("❌ Категории не найдены, сообщение не будет разослано")
-            return
+            return False
 
-        logger.info(f"📊 Найдено ниш: {found_niches} (тип: {message_type}, уверенность: {confidence}%, причина: {reason})")
-        
+        logger.info(
+            f"📊 Найдено ниш: {lead.niches} (тип: {classification_result.get('message_type', 'ОБЩЕНИЕ')}, "
+            f"уверенность: {classification_result.get('confidence', 0)}%, "
+            f"причина: {classification_result.get('reason', 'Неизвестная причина')})"
+        )
+        return True
+
+    async def route_message(self, lead: IncomingMessage) -> bool:
+        """Стадия route: страна чата, подписчики ниш и глобальная блокировка"""
+        chat_title = lead.chat_title
         # Определяем страну чата по названию чата
         chat_country = self._get_country_from_chat_title(chat_title) if chat_title else None
         if chat_country:
@@ -1289,54 +1333,50 @@ class MessageMonitor:
             chat_country = "Бали"
             logger.info(f"🌍 Страна не определена по названию чата, используем 'Бали' по умолчанию")
         
-        # Получаем всех подписчиков для найденных ниш с учетом страны
-        all_subscribers = set()
-        for niche in found_niches:
-            subscribers = await self.db.get_subscribers_for_niche(niche, country=chat_country)
-            logger.info(f"👥 Найдено {len(subscribers)} подписчиков для ниши '{niche}'" + (f" и страны '{chat_country}'" if chat_country else "") + f": {subscribers}")
-            all_subscribers.update(subscribers)
+        # Получаем всех подписчиков для найденных ниш с учетом страны (user_id -> общие ниши)
+        all_subscribers = await self.subscriber_index.resolve(lead.niches, chat_country)
         
         if not all_subscribers:
             logger.info("❌ Подписчики не найдены, сообщение не будет разослано")
-            return
+            return False
+
+        logger.info(f"👥 Всего найдено {len(all_subscribers)} уникальных подписчиков" + (f" для страны '{chat_country}'" if chat_country else "") + f": {list(all_subscribers)}")
 
-        logger.info(f"👥 Всего найдено {len(all_subscribers)} уникальных подписчиков: {all_subscribers}")
-        
-        # Формируем информацию об отправителе
-        sender_info = ""
-        if sender_first_name or sender_last_name:
-            full_name = f"{sender_first_name or ''} {sender_last_name or ''}".strip()
-            sender_info = f"👤 {full_name}"
-            if sender_username:
-                sender_info += f" (@{sender_username})"
-        elif sender_username:
-            sender_info = f"👤 @{sender_username}"
-        
         # Создаем уникальный ID для сообщения для кнопок
-        message_id = self._create_message_hash(message_text, sender_id or 0)
+        message_id = self._create_message_hash(lead.message_text, lead.sender_id or 0)
         
         # Проверяем глобальную блокировку (если сообщение помечено как спам или нерелевантное несколько раз)
         if self._is_message_globally_blocked(message_id):
             logger.warning(f"🚫 Сообщение {message_id} заблокировано глобально, не отправляем никому")
-            return
+            return False
+
+        lead.subscribers = all_subscribers
+        lead.message_id = message_id
+        return True
+
+    def deliver_message(self, lead: IncomingMessage):
+        """Стадия deliver: уведомления с кнопками в очередь диспетчера"""
+        message_text = lead.message_text
+        message_id = lead.message_id
+        message_type = lead.classification.get('message_type', 'ОБЩЕНИЕ')
+        context = lead.classification.get('context', '')
+        urgency = lead.classification.get('urgency', 'не срочно')
+        budget = lead.classification.get('budget', '')
+
+        # Формируем информацию об отправителе
+        sender_info = ""
+        if lead.sender_first_name or lead.sender_last_name:
+            full_name = f"{lead.sender_first_name or ''} {lead.sender_last_name or ''}".strip()
+            sender_info = f"👤 {full_name}"
+            if lead.sender_username:
+                sender_info += f" (@{lead.sender_username})"
+        elif lead.sender_username:
+            sender_info = f"👤 @{lead.sender_username}"
         
         # Рассылка всем подписчикам найденных ниш
-        for user_id in all_subscribers:
+        for user_id, common_niches in lead.subscribers.items():
             try:
-                user = await self.db.get_user(user_id)
-                if not user:
-                    logger.warning(f"⚠️ Пользователь {user_id} не найден в базе")
-                    continue
-
-                # Получаем ниши пользователя для логирования
-                user_niches = await self.db.get_user_niches(user_id)
-                logger.info(f"📋 Пользователь {user_id} подписан на ниши: {user_niches}")
-
-                # Проверяем, есть ли пересечение ниш
-                common_niches = set(n.lower() for n in user_niches) & set(n.lower() for n in found_niches)
-                if not common_niches:
-                    logger.info(f"⚠️ У пользователя {user_id} нет общих ниш с найденными")
-                    continue
+                logger.info(f"📋 Пользователь {user_id}, общие ниши: {common_niches}")
 
                 # Проверяем, не был ли этот message_id помечен как нерелевантный для этого пользователя
                 if self._is_message_marked_as_not_relevant(message_id, str(user_id)):
@@ -1389,21 +1429,21 @@ class MessageMonitor:
                     notification += f"{self._escape_html(sender_info)}\n\n"
                 
                 notification += (
-                    f"💬 <b>Чат:</b> {self._escape_html(chat_title or 'Неизвестный чат')}"
+                    f"💬 <b>Чат:</b> {self._escape_html(lead.chat_title or 'Неизвестный чат')}"
                 )
                 
-                if message_link:
-                    safe_link = self._escape_html(message_link)
+                if lead.message_link:
+                    safe_link = self._escape_html(lead.message_link)
                     notification += f"\n🔗 <b>Ссылка:</b> <a href=\"{safe_link}\">{safe_link}</a>"
 
                 # Если ссылка на чат доступна (для приватных/неочевидных чатов) — добавляем
-                if chat_join_link:
-                    safe_join = self._escape_html(chat_join_link)
+                if lead.chat_join_link:
+                    safe_join = self._escape_html(lead.chat_join_link)
                     notification += (
                         f"\n🔑 <b>Вступить в чат:</b> <a href=\"{safe_join}\">{safe_join}</a>"
                     )
-                elif chat_username:
-                    safe_chat_un = self._escape_html(chat_username)
+                elif lead.chat_username:
+                    safe_chat_un = self._escape_html(lead.chat_username)
                     notification += f"\n👥 <b>Чат:</b> @{safe_chat_un}"
 
                 # Создаем кнопки для оценки релевантности
@@ -1423,33 +1463,49 @@ class MessageMonitor:
                     InlineKeyboardButton("🔧 Исправить классификацию", callback_data=f"correct_{message_id}_{user_id}")
                 )
 
-                await self.bot.send_message(
-                    user_id, 
-                    notification, 
+                # Ставим в очередь отправки; глобальная блокировка перепроверяется перед самой отправкой
+                self.notifier.submit(
+                    user_id,
+                    notification,
+                    dedup_key=message_id,
+                    skip_if=lambda: self._is_message_globally_blocked(message_id),
                     parse_mode="HTML",
                     reply_markup=keyboard
                 )
-                logger.info(f"✅ Уведомление с кнопками отправлено пользователю {user_id}")
+                logger.info(f"📮 Уведомление с кнопками поставлено в очередь для пользователя {user_id}")
                 
             except Exception as e:
                 logger.error(f"❌ Ошибка отправки уведомления пользователю {user_id}: {e}")
         
+        logger.info(f"📮 В очереди уведомлений: {self.notifier.queue_depth}")
         logger.info("=== Обработка сообщения завершена ===")
 
     async def cleanup(self):
         """Очищает ресурсы при завершении работы"""
         try:
+            # Сначала дообрабатываем уже принятые сообщения (их уведомления попадут в очередь ниже)
+            if self.pipeline:
+                await self.pipeline.close()
+
+            # Останавливаем LISTEN-соединение и обновление индекса подписчиков
+            await self.subscriber_index.close()
+
             # Очищаем все очереди и кэши
             self.message_queue.clear()
             self.message_cache.clear()
-            self.message_hashes.clear()  # Очищаем хеши сообщений
+            # Сохраняем хеши сообщений, чтобы дубликаты ловились после перезапуска
+            self.message_hashes.save()
+            self.bot_message_hashes.save()
             self.user_keywords.clear()
             self.topic_keywords.clear()
             self.user_topics.clear()
             self.user_settings.clear()
             self.subscribers.clear()
             
-            # Очищаем AI классификатор
+            # Досылаем уведомления из очереди и останавливаем воркеров
+            await self.notifier.close()
+            
+            # Очищаем только кэш AI классификатора в памяти (сохраненный в БД переживает рестарт)
             if self.ai_classifier:
                 self.ai_classifier.clear_cache()
             
@@ -1596,21 +1652,9 @@ class MessageMonitor:
         Проверяет, был ли message_id помечен как нерелевантный для конкретного пользователя
         """
         try:
-            feedback_file = "relevance_feedback.json"
-            try:
-                with open(feedback_file, 'r', encoding='utf-8') as f:
-                    feedbacks = json.load(f)
-            except FileNotFoundError:
-                return False
-            
-            # Проверяем, есть ли запись с этим message_id и user_id, где is_relevant = False
-            for feedback in feedbacks:
-                if (feedback.get("message_id") == message_id and 
-                    feedback.get("user_id") == str(user_id) and 
-                    feedback.get("is_relevant") == False):
-                    logger.info(f"🚫 Сообщение {message_id} помечено как нерелевантное для пользователя {user_id}")
-                    return True
-            
+            if get_feedback_store().is_marked_as_not_relevant(message_id, user_id):
+                logger.info(f"🚫 Сообщение {message_id} помечено как нерелевантное для пользователя {user_id}")
+                return True
             return False
         except Exception as e:
             logger.error(f"❌ Ошибка проверки релевантности сообщения: {e}")
@@ -1628,81 +1672,33 @@ class MessageMonitor:
             True если сообщение заблокировано глобально, False иначе
         """
         try:
-            feedback_file = "relevance_feedback.json"
-            try:
-                with open(feedback_file, 'r', encoding='utf-8') as f:
-                    feedbacks = json.load(f)
-            except FileNotFoundError:
-                return False
-            
-            # Подсчитываем количество отметок "не релевантно" для этого сообщения
-            not_relevant_count = 0
-            is_spam_marked = False
-            
-            for feedback in feedbacks:
-                if feedback.get("message_id") == message_id:
-                    if feedback.get("is_relevant") == False:
-                        not_relevant_count += 1
-                    # Проверяем, помечено ли как спам
-                    if feedback.get("is_spam", False):
-                        is_spam_marked = True
-            
+            store = get_feedback_store()
+        
             # Если помечено как спам или превышен порог, блокируем глобально
-            if is_spam_marked:
+            if store.is_spam_marked(message_id):
                 logger.info(f"🚫 Сообщение {message_id} заблокировано глобально (помечено как спам)")
                 return True
-            
+        
+            not_relevant_count = store.not_relevant_count(message_id)
             if not_relevant_count >= spam_threshold:
                 logger.info(f"🚫 Сообщение {message_id} заблокировано глобально ({not_relevant_count} отметок 'не релевантно')")
                 return True
-            
+        
             return False
         except Exception as e:
             logger.error(f"❌ Ошибка проверки глобальной блокировки сообщения: {e}")
             return False
 
     async def save_relevance_feedback(self, message_id: str, user_id: str, is_relevant: bool, is_spam: bool = False):
-        """Сохраняет обратную связь о релевантности"""
+        """Сохраняет обратную связь о релевантности (append-only лог, см. feedback_store.py)"""
         try:
-            # Здесь можно сохранить в базу данных или файл
-            feedback_data = {
-                "message_id": message_id,
-                "user_id": user_id,
-                "is_relevant": is_relevant,
-                "is_spam": is_spam,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            # Сохраняем в файл для простоты (можно заменить на базу данных)
-            feedback_file = "relevance_feedback.json"
-            try:
-                with open(feedback_file, 'r', encoding='utf-8') as f:
-                    feedbacks = json.load(f)
-            except FileNotFoundError:
-                feedbacks = []
-            
-            # Проверяем, нет ли уже такой записи (чтобы не дублировать)
-            existing = False
-            for i, fb in enumerate(feedbacks):
-                if (fb.get("message_id") == message_id and 
-                    fb.get("user_id") == str(user_id)):
-                    # Обновляем существующую запись
-                    feedbacks[i] = feedback_data
-                    existing = True
-                    break
-            
-            if not existing:
-                feedbacks.append(feedback_data)
-            
-            with open(feedback_file, 'w', encoding='utf-8') as f:
-                json.dump(feedbacks, f, ensure_ascii=False, indent=2)
-            
+            feedback_data = get_feedback_store().add(message_id, user_id, is_relevant, is_spam)
             logger.info(f"💾 Сохранена обратная связь: {feedback_data}")
-            
+        
             # Если сообщение помечено как спам, логируем это
             if is_spam:
                 logger.warning(f"🚫 Сообщение {message_id} помечено как СПАМ пользователем {user_id}")
-            
+        
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения обратной связи: {e}")
 
@@ -0,0 +1,145 @@
+import importlib
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import patterns
+
+logger = logging.getLogger(__name__)
+
+# Паттерны с обратными ссылками нельзя склеивать: номера групп сдвинутся
+_BACKREFERENCE_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class NicheMatcher:
+    """
+    Скомпилированный матчер ниш по NICHES_KEYWORDS.
+
+    Все паттерны склеены в одно регулярное выражение с именованной группой
+    на каждый паттерн (группа -> ниша), поэтому сообщение без ниш проверяется
+    одним проходом по тексту. Если что-то нашлось, остальные ниши проверяются
+    своими склеенными выражениями только с позиции первого совпадения.
+
+    Если словарь паттернов не передан явно, он берётся из patterns.py
+    и перекомпилируется при изменении файла (проверка не чаще reload_interval).
+    """
+
+    def __init__(self, niches_keywords: Optional[Dict[str, List[str]]] = None, reload_interval: float = 30.0):
+        self._hot_reload = niches_keywords is None
+        self.reload_interval = reload_interval
+        self._patterns_file = getattr(patterns, "__file__", None)
+        self._patterns_mtime = self._get_patterns_mtime()
+        self._last_reload_check = time.monotonic()
+
+        self.niches_keywords: Dict[str, List[str]] = {}
+        self._combined: Optional[re.Pattern] = None
+        self._group_niche: Dict[str, str] = {}
+        self._niche_regexes: Dict[str, re.Pattern] = {}
+        self._standalone: List[Tuple[str, re.Pattern]] = []
+        self._compile(niches_keywords if niches_keywords is not None else patterns.NICHES_KEYWORDS)
+
+    def _get_patterns_mtime(self) -> Optional[float]:
+        if not self._patterns_file:
+            return None
+        try:
+            return os.path.getmtime(self._patterns_file)
+        except OSError:
+            return None
+
+    def _compile(self, niches_keywords: Dict[str, List[str]]):
+        """Компилирует паттерны всех ниш (невалидные паттерны пропускаются с ошибкой в логе)"""
+        alternatives = []
+        group_niche = {}
+        niche_alternatives: Dict[str, List[str]] = {}
+        standalone = []
+
+        for niche_idx, (niche, niche_patterns) in enumerate(niches_keywords.items()):
+            for pattern_idx, pattern in enumerate(niche_patterns):
+                try:
+                    compiled = re.compile(pattern)
+                except re.error as e:
+                    logger.error(f"❌ Ошибка в паттерне '{pattern}' для ниши '{niche}': {e}")
+                    continue
+
+                if _BACKREFERENCE_RE.search(pattern):
+                    standalone.append((niche, compiled))
+                    continue
+
+                group_name = f"n{niche_idx}_{pattern_idx}"
+                try:
+                    re.compile(f"(?P<{group_name}>(?:{pattern}))")
+                except re.error:
+                    # Например, глобальные флаги (?i) не в начале выражения
+                    standalone.append((niche, compiled))
+                    continue
+
+                alternatives.append(f"(?P<{group_name}>(?:{pattern}))")
+                group_niche[group_name] = niche
+                niche_alternatives.setdefault(niche, []).append(f"(?:{pattern})")
+
+        self._combined = re.compile("|".join(alternatives)) if alternatives else None
+        self._group_niche = group_niche
+        self._niche_regexes = {
+            niche: re.compile("|".join(parts)) for niche, parts in niche_alternatives.items()
+        }
+        self._standalone = standalone
+        self.niches_keywords = niches_keywords
+
+        logger.info(
+            f"🧩 NicheMatcher: {len(group_niche)} паттернов для {len(niches_keywords)} ниш скомпилированы"
+            + (f", {len(standalone)} отдельно" if standalone else "")
+        )
+
+    def maybe_reload(self) -> bool:
+        """Перекомпилирует паттерны, если patterns.py изменился. Возвращает True при перезагрузке."""
+        if not self._hot_reload:
+            return False
+
+        now = time.monotonic()
+        if now - self._last_reload_check < self.reload_interval:
+            return False
+        self._last_reload_check = now
+
+        mtime = self._get_patterns_mtime()
+        if mtime is None or mtime == self._patterns_mtime:
+            return False
+
+        try:
+            reloaded = importlib.reload(patterns)
+            self._compile(reloaded.NICHES_KEYWORDS)
+        except Exception as e:
+            # Оставляем старые паттерны, попробуем снова при следующем изменении файла
+            logger.error(f"❌ Не удалось перезагрузить patterns.py: {e}")
+            self._patterns_mtime = mtime
+            return False
+
+        self._patterns_mtime = mtime
+        logger.info("🔄 patterns.py изменился, паттерны ниш перекомпилированы")
+        return True
+
+    def find_niches(self, text: str) -> Set[str]:
+        """
+        Возвращает ниши, у которых хотя бы один паттерн совпал с текстом.
+
+        Результат совпадает с поочерёдным re.search по каждому паттерну.
+        """
+        self.maybe_reload()
+
+        found = set()
+        if self._combined is not None:
+            match = self._combined.search(text)
+            if match:
+                found.add(self._group_niche[match.lastgroup])
+                # Левее match.start() не совпадает ни один паттерн - начинаем с него
+                start = match.start()
+                for niche, regex in self._niche_regexes.items():
+                    if niche not in found and regex.search(text, start):
+                        found.add(niche)
+
+        for niche, regex in self._standalone:
+            if niche not in found and regex.search(text):
+                found.add(niche)
+
+        return found
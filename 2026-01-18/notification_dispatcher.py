@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Optional, Set
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    CantInitiateConversation,
+    ChatNotFound,
+    RetryAfter,
+    TelegramAPIError,
+    Unauthorized,
+    UserDeactivated,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых повторять отправку этому пользователю бессмысленно
+PERMANENT_ERRORS = (BotBlocked, CantInitiateConversation, ChatNotFound, Unauthorized, UserDeactivated)
+
+
+@dataclass
+class _Notification:
+    chat_id: int
+    text: str
+    kwargs: Dict
+    dedup_key: Optional[str] = None
+    skip_if: Optional[Callable[[], bool]] = None
+    created_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class NotificationDispatcher:
+    """
+    Очередь исходящих уведомлений бота с пулом воркеров.
+
+    Монитор только ставит уведомление в очередь и сразу переходит к следующему
+    сообщению, а воркеры отправляют с учетом лимитов Bot API: общий темп
+    (global_rate сообщений в секунду) и не чаще одного сообщения в чат
+    за per_chat_interval. RetryAfter откладывает только свой чат, остальные
+    чаты продолжают получать уведомления.
+
+    Повторные уведомления с тем же dedup_key для чата, пока первое ещё в очереди,
+    схлопываются в одно.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 4,
+        global_rate: float = 25.0,
+        per_chat_interval: float = 1.0,
+        max_retries: int = 3,
+        max_queue: int = 10000,
+        stats_interval: float = 60.0,
+    ):
+        self.bot = bot
+        self.workers = max(1, workers)
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.stats_interval = stats_interval
+
+        self._pending: Dict[int, Deque[_Notification]] = {}  # chat_id -> очередь чата
+        self._dedup: Set[tuple] = set()                       # (chat_id, dedup_key) в очереди
+        self._chat_ready_at: Dict[int, float] = {}
+        self._scheduled: Set[int] = set()                     # чаты в _ready или ожидающие паузы
+        self._active: Set[int] = set()                        # чаты, которые сейчас отправляет воркер
+        self._ready: Optional[asyncio.Queue] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._rate_lock: Optional[asyncio.Lock] = None
+        self._next_slot = 0.0
+        self._depth = 0
+        self._last_stats_log = time.monotonic()
+
+        self.stats = {
+            'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'coalesced': 0,
+            'skipped': 0, 'dropped': 0, 'latency_total': 0.0, 'latency_max': 0.0,
+        }
+
+    def start(self):
+        """Запустить воркеров (повторный вызов ничего не делает)"""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._rate_lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"📮 Диспетчер уведомлений запущен: {self.workers} воркеров, до {self.global_rate:g} сообщений/сек")
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        dedup_key: Optional[str] = None,
+        skip_if: Optional[Callable[[], bool]] = None,
+        **kwargs
+    ) -> bool:
+        """
+        Поставить уведомление в очередь (не ждет отправки)
+
+        Args:
+            chat_id: Получатель
+            text: Текст уведомления
+            dedup_key: Ключ схлопывания повторов (например, ID исходного сообщения)
+            skip_if: Проверка перед самой отправкой - если вернула True, уведомление не отправляется
+            **kwargs: Параметры bot.send_message (parse_mode, reply_markup, ...)
+
+        Returns:
+            False, если уведомление схлопнуто с уже стоящим в очереди или очередь переполнена
+        """
+        self.start()
+
+        if dedup_key is not None:
+            key = (chat_id, dedup_key)
+            if key in self._dedup:
+                self.stats['coalesced'] += 1
+                return False
+        if self._depth >= self.max_queue:
+            self.stats['dropped'] += 1
+            logger.warning(f"⚠️ Очередь уведомлений переполнена ({self._depth}), уведомление для {chat_id} отброшено")
+            return False
+
+        if dedup_key is not None:
+            self._dedup.add((chat_id, dedup_key))
+        self._pending.setdefault(chat_id, deque()).append(
+            _Notification(chat_id, text, kwargs, dedup_key=dedup_key, skip_if=skip_if)
+        )
+        self._depth += 1
+        self._idle.clear()
+        self.stats['queued'] += 1
+        self._schedule(chat_id)
+        return True
+
+    def _schedule(self, chat_id: int):
+        """Поставить чат в очередь воркеров (с учетом его паузы)"""
+        if chat_id in self._scheduled or chat_id in self._active:
+            return
+        self._scheduled.add(chat_id)
+        delay = self._chat_ready_at.get(chat_id, 0.0) - time.monotonic()
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    async def _wait_global_slot(self):
+        """Общий лимит отправки: не больше global_rate сообщений в секунду"""
+        async with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.global_rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _finish(self, job: _Notification):
+        if job.dedup_key is not None:
+            self._dedup.discard((job.chat_id, job.dedup_key))
+        self._depth -= 1
+        if self._depth == 0:
+            self._idle.set()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            chat_id = await self._ready.get()
+            self._scheduled.discard(chat_id)
+            queue = self._pending.get(chat_id)
+            if not queue:
+                self._pending.pop(chat_id, None)
+                continue
+
+            self._active.add(chat_id)
+            job = queue.popleft()
+            try:
+                retry = await self._deliver(job)
+            finally:
+                self._active.discard(chat_id)
+            if retry:
+                queue.appendleft(job)
+            else:
+                self._finish(job)
+
+            if queue:
+                self._schedule(chat_id)
+            else:
+                self._pending.pop(chat_id, None)
+            self._maybe_log_stats()
+
+    async def _deliver(self, job: _Notification) -> bool:
+        """Отправить уведомление. Возвращает True, если его нужно повторить позже."""
+        try:
+            if job.skip_if is not None and job.skip_if():
+                self.stats['skipped'] += 1
+                return False
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки перед отправкой уведомления пользователю {job.chat_id}: {e}")
+
+        await self._wait_global_slot()
+        job.attempts += 1
+        try:
+            await self.bot.send_message(job.chat_id, job.text, **job.kwargs)
+        except RetryAfter as e:
+            self._chat_ready_at[job.chat_id] = time.monotonic() + e.timeout
+            logger.warning(f"⏳ RetryAfter {e.timeout}с для пользователя {job.chat_id}, откладываем")
+            self.stats['retried'] += 1
+            return True
+        except PERMANENT_ERRORS as e:
+            self.stats['failed'] += 1
+            logger.warning(f"🚫 Уведомление пользователю {job.chat_id} не доставлено: {e}")
+            return False
+        except (TelegramAPIError, asyncio.TimeoutError, OSError) as e:
+            if job.attempts <= self.max_retries:
+                self._chat_ready_at[job.chat_id] = time.monotonic() + 2 ** job.attempts
+                self.stats['retried'] += 1
+                logger.warning(f"⚠️ Ошибка отправки уведомления пользователю {job.chat_id} (попытка {job.attempts}): {e}")
+                return True
+            self.stats['failed'] += 1
+            logger.error(f"❌ Ошибка отправки уведомления пользователю {job.chat_id}: {e}")
+            return False
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"❌ Ошибка отправки уведомления пользователю {job.chat_id}: {e}")
+            return False
+
+        self._chat_ready_at[job.chat_id] = time.monotonic() + self.per_chat_interval
+        latency = time.monotonic() - job.created_at
+        self.stats['sent'] += 1
+        self.stats['latency_total'] += latency
+        self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+        logger.info(f"✅ Уведомление отправлено пользователю {job.chat_id} (в очереди {latency:.1f}с)")
+        return False
+
+    def get_stats(self) -> dict:
+        sent = self.stats['sent']
+        return {
+            'queue_depth': self._depth,
+            'chats_pending': len(self._pending),
+            'avg_latency': round(self.stats['latency_total'] / sent, 2) if sent else 0.0,
+            **{k: v for k, v in self.stats.items() if k != 'latency_total'},
+        }
+
+    def _maybe_log_stats(self):
+        now = time.monotonic()
+        if now - self._last_stats_log < self.stats_interval:
+            return
+        self._last_stats_log = now
+        stats = self.get_stats()
+        logger.info(
+            f"📮 Уведомления: в очереди {stats['queue_depth']} ({stats['chats_pending']} чатов), "
+            f"отправлено {stats['sent']}, ошибок {stats['failed']}, повторов {stats['retried']}, "
+            f"схлопнуто {stats['coalesced']}, задержка ср. {stats['avg_latency']}с / макс. {stats['latency_max']:.1f}с"
+        )
+
+    async def join(self, timeout: Optional[float] = None):
+        """Дождаться отправки всех уведомлений в очереди"""
+        if not self._tasks:
+            return
+        await asyncio.wait_for(self._idle.wait(), timeout)
+
+    async def close(self, drain_timeout: float = 30.0):
+        """Дождаться очереди (не дольше drain_timeout) и остановить воркеров"""
+        if not self._tasks:
+            return
+        try:
+            await self.join(drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не отправлено {self._depth} уведомлений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
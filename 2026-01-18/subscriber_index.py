@@ -0,0 +1,215 @@
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Set
+
+from config import ADMIN_CHAT_ID
+
+logger = logging.getLogger(__name__)
+
+# Маппинг кириллических названий стран на латинские (как в базе данных)
+COUNTRY_NAME_MAPPING = {
+    "бали": "bali",
+    "таиланд": "thailand",
+    "турция": "turkey",
+    "грузия": "georgia"
+}
+
+# Ключ маршрута для пользователей без выбранных стран (получают сообщения из всех стран)
+ANY_COUNTRY = None
+
+
+def normalize_country(country: Optional[str]) -> Optional[str]:
+    if not country:
+        return None
+    country_lower = country.lower()
+    return COUNTRY_NAME_MAPPING.get(country_lower, country_lower)
+
+
+def _parse_json_list(value) -> list:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            return []
+        return parsed if isinstance(parsed, list) else []
+    return []
+
+
+@dataclass
+class SubscriberEntry:
+    user_id: int
+    niches: Set[str] = field(default_factory=set)      # ниши в нижнем регистре
+    countries: Set[str] = field(default_factory=set)   # нормализованные страны
+    subscription_active: bool = False
+    subscription_until: Optional[datetime] = None
+    trial_until: Optional[datetime] = None
+
+    def has_access(self, now: datetime) -> bool:
+        """Активная подписка (безлимитная или не истекшая) или действующий триал"""
+        has_active_subscription = self.subscription_active is True and (
+            self.subscription_until is None or self.subscription_until > now
+        )
+        has_active_trial = self.trial_until is not None and self.trial_until > now
+        return has_active_subscription or has_active_trial
+
+
+class SubscriberIndex:
+    """
+    Маршрутизация сообщений по подписчикам в памяти: ниша -> страна -> user_id.
+
+    Правила те же, что в Database.get_subscribers_for_niche: пользователь с
+    выбранными странами получает только их, без стран - все (кроме админа),
+    доступ проверяется по подписке/триалу в момент рассылки.
+
+    Изменения ниш/стран приходят через LISTEN/NOTIFY (Database шлет уведомление
+    с user_id, индекс перечитывает одну строку), полная перезагрузка -
+    раз в full_reload_interval секунд (оплаты и правки в обход бота).
+    """
+
+    def __init__(self, db, full_reload_interval: float = 600.0):
+        self.db = db
+        self.full_reload_interval = full_reload_interval
+        self._users: Dict[int, SubscriberEntry] = {}
+        self._routes: Dict[str, Dict[Optional[str], Set[int]]] = {}
+        self._loaded_at: Optional[float] = None
+        self._listener_conn = None
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def _index(self, entry: SubscriberEntry):
+        for niche in entry.niches:
+            by_country = self._routes.setdefault(niche, {})
+            if entry.countries:
+                for country in entry.countries:
+                    by_country.setdefault(country, set()).add(entry.user_id)
+            elif str(entry.user_id) != str(ADMIN_CHAT_ID):
+                # Без выбранных стран - все сообщения (обратная совместимость), для админа - строгая фильтрация
+                by_country.setdefault(ANY_COUNTRY, set()).add(entry.user_id)
+
+    def _unindex(self, user_id: int):
+        entry = self._users.pop(user_id, None)
+        if entry is None:
+            return
+        for niche in entry.niches:
+            by_country = self._routes.get(niche, {})
+            for country in list(entry.countries) or [ANY_COUNTRY]:
+                users = by_country.get(country)
+                if users is not None:
+                    users.discard(user_id)
+                    if not users:
+                        del by_country[country]
+            if not by_country:
+                self._routes.pop(niche, None)
+
+    @staticmethod
+    def _entry_from_row(row) -> SubscriberEntry:
+        return SubscriberEntry(
+            user_id=row['user_id'],
+            niches={cat.lower() for cat in _parse_json_list(row['categories']) if isinstance(cat, str)},
+            countries={normalize_country(str(c)) for c in _parse_json_list(row['countries'])},
+            subscription_active=row['subscription_active'],
+            subscription_until=row['subscription_until'],
+            trial_until=row['trial_until'],
+        )
+
+    def _put(self, row):
+        self._unindex(row['user_id'])
+        entry = self._entry_from_row(row)
+        self._users[entry.user_id] = entry
+        self._index(entry)
+
+    async def load(self):
+        """Полная загрузка индекса (один запрос)"""
+        rows = await self.db.get_subscriber_routing_rows()
+        self._users.clear()
+        self._routes.clear()
+        for row in rows:
+            self._put(row)
+        self._loaded_at = time.monotonic()
+        logger.info(f"🗺️ Индекс подписчиков: {len(self._users)} пользователей, {len(self._routes)} ниш")
+
+    async def refresh_user(self, user_id: int):
+        """Перечитать одного пользователя после изменения ниш/стран"""
+        rows = await self.db.get_subscriber_routing_rows([user_id])
+        if rows:
+            self._put(rows[0])
+        else:
+            self._unindex(user_id)
+        logger.info(f"🗺️ Индекс подписчиков обновлен для пользователя {user_id}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            user_id = int(payload)
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ Некорректный payload уведомления {channel}: {payload!r}")
+            return
+        asyncio.ensure_future(self._safe_refresh_user(user_id))
+
+    async def _safe_refresh_user(self, user_id: int):
+        try:
+            await self.refresh_user(user_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления индекса подписчиков для {user_id}: {e}")
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(self.full_reload_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"❌ Ошибка перезагрузки индекса подписчиков: {e}")
+
+    async def start(self):
+        """Загрузить индекс и подписаться на изменения (повторный вызов - только перезагрузка)"""
+        await self.load()
+        if self._listener_conn is None:
+            try:
+                self._listener_conn = await self.db.listen_subscriber_changes(self._on_notify)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось подписаться на изменения подписчиков, только периодическая перезагрузка: {e}")
+        if self._reload_task is None:
+            self._reload_task = asyncio.create_task(self._reload_loop())
+
+    async def close(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+        if self._listener_conn is not None:
+            await self._listener_conn.close()
+            self._listener_conn = None
+
+    async def resolve(self, niches: Iterable[str], country: Optional[str] = None) -> Dict[int, Set[str]]:
+        """
+        Получатели сообщения с найденными нишами из чата страны country
+
+        Returns:
+            user_id -> общие ниши пользователя и сообщения (в нижнем регистре)
+        """
+        if self._loaded_at is None:
+            await self.load()
+
+        country_normalized = normalize_country(country)
+        now = datetime.now(timezone.utc)
+        recipients: Dict[int, Set[str]] = {}
+
+        for niche in {n.lower() for n in niches}:
+            by_country = self._routes.get(niche)
+            if not by_country:
+                continue
+            users = by_country.get(ANY_COUNTRY, set())
+            if country_normalized:
+                users = users | by_country.get(country_normalized, set())
+            for user_id in users:
+                recipients.setdefault(user_id, set()).add(niche)
+
+        return {
+            user_id: common for user_id, common in recipients.items()
+            if self._users[user_id].has_access(now)
+        }
@@ -4,7 +4,6 @@
 """
 
 import asyncio
-import json
 import os
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types
@@ -12,6 +11,8 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils import executor
 from dotenv import load_dotenv
 
+from feedback_store import get_feedback_store
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -70,7 +71,7 @@ async def test_buttons():
             "2. **❌ Не релевантно** - нажмите, если сообщение не подходит\n"
             "3. **🔧 Исправить классификацию** - нажмите для исправления AI классификации\n\n"
             "После нажатия кнопки:\n"
-            "• Ваша оценка сохранится в файл `relevance_feedback.json`\n"
+            "• Ваша оценка сохранится в лог `relevance_feedback.jsonl`\n"
             "• Кнопки обновятся и покажут статус подтверждения\n"
             "• AI система будет учиться на ваших оценках\n\n"
             "Попробуйте нажать на любую кнопку!"
@@ -88,8 +89,10 @@ async def test_buttons():
 async def show_feedback_stats():
     """Показывает статистику обратной связи"""
     try:
-        with open("relevance_feedback.json", "r", encoding="utf-8") as f:
-            feedbacks = json.load(f)
+        feedbacks = get_feedback_store().all_feedback()
+        if not feedbacks:
+            print("📝 Обратной связи еще нет")
+            return
         
         total = len(feedbacks)
         relevant = sum(1 for f in feedbacks if f.get("is_relevant", False))
@@ -110,8 +113,6 @@ async def show_feedback_stats():
         
         print("✅ Статистика отправлена!")
         
-    except FileNotFoundError:
-        print("📝 Файл с обратной связью еще не создан")
     except Exception as e:
         print(f"❌ Ошибка показа статистики: {e}")
 
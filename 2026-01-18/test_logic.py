@@ -1,5 +1,6 @@
 from ai_sniper import SemanticSniper
 import logging
+import sys
 
 # Настройка простого логгирования в консоль
 logging.basicConfig(level=logging.INFO, format='%(message)s')
@@ -52,5 +53,26 @@ def test_system():
         if result['reason'] != 'match' and result['reason'] != 'supply_match':
             print(f"{' '*60} | Reason: {reason}")
 
+def test_backend(backend: str):
+    """Сверка решений ONNX/int8-бэкенда с эталонным torch на тестовых фразах и эталонах"""
+    print(f"\n⏳ Сверка бэкенда {backend} с torch...")
+    reference = SemanticSniper(backend='torch')
+    candidate = SemanticSniper(backend=backend)
+    texts = [text for phrases in reference.anchors.values() for text in phrases] + [
+        "Сниму виллу в Убуде на 2 месяца, бюджет 3000$",
+        "Ребята, кто сдает байки? Нужен nmax",
+        "Сдается шикарная вилла, 3 спальни, бассейн. Пишите в лс.",
+        "Посоветуйте фотографа для съемки виллы",
+        "Я риелтор, помогу снять жилье, комиссия 50%",
+    ]
+    report = candidate.compare_with(reference, texts)
+    print(f"Бэкенд: {candidate.backend}, макс. расхождение близости: {report['max_score_diff']}")
+    for text, ours, theirs in report['mismatches']:
+        print(f"⚠️ {text[:58]:<60} | {ours['niche']} ({ours['score']}%) vs {theirs['niche']} ({theirs['score']}%)")
+    print("✅ Решения совпадают" if report['ok'] else "❌ Решения расходятся сильнее допуска")
+
 if __name__ == "__main__":
     test_system()
+    # python test_logic.py onnx-int8 - дополнительно сверить бэкенд с torch
+    if len(sys.argv) > 1:
+        test_backend(sys.argv[1])
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Множество ключей с временем жизни для дедупликации сообщений.
+
+    Ключи лежат в OrderedDict в порядке времени истечения (ttl общий, поэтому
+    это порядок последнего add; проверка порядок не меняет): проверка и вставка -
+    O(1), устаревшие ключи удаляются с начала порциями при вставке, а при
+    превышении max_size вытесняются те, что истекают раньше всех.
+
+    Если задан persist_path, кэш сохраняется в JSON (не чаще save_interval секунд
+    и при close) и загружается при старте, поэтому дубликаты ловятся и после
+    перезапуска. Время - wall clock (time.time), чтобы TTL пережил рестарт.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 50000, persist_path: Optional[str] = None,
+                 save_interval: float = 60.0, name: str = "cache"):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+        self.name = name
+        self._expires: "OrderedDict[str, float]" = OrderedDict()  # ключ -> время истечения
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def __contains__(self, key: str) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._expires[key]
+            return False
+        return True
+
+    def add(self, key: str):
+        """Запомнить ключ на ttl секунд (отсчет заново)"""
+        self._expires[key] = time.time() + self.ttl
+        self._expires.move_to_end(key)
+        self._dirty = True
+        self._evict()
+        self.maybe_save()
+
+    def check_and_add(self, key: str) -> bool:
+        """True, если ключ уже был в течение ttl; иначе запоминает его и возвращает False"""
+        if key in self:
+            return True
+        self.add(key)
+        return False
+
+    def _evict(self, batch: int = 100):
+        # Амортизированная очистка: просроченные ключи с начала очереди (не больше batch за вызов)
+        now = time.time()
+        for _ in range(batch):
+            if not self._expires:
+                break
+            key, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            del self._expires[key]
+        # Жесткий лимит памяти: вытесняем те, что истекают раньше всех
+        while len(self._expires) > self.max_size:
+            self._expires.popitem(last=False)
+
+    def clear(self):
+        self._expires.clear()
+        self._dirty = True
+
+    def _load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for key, expires_at in sorted(data.items(), key=lambda item: item[1]):
+                if expires_at > now:
+                    self._expires[key] = expires_at
+            self._evict()
+            logger.info(f"📦 {self.name}: загружено {len(self._expires)} ключей из {self.persist_path}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки {self.persist_path}: {e}")
+
+    def maybe_save(self):
+        if self.persist_path and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        """Сохранить непросроченные ключи (атомарно через временный файл)"""
+        self._last_save = time.monotonic()
+        if not self.persist_path or not self._dirty:
+            return
+        now = time.time()
+        data = {key: expires_at for key, expires_at in self._expires.items() if expires_at > now}
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.persist_path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения {self.persist_path}: {e}")
@@ -1,18 +1,19 @@
 from telethon import TelegramClient, events
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser
-from telethon.tl.functions.messages import ExportChatInviteRequest
 import re
 from patterns import PATTERNS
 from datetime import datetime
 import asyncio
 import logging
-import json
-from config import API_ID, API_HASH, PHONE_NUMBER, MONITORING_CONFIG, BOT_TOKEN, DB_DSN
+from config import API_ID, API_HASH, PHONE_NUMBER, MONITORING_CONFIG, BOT_TOKEN, DB_DSN, PIPELINE_CONFIG
 import os
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from database import Database
-from monitor import MessageMonitor
+from monitor import MessageMonitor, IncomingMessage
+from ingest_pipeline import IngestPipeline, Stage, OVERFLOW_DROP_OLDEST
+from chat_registry import ChatMetadataCache, KnownChats, chat_key
 from content import MONITORING_TOPICS
 # from mvp_release.patterns import PATTERNS, NICHES_KEYWORDS
 
@@ -27,16 +28,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка известных чатов
-try:
-    with open('known_chats.json', 'r', encoding='utf-8') as f:
-        known_chats = json.load(f)
-        monitored_chats = list(known_chats.keys())
-        logger.info(f"Загружено {len(monitored_chats)} чатов для мониторинга")
-except FileNotFoundError:
-    known_chats = {}
-    monitored_chats = []
-    logger.info("Файл known_chats.json не найден, начинаем с пустого списка чатов")
+# Загрузка известных чатов (множество ID для фильтра событий, сохранение отложенное)
+known_chats = KnownChats('known_chats.json')
 
 # Ваш Telegram ID для теста
 test_user_id = 210147380
@@ -51,9 +44,6 @@ STOP_PHRASES = [
     "joined the group",
 ]
 
-# Кэш инвайт-ссылок, чтобы не экспортировать заново на каждое сообщение
-INVITE_LINK_CACHE: dict[str, str] = {}
-
 def is_spam(text: str) -> bool:
     """
     Быстрая проверка на очевидный спам (продажа документов, реклама обмена валют).
@@ -142,25 +132,6 @@ def _get_thread_id_from_event(event) -> int | None:
     return None
 
 
-async def _get_join_link_if_available(client: TelegramClient, chat) -> str | None:
-    """
-    Пытается получить invite link для приватных чатов (если доступно боту/аккаунту).
-    Возвращает None, если прав нет или ссылка недоступна.
-    """
-    chat_id = str(getattr(chat, "id", ""))
-    if chat_id and chat_id in INVITE_LINK_CACHE:
-        return INVITE_LINK_CACHE[chat_id]
-
-    try:
-        exported = await client(ExportChatInviteRequest(peer=chat))
-        link = getattr(exported, "link", None)
-        if link:
-            INVITE_LINK_CACHE[chat_id] = link
-            return link
-    except Exception as e:
-        logger.info(f"[Monitor] Invite link недоступен для чата {chat_id}: {e}")
-    return None
-
 async def main():
     # Инициализация Telethon клиента
     # Используем сессию из корневой директории, если она есть и авторизована
@@ -202,138 +173,104 @@ async def main():
 
     # Убираем диспетчер и polling - кнопки будут обрабатываться в основном боте
 
-    @client.on(events.NewMessage())
-    async def handler(event):
-        try:
+    # Название/username/инвайт-ссылка чата запрашиваются один раз на чат
+    chat_metadata = ChatMetadataCache(client)
+
+    async def ingest(event) -> Optional[IncomingMessage]:
+        """Стадия ingest: метаданные чата (из кэша), ранние фильтры, отправитель, ссылка на сообщение"""
+        chat_id = chat_key(event)
+        meta = chat_metadata.get(chat_id)
+        if meta is None:
             chat = await event.get_chat()
-            chat_id = str(chat.id)
-            chat_title = chat.title if hasattr(chat, 'title') else 'Private Chat'
-            logger.info(f"[Monitor] Получено сообщение в чате: {chat_title} (ID: {chat_id})")
-            logger.info(f"[Monitor] Текст сообщения: {event.message.text}")
+            meta = await chat_metadata.load(chat_id, chat)
+        chat_title = meta.title
+        logger.info(f"[Monitor] Получено сообщение в чате: {chat_title} (ID: {chat_id})")
+        logger.info(f"[Monitor] Текст сообщения: {event.message.text}")
+
+        # Сохраняем новый чат, если он ещё не известен
+        if chat_id not in known_chats:
+            known_chats.add(chat_id, chat_title, str(event.message.date))
+            logger.info(f"Добавлен новый чат: {chat_title} (ID: {chat_id})")
 
-            # Получаем информацию об отправителе
-            sender = await event.get_sender()
-            sender_username = sender.username if hasattr(sender, 'username') else None
-            sender_id = sender.id if hasattr(sender, 'id') else None
-            sender_first_name = sender.first_name if hasattr(sender, 'first_name') else None
-            sender_last_name = sender.last_name if hasattr(sender, 'last_name') else None
-            sender_is_bot = bool(getattr(sender, "bot", False))
+        # --- БЫСТРАЯ ПРОВЕРКА НА СПАМ (до запроса отправителя) ---
+        if event.message.text and is_spam(event.message.text):
+            logger.info(f"🚫 Спам отфильтрован на раннем этапе, сообщение пропущено: {event.message.text[:100]}...")
+            return None
+        # -----------------------------------------------------------------
 
-            # 1) Проверка is_bot: сообщения от ботов игнорируем сразу (приветствия/админ-боты)
-            if sender_is_bot:
-                logger.info(
-                    f"🚫 Пропускаем сообщение от бота @{sender_username or ''} (ID: {sender_id})"
-                )
-                return
+        # Получаем информацию об отправителе
+        sender = await event.get_sender()
+        sender_username = sender.username if hasattr(sender, 'username') else None
+        sender_id = sender.id if hasattr(sender, 'id') else None
+        sender_first_name = sender.first_name if hasattr(sender, 'first_name') else None
+        sender_last_name = sender.last_name if hasattr(sender, 'last_name') else None
+        sender_is_bot = bool(getattr(sender, "bot", False))
 
-            # Сохраняем новый чат, если он ещё не известен
-            if chat_id not in known_chats:
-                known_chats[chat_id] = {
-                    'title': chat_title,
-                    'type': 'Private',
-                    'first_seen': str(event.message.date)
-                }
-                monitored_chats.append(chat_id)
-                with open('known_chats.json', 'w', encoding='utf-8') as f:
-                    json.dump(known_chats, f, ensure_ascii=False, indent=2)
-                logger.info(f"Добавлен новый чат: {chat_title} (ID: {chat_id})")
+        # 1) Проверка is_bot: сообщения от ботов игнорируем сразу (приветствия/админ-боты)
+        if sender_is_bot:
+            logger.info(
+                f"🚫 Пропускаем сообщение от бота @{sender_username or ''} (ID: {sender_id})"
+            )
+            return None
 
-            # Только для чатов из списка мониторинга
-            if chat_id not in monitored_chats:
-                logger.info(f"Чат {chat_id} не в списке мониторинга, пропускаем")
-                return
+        # Формируем ссылку на конкретное сообщение
+        message_link = meta.message_link(getattr(event.message, 'id', None), _get_thread_id_from_event(event))
+        if message_link:
+            logger.info(f"[Monitor] Сформирована ссылка на сообщение: {message_link}")
 
-            # --- БЫСТРАЯ ПРОВЕРКА НА СПАМ (до всех остальных проверок) ---
-            if event.message.text and is_spam(event.message.text):
-                logger.info(f"🚫 Спам отфильтрован на раннем этапе, сообщение пропущено: {event.message.text[:100]}...")
-                return
-            # -----------------------------------------------------------------
+        return IncomingMessage(
+            message_text=event.message.text,
+            chat_title=chat_title,
+            message_link=message_link,
+            chat_username=meta.username,
+            chat_join_link=meta.join_link,
+            sender_username=sender_username,
+            sender_id=sender_id,
+            sender_first_name=sender_first_name,
+            sender_last_name=sender_last_name,
+            sender_is_bot=sender_is_bot,
+        )
 
-            # Формируем ссылку на конкретное сообщение
-            message_link = None
-            chat_username = None
-            chat_join_link = None
-            if hasattr(event.message, 'id'):
-                try:
-                    thread_id = _get_thread_id_from_event(event)
-                    # Пытаемся получить username чата через get_entity
-                    try:
-                        entity = await client.get_entity(chat.id)
-                        if hasattr(entity, 'username') and entity.username:
-                            chat_username = entity.username
-                            chat_join_link = f"https://t.me/{chat_username}"
-                            if thread_id:
-                                message_link = f"https://t.me/{chat_username}/{thread_id}/{event.message.id}"
-                            else:
-                                message_link = f"https://t.me/{chat_username}/{event.message.id}"
-                            logger.info(f"[Monitor] Сформирована ссылка для публичного чата: {message_link}")
-                        else:
-                            # Для приватных чатов используем правильный формат
-                            chat_id_int = abs(chat.id) if chat.id < 0 else chat.id
-                            # Убираем префикс -100 для супергрупп
-                            if chat_id_int >= 1000000000000:
-                                chat_id_for_link = str(chat_id_int)[4:]  # Убираем первые 4 цифры (1000)
-                            else:
-                                chat_id_for_link = str(chat_id_int)
-                            
-                            if chat_id_for_link.isdigit():
-                                if thread_id:
-                                    message_link = f"https://t.me/c/{chat_id_for_link}/{thread_id}/{event.message.id}"
-                                else:
-                                    message_link = f"https://t.me/c/{chat_id_for_link}/{event.message.id}"
-                                logger.info(f"[Monitor] Сформирована ссылка для приватного чата: {message_link} (ID чата: {chat_id_for_link})")
-                                chat_join_link = await _get_join_link_if_available(client, chat)
-                            else:
-                                logger.warning(f"[Monitor] Некорректный ID чата для ссылки: {chat_id_for_link}")
-                    except Exception as e:
-                        logger.warning(f"[Monitor] Не удалось получить entity для чата {chat.id}: {e}")
-                        # Fallback: используем старый метод
-                        if hasattr(chat, 'username') and chat.username:
-                            chat_username = chat.username
-                            chat_join_link = f"https://t.me/{chat_username}"
-                            if thread_id:
-                                message_link = f"https://t.me/{chat_username}/{thread_id}/{event.message.id}"
-                            else:
-                                message_link = f"https://t.me/{chat_username}/{event.message.id}"
-                        else:
-                            chat_id_str = str(abs(chat.id))
-                            if chat_id_str.startswith('100'):
-                                chat_id_for_link = chat_id_str[3:]  # Убираем '100'
-                            else:
-                                chat_id_for_link = chat_id_str
-                            
-                            if chat_id_for_link.isdigit():
-                                if thread_id:
-                                    message_link = f"https://t.me/c/{chat_id_for_link}/{thread_id}/{event.message.id}"
-                                else:
-                                    message_link = f"https://t.me/c/{chat_id_for_link}/{event.message.id}"
-                                chat_join_link = await _get_join_link_if_available(client, chat)
-                except Exception as e:
-                    logger.error(f"[Monitor] Ошибка при формировании ссылки: {e}")
-                    message_link = None
+    async def prefilter(lead: IncomingMessage) -> Optional[IncomingMessage]:
+        return lead if monitor.prefilter_message(lead) else None
 
-            # Обрабатываем сообщение через монитор
-            await monitor.process_message_from_subscriber(
-                message_text=event.message.text,
-                chat_title=chat_title,
-                message_link=message_link,
-                chat_username=chat_username,
-                chat_join_link=chat_join_link,
-                sender_username=sender_username,
-                sender_id=sender_id,
-                sender_first_name=sender_first_name,
-                sender_last_name=sender_last_name,
-                sender_is_bot=sender_is_bot,
-            )
-            logger.info("Сообщение успешно обработано монитором")
+    async def classify(lead: IncomingMessage) -> Optional[IncomingMessage]:
+        return lead if await monitor.classify_message(lead) else None
 
-        except Exception as e:
-            logger.error(f"Ошибка при обработке сообщения: {e}")
+    async def route(lead: IncomingMessage) -> Optional[IncomingMessage]:
+        return lead if await monitor.route_message(lead) else None
+
+    async def deliver(lead: IncomingMessage):
+        monitor.deliver_message(lead)
+        logger.info("Сообщение успешно обработано монитором")
+
+    # ingest → prefilter → classify → route → deliver: у каждой стадии свои воркеры,
+    # медленная классификация не задерживает прием сообщений из чатов.
+    # Прием никогда не ждет: при переполнении отбрасываются самые старые сообщения,
+    # дальше по конвейеру действует backpressure (стадия ждет места в следующей очереди).
+    pipeline = IngestPipeline([
+        Stage('ingest', ingest, overflow=OVERFLOW_DROP_OLDEST, timeout=30, **PIPELINE_CONFIG['ingest']),
+        Stage('prefilter', prefilter, **PIPELINE_CONFIG['prefilter']),
+        Stage('classify', classify, timeout=60, **PIPELINE_CONFIG['classify']),
+        Stage('route', route, timeout=30, **PIPELINE_CONFIG['route']),
+        Stage('deliver', deliver, **PIPELINE_CONFIG['deliver']),
+    ])
+    monitor.pipeline = pipeline
+    pipeline.start()
+
+    # Фильтр чатов - до обработчика, по живому множеству ID (без get_chat/get_sender)
+    @client.on(events.NewMessage(func=known_chats.accepts))
+    async def handler(event):
+        # Только постановка в очередь - обработка идет в воркерах конвейера
+        pipeline.submit(event)
 
     logger.info("[Monitor] Запуск Telethon-клиента...")
     
     # Запускаем Telethon клиент
     await client.run_until_disconnected()
+    # Конвейер, индекс подписчиков, хеши дубликатов и очередь уведомлений
+    await monitor.cleanup()
+    await known_chats.flush()
     await db.close()
     await bot.close()
 
@@ -366,6 +366,178 @@ class DbManager:
             )
             return False
     
+    async def get_posting_accounts(self, allowed_sessions: Optional[List[str]] = None) -> List[Account]:
+        """
+        Получить все активные аккаунты для постинга одним запросом
+        
+        Args:
+            allowed_sessions: Whitelist session_name (None = все активные)
+        
+        Returns:
+            Список аккаунтов (отсоединенные объекты, только колонки, которые есть в БД Bali)
+        """
+        accounts_sql = text("""
+            SELECT a.id, a.phone, a.string_session, a.session_name, a.status,
+                   a.api_id, a.api_hash, a.proxy, a.nickname, a.bio,
+                   a.created_at, a.updated_at
+            FROM accounts a
+            WHERE a.status = 'active'
+              AND (
+                :allowed_sessions_is_null
+                OR a.session_name = ANY(CAST(:allowed_sessions AS TEXT[]))
+              )
+            ORDER BY a.id
+        """)
+        rows = (
+            await self.session.execute(
+                accounts_sql,
+                {
+                    "allowed_sessions_is_null": allowed_sessions is None,
+                    "allowed_sessions": allowed_sessions or [],
+                }
+            )
+        ).fetchall()
+        
+        return [
+            Account(
+                id=row[0],
+                phone=row[1],
+                string_session=row[2],
+                session_name=row[3],
+                status=row[4],
+                api_id=row[5],
+                api_hash=row[6],
+                proxy=row[7],
+                nickname=row[8],
+                bio=row[9],
+                created_at=row[10],
+                updated_at=row[11],
+            )
+            for row in rows
+        ]
+    
+    async def get_blocklist_pairs(self, group_ids: List[int]) -> Dict[int, set]:
+        """
+        Получить блоклист связок группа-аккаунт для набора групп одним запросом
+        
+        Returns:
+            {group_id: {account_id, ...}}
+        """
+        if not group_ids:
+            return {}
+        
+        blocklist_sql = text("""
+            SELECT b.group_id, b.account_id
+            FROM account_group_blocklist b
+            WHERE b.group_id = ANY(CAST(:group_ids AS INTEGER[]))
+        """)
+        rows = (await self.session.execute(blocklist_sql, {"group_ids": list(group_ids)})).fetchall()
+        
+        blocked: Dict[int, set] = {}
+        for group_id, account_id in rows:
+            blocked.setdefault(group_id, set()).add(account_id)
+        return blocked
+    
+    async def record_posts_bulk(
+        self,
+        posts: List[Dict],
+        blocked_pairs: Optional[List[Dict]] = None,
+        target_updates: Optional[List[Dict]] = None
+    ) -> bool:
+        """
+        Записать результаты батча одной транзакцией (аналог record_post для списка постов)
+        
+        Args:
+            posts: Словари с ключами account_id, target_id, message_content, photo_path,
+                   status, error_message, sent_at
+            blocked_pairs: Новые связки блоклиста: group_id, account_id, reason
+            target_updates: Новые значения полей групп: target_id, status, can_post,
+                            assigned_account_id, updated_at
+        
+        Returns:
+            True если успешно
+        """
+        try:
+            if blocked_pairs:
+                await self.session.execute(
+                    text(
+                        "INSERT INTO account_group_blocklist (group_id, account_id, reason) "
+                        "VALUES (:group_id, :account_id, :reason) "
+                        "ON CONFLICT (group_id, account_id) DO NOTHING"
+                    ),
+                    blocked_pairs
+                )
+            
+            if posts:
+                await self.session.execute(
+                    text("""
+                        INSERT INTO posts (group_id, account_id, message_text, photo_path, sent_at, niche, success, error_message)
+                        VALUES (:group_id, :account_id, :message_text, :photo_path, :sent_at, :niche, :success, :error_message)
+                    """),
+                    [
+                        {
+                            "group_id": post["target_id"],
+                            "account_id": post["account_id"],
+                            "message_text": post["message_content"][:1000] if post.get("message_content") else None,
+                            "photo_path": post.get("photo_path"),
+                            "sent_at": post["sent_at"],
+                            "niche": "bali",  # Как в record_post
+                            "success": post["status"] == 'success',
+                            "error_message": post["error_message"][:500] if post.get("error_message") else None,
+                        }
+                        for post in posts
+                    ]
+                )
+            
+            # Счетчики групп: одна строка на группу с числом успешных постов за батч
+            group_updates: Dict[int, Dict] = {}
+            for post in posts:
+                if post["status"] != 'success':
+                    continue
+                update_row = group_updates.setdefault(
+                    post["target_id"],
+                    {"target_id": post["target_id"], "count": 0, "now": post["sent_at"]}
+                )
+                update_row["count"] += 1
+                update_row["now"] = max(update_row["now"], post["sent_at"])
+            
+            if group_updates:
+                await self.session.execute(
+                    text("""
+                        UPDATE groups 
+                        SET last_post_at = :now, 
+                            daily_posts_count = COALESCE(daily_posts_count, 0) + :count,
+                            updated_at = :now
+                        WHERE id = :target_id
+                    """),
+                    list(group_updates.values())
+                )
+            
+            if target_updates:
+                await self.session.execute(
+                    text("""
+                        UPDATE groups 
+                        SET status = :status, 
+                            can_post = :can_post, 
+                            assigned_account_id = :assigned_account_id, 
+                            updated_at = :updated_at
+                        WHERE id = :target_id
+                    """),
+                    target_updates
+                )
+            
+            await self.session.commit()
+            logger.info(
+                f"✅ Recorded batch: {len(posts)} posts, {len(group_updates)} groups updated, "
+                f"{len(blocked_pairs or [])} blocklist pairs, {len(target_updates or [])} group changes"
+            )
+            return True
+            
+        except Exception as e:
+            await self.session.rollback()
+            logger.error(f"❌ Error recording batch of {len(posts)} posts: {e}", exc_info=True)
+            return False
+    
     async def set_account_flood_wait(self, account_id: int, wait_until: datetime):
         """
         Установка FloodWait для аккаунта
@@ -24,6 +24,8 @@ from telethon.errors import FloodWaitError, UsernameNotOccupiedError, RPCError
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
+from shared.telegram.bootstrap import bootstrap_clients
+
 # Импорты для GPT Handler и ConfigLoader
 try:
     from shared.config.loader import ConfigLoader
@@ -179,6 +181,7 @@ class LexusSecretary:
         proxy_config = self.parse_proxy(proxy)
         
         # Создаем клиент
+        client = None
         try:
             if string_session and string_session.strip() and string_session not in ['', 'null']:
                 session_obj = StringSession(string_session.strip())
@@ -212,6 +215,14 @@ class LexusSecretary:
             logger.info(f"✅ Client {session_name} connected and authorized")
             return client
             
+        except asyncio.CancelledError:
+            # Таймаут подключения (зависший прокси) - закрываем соединение
+            if client is not None:
+                try:
+                    await asyncio.wait_for(client.disconnect(), timeout=2.0)
+                except Exception:
+                    pass
+            raise
         except Exception as e:
             logger.error(f"❌ Failed to create client {session_name}: {e}")
             return None
@@ -646,10 +657,14 @@ class LexusSecretary:
         if not self.load_accounts():
             raise ValueError("Failed to load accounts")
         
-        # Создаем клиенты
+        # Создаем клиенты (параллельно, с таймаутом на аккаунт)
         logger.info("🔄 Creating clients...")
-        for account in self.accounts:
-            await self.create_client(account)
+        await bootstrap_clients(
+            self.accounts,
+            self.create_client,
+            name_of=lambda account: account.get('session_name') or '?',
+            label="secretary clients"
+        )
         
         if not self.clients:
             raise ValueError("No clients created")
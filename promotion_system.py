@@ -12,6 +12,9 @@ from telethon.errors import RPCError, FloodWaitError
 from telethon.tl.functions.account import UpdateProfileRequest
 
 from chatgpt_response_generator import ChatGPTResponseGenerator
+from shared.telegram.bootstrap import bootstrap_clients
+from shared.telegram.media_cache import get_media_cache
+from shared.telegram.peer_cache import INVALIDATING_ERRORS as PEER_INVALIDATING_ERRORS, get_peer_cache
 
 # from alert_system import AlertSystem  # Временно отключено из-за конфликтов
 
@@ -30,6 +33,8 @@ class PromotionSystem:
         self.niche_messages = {}
         self.posted_slots_today = {}
         self.dialog_entities_cache = {}
+        self.peer_cache = get_peer_cache()  # username/ID -> InputPeer для каждого аккаунта
+        self.media_cache = get_media_cache()  # загруженные фото кампаний для каждого аккаунта
         self.group_niches = {}
         self.daily_posts = {}  # Счетчик постов в день для каждого аккаунта
         self.max_daily_posts = 20  # Максимум постов в день с аккаунта (увеличено для большего охвата)
@@ -666,40 +671,56 @@ class PromotionSystem:
             self.logger.warning(f"⚠️ lexus_accounts_config.json not found in any of: {possible_paths}, using all accounts for Lexus")
             self.lexus_allowed_accounts = set()
 
+    async def _lookup_target(self, client: TelegramClient, target: str):
+        """Сетевое разрешение цели (get_entity, для ID - еще и поиск по диалогам)"""
+        # Попытка как число (ID)
+        if target.isdigit():
+            target_id = int(target)
+            # Сначала пробуем напрямую
+            try:
+                return await client.get_entity(target_id)
+            except Exception:
+                pass
+            # Затем ищем среди диалогов
+            if client not in self.dialog_entities_cache:
+                self.dialog_entities_cache[client] = [d async for d in client.iter_dialogs()]
+                account_name = next((name for name, c in self.clients.items() if c is client), None)
+                if account_name:
+                    self.peer_cache.put_many(account_name, ((d.id, d.entity) for d in self.dialog_entities_cache[client]))
+            for dialog in self.dialog_entities_cache[client]:
+                entity = dialog.entity
+                try:
+                    if getattr(entity, 'id', None) == target_id:
+                        return entity
+                    # Попытка сопоставить с полным ID каналов (-100prefix)
+                    if isinstance(target_id, int) and getattr(entity, 'id', None) is not None:
+                        full_id = int(f"100{entity.id}") if entity.id > 0 else abs(entity.id)
+                        if full_id == target_id:
+                            return entity
+                except Exception:
+                    continue
+            raise ValueError(f"Entity with id {target_id} not found in dialogs")
+        # Иначе строка (@username или ссылка)
+        return await client.get_entity(target)
+
     async def resolve_target(self, client: TelegramClient, target: str):
-        """Разрешение цели: username/link/ID -> entity"""
+        """Разрешение цели: username/link/ID -> entity (сначала кэш peer'ов аккаунта)"""
+        account_name = next((name for name, c in self.clients.items() if c is client), None)
         try:
             # Проверяем подключение клиента перед запросами
             if not client.is_connected():
                 self.logger.warning(f"⚠️ Client is disconnected, cannot resolve target {target}")
                 return None
             
-            # Попытка как число (ID)
-            if target.isdigit():
-                target_id = int(target)
-                # Сначала пробуем напрямую
-                try:
-                    return await client.get_entity(target_id)
-                except Exception:
-                    pass
-                # Затем ищем среди диалогов
-                if client not in self.dialog_entities_cache:
-                    self.dialog_entities_cache[client] = [d async for d in client.iter_dialogs()]
-                for dialog in self.dialog_entities_cache[client]:
-                    entity = dialog.entity
-                    try:
-                        if getattr(entity, 'id', None) == target_id:
-                            return entity
-                        # Попытка сопоставить с полным ID каналов (-100prefix)
-                        if isinstance(target_id, int) and getattr(entity, 'id', None) is not None:
-                            full_id = int(f"100{entity.id}") if entity.id > 0 else abs(entity.id)
-                            if full_id == target_id:
-                                return entity
-                    except Exception:
-                        continue
-                raise ValueError(f"Entity with id {target_id} not found in dialogs")
-            # Иначе строка (@username или ссылка)
-            return await client.get_entity(target)
+            if account_name:
+                cached_peer = self.peer_cache.get(account_name, target)
+                if cached_peer is not None:
+                    return cached_peer
+
+            entity = await self._lookup_target(client, target)
+            if account_name:
+                self.peer_cache.put(account_name, target, entity)
+            return entity
         except FloodWaitError as e:
             # FloodWait - это не критическая ошибка, логируем как предупреждение
             wait_seconds = e.seconds
@@ -711,6 +732,9 @@ class PromotionSystem:
                 self.logger.warning(f"⚠️ FloodWait для {target}: {wait_minutes}м (будет пропущено)")
             return None
         except RPCError as e:
+            if account_name and isinstance(e, PEER_INVALIDATING_ERRORS):
+                # Группа переименована/стала приватной - закэшированный peer больше не годится
+                self.peer_cache.invalidate(account_name, target)
             error_msg = str(e)
             error_lower = error_msg.lower()
             
@@ -1073,7 +1097,9 @@ class PromotionSystem:
                     continue
                 
                 # Отправляем фото с подписью
-                await client.send_file(
+                await self.media_cache.send_file(
+                    client,
+                    account_name,
                     account_entity,
                     str(photo_file),
                     caption=caption
@@ -1613,73 +1639,92 @@ class PromotionSystem:
         return None
     
     async def initialize_clients(self):
-        """Инициализация всех клиентов с проверкой подключения"""
-        for account in self.accounts:
-            account_name = account['session_name']
-            try:
-                self.logger.info(f"🔄 Initializing {account_name}...")
-                
-                api_id = int(account['api_id'])
-                # Приоритет: используем string_session из конфига, если есть
-                string_session = account.get('string_session')
-                self.logger.debug(f"  string_session type: {type(string_session)}, value: {str(string_session)[:50] if string_session else 'None'}...")
-                proxy_config = account.get('proxy')  # Получаем конфигурацию прокси
-                
-                # Парсим прокси если указан
-                proxy = None
-                if proxy_config:
-                    proxy = self.parse_proxy(proxy_config)
-                    if proxy:
-                        self.logger.info(f"  Using proxy for {account_name}: {proxy['addr']}:{proxy['port']} ({proxy['proxy_type']})")
-                    else:
-                        self.logger.warning(f"  Failed to parse proxy config for {account_name}, continuing without proxy")
-                
-                # Создаем клиент с прокси если указан
-                client = None
-                if string_session and string_session not in ['', 'TO_BE_CREATED', 'null', None]:
-                    # Убеждаемся, что string_session это строка
-                    if isinstance(string_session, str):
-                        session_cleaned = string_session.strip()
-                        if session_cleaned:
-                            from telethon.sessions import StringSession
-                            try:
-                                self.logger.info(f"  Using StringSession for {account_name} (length: {len(session_cleaned)})")
-                                session_obj = StringSession(session_cleaned)
-                                client = TelegramClient(
-                                    session_obj, 
-                                    api_id, 
-                                    account['api_hash'],
-                                    proxy=proxy
-                                )
-                            except Exception as session_error:
-                                self.logger.error(f"  Failed to create StringSession for {account_name}: {type(session_error).__name__}: {session_error}")
-                                raise
-                        else:
-                            self.logger.warning(f"  string_session is empty string for {account_name}, using file session")
-                    else:
-                        self.logger.warning(f"  string_session is not a string for {account_name} (type: {type(string_session)}), using file session")
-                
-                if not client:
-                    # Fallback: используем файловую сессию
-                    self.logger.info(f"  Using file session for {account_name}")
-                    client = TelegramClient(
-                        f"sessions/{account_name}", 
-                        api_id, 
-                        account['api_hash'],
-                        proxy=proxy
-                    )
-                
-                await client.connect()
-                self.logger.info(f"  Connected {account_name}")
-                
-                # Для StringSession не проверяем авторизацию (зависает)
-                # Просто добавляем и доверяем что сессия валидна
-                self.clients[account_name] = client
-                self.logger.info(f"✅ Client {account_name} ready")
-                
-            except Exception as e:
-                self.logger.error(f"❌ Failed {account_name}: {e}")
+        """Инициализация всех клиентов с проверкой подключения (параллельно, с таймаутом на аккаунт)"""
+        await bootstrap_clients(
+            self.accounts,
+            self._initialize_client,
+            name_of=lambda account: account['session_name'],
+            label="promotion clients"
+        )
     
+    async def _initialize_client(self, account: dict) -> Optional[TelegramClient]:
+        """Подключение одного аккаунта (None - не удалось)"""
+        account_name = account['session_name']
+        client = None
+        try:
+            self.logger.info(f"🔄 Initializing {account_name}...")
+            
+            api_id = int(account['api_id'])
+            # Приоритет: используем string_session из конфига, если есть
+            string_session = account.get('string_session')
+            self.logger.debug(f"  string_session type: {type(string_session)}, value: {str(string_session)[:50] if string_session else 'None'}...")
+            proxy_config = account.get('proxy')  # Получаем конфигурацию прокси
+            
+            # Парсим прокси если указан
+            proxy = None
+            if proxy_config:
+                proxy = self.parse_proxy(proxy_config)
+                if proxy:
+                    self.logger.info(f"  Using proxy for {account_name}: {proxy['addr']}:{proxy['port']} ({proxy['proxy_type']})")
+                else:
+                    self.logger.warning(f"  Failed to parse proxy config for {account_name}, continuing without proxy")
+            
+            # Создаем клиент с прокси если указан
+            client = None
+            if string_session and string_session not in ['', 'TO_BE_CREATED', 'null', None]:
+                # Убеждаемся, что string_session это строка
+                if isinstance(string_session, str):
+                    session_cleaned = string_session.strip()
+                    if session_cleaned:
+                        from telethon.sessions import StringSession
+                        try:
+                            self.logger.info(f"  Using StringSession for {account_name} (length: {len(session_cleaned)})")
+                            session_obj = StringSession(session_cleaned)
+                            client = TelegramClient(
+                                session_obj, 
+                                api_id, 
+                                account['api_hash'],
+                                proxy=proxy
+                            )
+                        except Exception as session_error:
+                            self.logger.error(f"  Failed to create StringSession for {account_name}: {type(session_error).__name__}: {session_error}")
+                            raise
+                    else:
+                        self.logger.warning(f"  string_session is empty string for {account_name}, using file session")
+                else:
+                    self.logger.warning(f"  string_session is not a string for {account_name} (type: {type(string_session)}), using file session")
+            
+            if not client:
+                # Fallback: используем файловую сессию
+                self.logger.info(f"  Using file session for {account_name}")
+                client = TelegramClient(
+                    f"sessions/{account_name}", 
+                    api_id, 
+                    account['api_hash'],
+                    proxy=proxy
+                )
+            
+            await client.connect()
+            self.logger.info(f"  Connected {account_name}")
+            
+            # Для StringSession не проверяем авторизацию (зависает)
+            # Просто добавляем и доверяем что сессия валидна
+            self.clients[account_name] = client
+            self.logger.info(f"✅ Client {account_name} ready")
+            return client
+            
+        except asyncio.CancelledError:
+            # Таймаут подключения (зависший прокси) - закрываем соединение
+            if client is not None:
+                try:
+                    await asyncio.wait_for(client.disconnect(), timeout=2.0)
+                except Exception:
+                    pass
+            raise
+        except Exception as e:
+            self.logger.error(f"❌ Failed {account_name}: {e}")
+            return None
+
     async def reconnect_client(self, account_name: str):
         """Переподключение конкретного клиента"""
         try:
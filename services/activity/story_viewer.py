@@ -2,19 +2,24 @@
 Модуль просмотра Stories участников групп
 """
 import asyncio
+import json
+import os
 import random
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 from sqlalchemy import func, and_
 
 from telethon.tl.functions.stories import (
+    GetAllStoriesRequest,
     GetPeerStoriesRequest,
     IncrementStoryViewsRequest,
     ReadStoriesRequest,
     SendReactionRequest,
 )
-from telethon.tl.types import ReactionEmoji
+from telethon.tl.functions.users import GetUsersRequest
+from telethon.tl.types import InputUser, ReactionEmoji, User
 from telethon.errors import (
     FloodWaitError,
     UserNotParticipantError,
@@ -25,9 +30,71 @@ from telethon.errors import (
 
 from shared.database.session import SessionLocal
 from shared.database.models import Account, Group, StoryView
+from shared.telegram.peer_cache import get_peer_cache
+from shared.telegram.roster_cache import ParticipantRosterCache, story_max_id
 
 logger = logging.getLogger(__name__)
 
+# Максимум пользователей в одном users.GetUsers
+GET_USERS_BATCH = 100
+
+
+def new_session():
+    """
+    Отдельная сессия БД
+
+    SessionLocal - scoped_session, и все корутины потока получают из него одну
+    и ту же сессию. Аккаунты обрабатываются параллельно, поэтому каждой
+    обработке нужна своя, иначе commit/close одной сбрасывают объекты другой.
+    """
+    return SessionLocal.session_factory()
+
+
+@dataclass(frozen=True)
+class AccountRef:
+    """Поля аккаунта, нужные для обработки, без привязки к сессии БД"""
+    id: int
+    session_name: str
+    proxy: Optional[str] = None
+
+
+class StoryViewLedger:
+    """
+    Просмотры Stories аккаунта за цикл: ключи уже просмотренных stories
+    загружаются из БД один раз, проверка дубликата - по множеству в памяти,
+    новые StoryView копятся и записываются пачкой (flush)
+    """
+    
+    def __init__(self, account_id: int, viewed_keys: set, flush_size: int = 20):
+        self.account_id = account_id
+        self.viewed_keys = viewed_keys
+        self.flush_size = flush_size
+        self.pending: List[StoryView] = []
+    
+    def __contains__(self, story_key: str) -> bool:
+        return story_key in self.viewed_keys
+    
+    def record(self, story_view: StoryView):
+        self.viewed_keys.add(story_view.story_id)
+        self.pending.append(story_view)
+    
+    def maybe_flush(self, db):
+        if len(self.pending) >= self.flush_size:
+            self.flush(db)
+    
+    def flush(self, db):
+        """Записать накопленные просмотры одной транзакцией"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            db.add_all(pending)
+            db.commit()
+            logger.debug(f"  💾 Сохранено {len(pending)} просмотров Stories (account_id={self.account_id})")
+        except Exception as e:
+            db.rollback()
+            logger.error(f"    ❌ Ошибка при сохранении просмотров в БД: {e}")
+
 
 class StoryViewer:
     """Класс для просмотра Stories участников групп"""
@@ -35,6 +102,7 @@ class StoryViewer:
     def __init__(self, client_manager, niche_config=None):
         self.client_manager = client_manager
         self.niche_config = niche_config or {}
+        self.peer_cache = get_peer_cache()
         
         # Получаем настройки из конфига ниши
         activity_config = self.niche_config.get('activity', {})
@@ -59,6 +127,26 @@ class StoryViewer:
         # Аккаунты для просмотра Stories контактов (вместо групп)
         self.contacts_view_accounts = set(activity_config.get('contacts_view_accounts', []))
         self.contacts_dialogs_limit = activity_config.get('contacts_dialogs_limit', 300)
+        
+        # Параллельная обработка аккаунтов
+        self.max_concurrent_accounts = activity_config.get('max_concurrent_accounts', 4)
+        self.max_accounts_per_proxy = activity_config.get('max_accounts_per_proxy', 1)
+        
+        # Чекпоинт цикла (logs/ доступен на запись в контейнере)
+        self.checkpoint_path = activity_config.get(
+            'checkpoint_path', os.getenv('ACTIVITY_CHECKPOINT_PATH', '/app/logs/activity_checkpoint.json')
+        )
+        self.checkpoint_max_age = activity_config.get('checkpoint_max_age_hours', 12)
+        
+        # Кэш списков участников групп (снимок рядом с чекпоинтом)
+        self.rosters = ParticipantRosterCache(
+            persist_path=activity_config.get(
+                'roster_cache_path', os.path.join(os.path.dirname(self.checkpoint_path), 'participant_rosters.json')
+            ),
+            ttl=activity_config.get('roster_ttl_hours', 12) * 3600,
+            refresh_interval=activity_config.get('roster_refresh_minutes', 60) * 60,
+        )
+        self.roster_refresh_limit = activity_config.get('roster_refresh_limit', 20)
     
     def get_viewed_stories_today(self, db, account_id: int) -> set:
         """
@@ -85,6 +173,29 @@ class StoryViewer:
         
         return {row[0] for row in viewed if row[0]}
     
+    def get_viewed_stories_recent(self, db, account_id: int, hours: int = 24) -> set:
+        """
+        Получить множество stories, просмотренных аккаунтом за последние N часов (один запрос)
+        
+        Args:
+            db: Сессия БД
+            account_id: ID аккаунта
+            hours: Количество часов
+        
+        Returns:
+            Множество story_id (формат: "{user_id}_{story_id}")
+        """
+        threshold = datetime.utcnow() - timedelta(hours=hours)
+        
+        viewed = db.query(StoryView.story_id).filter(
+            and_(
+                StoryView.account_id == account_id,
+                StoryView.viewed_at >= threshold
+            )
+        ).all()
+        
+        return {row[0] for row in viewed if row[0]}
+    
     def get_views_count_today(self, db, account_id: int) -> int:
         """
         Получить количество просмотров за сегодня для аккаунта
@@ -166,7 +277,69 @@ class StoryViewer:
             logger.warning(f"  ⚠️ Ошибка получения контактов из диалогов: {e}")
             return []
     
-    async def get_group_participants(self, client, group: Group, limit: int = 50) -> List:
+    def has_unseen_stories(self, user, ledger: Optional[StoryViewLedger] = None) -> bool:
+        """
+        Есть ли у пользователя живые stories, которые аккаунт еще не смотрел
+        
+        Проверка только по полям User (stories_max_id, stories_unavailable),
+        без запросов к API.
+        """
+        if getattr(user, 'bot', False) or getattr(user, 'deleted', False):
+            return False
+        if getattr(user, 'stories_unavailable', False):
+            return False
+        max_id = story_max_id(user)
+        if not max_id:
+            return False
+        return ledger is None or f"{user.id}_{max_id}" not in ledger
+    
+    async def get_story_feed_unread(self, client, max_pages: int = 5) -> Optional[set]:
+        """
+        ID пользователей с непросмотренными stories из ленты аккаунта (GetAllStoriesRequest)
+        
+        Лента содержит контакты с живыми stories и max_read_id по каждому,
+        поэтому одна-две страницы заменяют GetPeerStoriesRequest на каждый контакт.
+        
+        Returns:
+            Множество user_id или None, если ленту получить не удалось
+        """
+        unread = set()
+        state = None
+        try:
+            for _ in range(max_pages):
+                result = await client(GetAllStoriesRequest(next=state is not None, state=state))
+                for peer_stories in getattr(result, 'peer_stories', None) or []:
+                    user_id = getattr(peer_stories.peer, 'user_id', None)
+                    max_read_id = peer_stories.max_read_id or 0
+                    if user_id and any(story.id > max_read_id for story in peer_stories.stories):
+                        unread.add(user_id)
+                if not getattr(result, 'has_more', False):
+                    break
+                state = result.state
+        except FloodWaitError as e:
+            logger.warning(f"  ⏳ FloodWait {e.seconds} секунд для ленты Stories")
+            return None
+        except Exception as e:
+            logger.debug(f"  ⚠️ Не удалось получить ленту Stories: {str(e)[:80]}")
+            return None
+        return unread
+    
+    async def get_fresh_users(self, client, users: List) -> List:
+        """
+        Актуальные объекты User для участников из кэша (users.GetUsers, до 100 за запрос)
+        
+        Метаданные stories в кэше не хранятся, поэтому перед фильтром
+        has_unseen_stories их нужно получить заново.
+        """
+        fresh = []
+        for start in range(0, len(users), GET_USERS_BATCH):
+            chunk = users[start:start + GET_USERS_BATCH]
+            result = await client(GetUsersRequest(id=[InputUser(u.id, u.access_hash) for u in chunk]))
+            fresh.extend(u for u in result if isinstance(u, User))
+        return fresh
+    
+    async def get_group_participants(self, client, group: Group, limit: int = 50,
+                                     account_name: Optional[str] = None) -> List:
         """
         Получить участников группы
         
@@ -174,13 +347,35 @@ class StoryViewer:
             client: Telegram клиент
             group: Группа из БД
             limit: Максимум участников
+            account_name: session_name аккаунта клиента (для кэша peer'ов и списков участников)
         
         Returns:
-            Список участников
+            Список участников с актуальными метаданными stories
         """
         try:
-            entity = await client.get_entity(group.username)
-            participants = await client.get_participants(entity, limit=limit)
+            if account_name and not self.rosters.needs_refresh(account_name, group.username):
+                # Список свежий - участников не запрашиваем, только их метаданные
+                participants = await self.get_fresh_users(
+                    client, self.rosters.get(account_name, group.username)[-limit:]
+                )
+                logger.debug(f"  📦 Участники {group.username} из кэша ({len(participants)})")
+            else:
+                if account_name:
+                    entity = await self.peer_cache.resolve(client, account_name, group.username)
+                else:
+                    entity = await client.get_entity(group.username)
+                
+                if account_name and not self.rosters.needs_full_load(account_name, group.username):
+                    # Дополняем известный список недавно вступившими
+                    recent = await client.get_participants(entity, limit=self.roster_refresh_limit)
+                    self.rosters.merge(account_name, group.username, recent)
+                    participants = await self.get_fresh_users(
+                        client, self.rosters.get(account_name, group.username)[-limit:]
+                    )
+                else:
+                    participants = await client.get_participants(entity, limit=limit)
+                    if account_name:
+                        self.rosters.replace(account_name, group.username, participants)
             
             # Фильтруем ботов и пользователей без ID
             filtered = [
@@ -192,6 +387,10 @@ class StoryViewer:
             return filtered
             
         except (ChannelPrivateError, ChatAdminRequiredError, UserNotParticipantError) as e:
+            if account_name:
+                self.rosters.invalidate(account_name, group.username)
+                if isinstance(e, ChannelPrivateError):
+                    self.peer_cache.invalidate(account_name, group.username)
             logger.debug(f"  ⚠️ Не удалось получить участников из {group.username}: {e}")
             return []
         except Exception as e:
@@ -201,9 +400,10 @@ class StoryViewer:
     async def view_user_stories(
         self,
         client,
-        account: Account,
+        account: Union[Account, AccountRef],
         user,
-        group: Optional[Group] = None
+        group: Optional[Group] = None,
+        ledger: Optional[StoryViewLedger] = None
     ) -> Tuple[int, int]:
         """
         Просмотр Stories конкретного пользователя
@@ -213,6 +413,7 @@ class StoryViewer:
             account: Аккаунт из БД
             user: Пользователь Telegram
             group: Группа из БД
+            ledger: Просмотры аккаунта за цикл (если None - загружается и сохраняется здесь же)
         
         Returns:
             (viewed_count: int, reactions_count: int)
@@ -237,14 +438,15 @@ class StoryViewer:
                 if not stories:
                     return 0, 0
                 
-                # Проверяем в БД, какие stories уже просмотрены
-                db = SessionLocal()
+                own_ledger = ledger is None
+                if own_ledger:
+                    ledger = self.load_ledger(account.id)
                 try:
                     for story in stories:
                         story_key = f"{user.id}_{story.id}"
                         
-                        # Проверяем, был ли просмотрен за последние 24 часа
-                        if self.was_story_viewed_recently(db, account.id, user.id, story.id, hours=24):
+                        # Проверяем, был ли просмотрен за последние 24 часа (множество в памяти)
+                        if story_key in ledger:
                             continue
                         
                         # Пропускаем с вероятностью
@@ -316,8 +518,7 @@ class StoryViewer:
                             except Exception as e:
                                 logger.debug(f"    ⚠️ Не удалось поставить реакцию: {str(e)[:50]}")
                         
-                        db.add(story_view)
-                        db.commit()
+                        ledger.record(story_view)
                         viewed_count += 1
                         
                         username = getattr(user, 'username', None) or f"ID{user.id}"
@@ -329,11 +530,9 @@ class StoryViewer:
                         # Задержка между просмотрами
                         await asyncio.sleep(random.randint(self.MIN_DELAY_BETWEEN_VIEWS, self.MAX_DELAY_BETWEEN_VIEWS))
                         
-                except Exception as e:
-                    db.rollback()
-                    logger.error(f"    ❌ Ошибка при сохранении в БД: {e}")
                 finally:
-                    db.close()
+                    if own_ledger:
+                        self.flush_ledger(ledger)
                 
                 return viewed_count, reactions_count
                 
@@ -351,6 +550,24 @@ class StoryViewer:
             logger.debug(f"    ⚠️ Ошибка при просмотре Stories: {str(e)[:50]}")
             return 0, 0
     
+    def load_ledger(self, account_id: int, hours: int = 24) -> StoryViewLedger:
+        """Загрузить просмотры аккаунта за последние N часов в память"""
+        db = new_session()
+        try:
+            return StoryViewLedger(account_id, self.get_viewed_stories_recent(db, account_id, hours=hours))
+        finally:
+            db.close()
+    
+    def flush_ledger(self, ledger: StoryViewLedger):
+        """Записать накопленные просмотры в отдельной сессии"""
+        if not ledger.pending:
+            return
+        db = new_session()
+        try:
+            ledger.flush(db)
+        finally:
+            db.close()
+    
     def get_active_groups_for_account(self, db, account_id: int, limit: int = 20) -> List[Group]:
         """
         Получить активные группы, закрепленные за аккаунтом
@@ -373,12 +590,12 @@ class StoryViewer:
         
         return groups
     
-    async def process_account(self, account: Account) -> Tuple[int, int]:
+    async def process_account(self, account: Union[Account, AccountRef]) -> Tuple[int, int]:
         """
         Обработка одного аккаунта: просмотр Stories участников его групп
         
         Args:
-            account: Аккаунт из БД
+            account: Аккаунт из БД или его AccountRef
         
         Returns:
             (total_viewed: int, total_reactions: int)
@@ -397,7 +614,8 @@ class StoryViewer:
                 logger.warning(f"⚠️ Не удалось подключить клиент {account.session_name}, пропускаем")
                 return 0, 0
         
-        db = SessionLocal()
+        db = new_session()
+        ledger = None
         try:
             # Проверяем лимит просмотров за сегодня
             views_today = self.get_views_count_today(db, account.id)
@@ -412,6 +630,9 @@ class StoryViewer:
             total_viewed = 0
             total_reactions = 0
             
+            # Все просмотры аккаунта за 24 часа - одним запросом на цикл
+            ledger = StoryViewLedger(account.id, self.get_viewed_stories_recent(db, account.id, hours=24))
+            
             # Проверяем, является ли аккаунт аккаунтом для просмотра контактов
             if account.session_name in self.contacts_view_accounts:
                 # Режим просмотра Stories контактов (диалогов)
@@ -426,6 +647,17 @@ class StoryViewer:
                 
                 logger.info(f"  📋 Аккаунт {account.session_name}: найдено {len(contacts)} контактов")
                 
+                # Оставляем только контакты с непросмотренными stories:
+                # по ленте Stories, а если она недоступна - по метаданным User
+                feed_unread = await self.get_story_feed_unread(client)
+                if feed_unread is not None:
+                    contacts = [c for c in contacts if c.id in feed_unread and f"{c.id}_{story_max_id(c)}" not in ledger]
+                else:
+                    contacts = [c for c in contacts if self.has_unseen_stories(c, ledger)]
+                logger.info(f"  📋 Аккаунт {account.session_name}: {len(contacts)} контактов с новыми Stories")
+                if not contacts:
+                    return 0, 0
+                
                 # Перемешиваем для разнообразия
                 random.shuffle(contacts)
                 
@@ -438,7 +670,8 @@ class StoryViewer:
                         break
                     
                     # Просматриваем Stories (group=None для контактов)
-                    viewed, reactions = await self.view_user_stories(client, account, contact, group=None)
+                    viewed, reactions = await self.view_user_stories(client, account, contact, group=None, ledger=ledger)
+                    ledger.maybe_flush(db)
                     total_viewed += viewed
                     total_reactions += reactions
                     processed_count += viewed
@@ -465,9 +698,15 @@ class StoryViewer:
                         logger.info(f"  🎯 Группа: {group.username}")
                         
                         # Получаем участников группы
-                        participants = await self.get_group_participants(client, group, limit=30)
+                        # Берем больше участников (один запрос), но Stories запрашиваем
+                        # только у тех, у кого по метаданным есть непросмотренные
+                        participants = await self.get_group_participants(
+                            client, group, limit=100, account_name=account.session_name
+                        )
+                        participants = [p for p in participants if self.has_unseen_stories(p, ledger)]
                         
                         if not participants:
+                            logger.info(f"  ℹ️ Группа {group.username}: нет участников с новыми Stories")
                             continue
                         
                         # Перемешиваем для разнообразия
@@ -482,7 +721,10 @@ class StoryViewer:
                                 break
                             
                             # Просматриваем Stories
-                            viewed, reactions = await self.view_user_stories(client, account, participant, group)
+                            viewed, reactions = await self.view_user_stories(
+                                client, account, participant, group, ledger=ledger
+                            )
+                            ledger.maybe_flush(db)
                             total_viewed += viewed
                             total_reactions += reactions
                             processed_count += viewed
@@ -508,25 +750,69 @@ class StoryViewer:
             logger.error(f"  ❌ Ошибка при обработке аккаунта {account.session_name}: {e}", exc_info=True)
             return 0, 0
         finally:
+            if ledger is not None:
+                ledger.flush(db)
             db.close()
     
+    def _load_checkpoint(self) -> dict:
+        """
+        Прогресс незавершенного цикла (аккаунты, уже обработанные в нем)
+        
+        Чекпоинт старше checkpoint_max_age часов считается устаревшим - начинаем новый цикл.
+        """
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            started_at = datetime.fromisoformat(checkpoint['started_at'])
+            if datetime.utcnow() - started_at < timedelta(hours=self.checkpoint_max_age):
+                return checkpoint
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось прочитать чекпоинт {self.checkpoint_path}: {e}")
+        return {'started_at': datetime.utcnow().isoformat(), 'done': {}}
+    
+    def _save_checkpoint(self, checkpoint: Optional[dict]):
+        """Сохранить прогресс цикла атомарно (None - цикл завершен, чекпоинт удаляется)"""
+        try:
+            if checkpoint is None:
+                if os.path.exists(self.checkpoint_path):
+                    os.remove(self.checkpoint_path)
+                return
+            os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+            tmp_path = f"{self.checkpoint_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить чекпоинт {self.checkpoint_path}: {e}")
+    
     async def process_all_accounts(self) -> Tuple[int, int]:
         """
         Обработка всех активных аккаунтов
         
+        Аккаунты работают параллельно, каждый со своими паузами: одновременно
+        не больше max_concurrent_accounts и не больше max_accounts_per_proxy
+        на один прокси. После каждого аккаунта прогресс пишется в чекпоинт,
+        поэтому после перезапуска цикл продолжается с необработанных аккаунтов.
+        
         Returns:
             (total_viewed: int, total_reactions: int)
         """
-        db = SessionLocal()
+        db = new_session()
         try:
-            # Получаем активные аккаунты
-            accounts = db.query(Account).filter(Account.status == 'active').all()
+            # Получаем активные аккаунты (копируем поля, чтобы задачи аккаунтов
+            # не зависели от ORM-объектов этой сессии)
+            accounts = [
+                AccountRef(id=a.id, session_name=a.session_name, proxy=a.proxy)
+                for a in db.query(Account).filter(Account.status == 'active').all()
+            ]
             
             if not accounts:
                 logger.warning("⚠️ Нет активных аккаунтов")
                 return 0, 0
             
-            # Сначала прогоняем аккаунты для контактов/сторис, чтобы активность
+            # Сначала запускаем аккаунты для контактов/сторис, чтобы активность
             # была "видимой" быстрее, а затем остальные.
             contacts_accounts = [
                 a for a in accounts if a.session_name in self.contacts_view_accounts
@@ -535,32 +821,73 @@ class StoryViewer:
                 a for a in accounts if a.session_name not in self.contacts_view_accounts
             ]
             ordered_accounts = [*contacts_accounts, *other_accounts]
-
-            logger.info(f"📋 Обработка {len(accounts)} активных аккаунтов...")
             
-            total_viewed = 0
-            total_reactions = 0
+            checkpoint = self._load_checkpoint()
+            done = checkpoint['done']
+            pending_accounts = [a for a in ordered_accounts if a.session_name not in done]
+            if done:
+                logger.info(
+                    f"♻️ Продолжаем цикл от {checkpoint['started_at']}: "
+                    f"{len(done)} аккаунтов уже обработано, осталось {len(pending_accounts)}"
+                )
+            
+            logger.info(
+                f"📋 Обработка {len(pending_accounts)} активных аккаунтов "
+                f"(параллельно до {self.max_concurrent_accounts}, до {self.max_accounts_per_proxy} на прокси)..."
+            )
+            
+            global_slots = asyncio.Semaphore(max(1, self.max_concurrent_accounts))
+            proxy_slots = {}
             
-            for account in ordered_accounts:
+            async def run_account(account: AccountRef, index: int):
+                # Если клиент не загрузился (часто из-за AuthKeyDuplicatedError),
+                # пропускаем без задержек.
+                if account.session_name not in self.client_manager.clients:
+                    logger.warning(
+                        f"⚠️ Клиент {account.session_name} не загружен, пропускаем"
+                    )
+                    return
+                
+                # Прямое подключение (без прокси) ограничено только общим лимитом
+                proxy_slot = None
+                if account.proxy:
+                    proxy_slot = proxy_slots.setdefault(
+                        account.proxy, asyncio.Semaphore(max(1, self.max_accounts_per_proxy))
+                    )
+                
                 try:
-                    # Если клиент не загрузился (часто из-за AuthKeyDuplicatedError),
-                    # пропускаем без задержек.
-                    if account.session_name not in self.client_manager.clients:
-                        logger.warning(
-                            f"⚠️ Клиент {account.session_name} не загружен, пропускаем"
-                        )
-                        continue
-
-                    viewed, reactions = await self.process_account(account)
-                    total_viewed += viewed
-                    total_reactions += reactions
+                    if proxy_slot:
+                        await proxy_slot.acquire()
+                    try:
+                        async with global_slots:
+                            # Небольшой разброс старта, чтобы аккаунты не начинали одновременно
+                            if index:
+                                await asyncio.sleep(random.uniform(5, 30))
+                            viewed, reactions = await self.process_account(account)
+                    finally:
+                        if proxy_slot:
+                            proxy_slot.release()
                     
-                    # Задержка между аккаунтами (умеренная, т.к. внутри уже есть задержки)
-                    await asyncio.sleep(random.randint(30, 90))
+                    done[account.session_name] = {'viewed': viewed, 'reactions': reactions}
+                    self._save_checkpoint(checkpoint)
+                    self.rosters.save()
                     
                 except Exception as e:
                     logger.error(f"❌ Ошибка при обработке аккаунта {account.session_name}: {e}", exc_info=True)
-                    continue
+            
+            results = await asyncio.gather(
+                *(run_account(account, index) for index, account in enumerate(pending_accounts)),
+                return_exceptions=True,
+            )
+            for account, result in zip(pending_accounts, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"❌ Ошибка при обработке аккаунта {account.session_name}: {result}", exc_info=result)
+            
+            total_viewed = sum(result['viewed'] for result in done.values())
+            total_reactions = sum(result['reactions'] for result in done.values())
+            
+            # Цикл завершен - следующий начнется с начала
+            self._save_checkpoint(None)
             
             logger.info(f"✅ Все аккаунты обработаны: {total_viewed} просмотров, {total_reactions} реакций")
             
@@ -571,4 +898,3 @@ class StoryViewer:
             return 0, 0
         finally:
             db.close()
-
@@ -0,0 +1,54 @@
+"""
+Полосы постинга: у каждого аккаунта своя очередь, свои паузы и свой FloodWait
+"""
+import asyncio
+import time
+from typing import Dict
+
+
+class AccountLane:
+    """Очередь постинга одного аккаунта"""
+
+    def __init__(self, session_name: str):
+        self.session_name = session_name
+        self.lock = asyncio.Lock()
+        self.ready_at = 0.0  # time.monotonic(), раньше которого аккаунт не постит
+        self.pending = 0     # сколько постов ждут этот аккаунт
+
+    def pause(self, seconds: float):
+        """Отложить следующий пост аккаунта (пауза между постами или FloodWait)"""
+        self.ready_at = max(self.ready_at, time.monotonic() + seconds)
+
+    async def wait_ready(self):
+        """Дождаться окончания паузы аккаунта"""
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @property
+    def load(self) -> tuple:
+        """Ключ сортировки: сначала аккаунты с меньшей очередью и более ранней готовностью"""
+        return (self.pending, self.ready_at)
+
+
+class LaneScheduler:
+    """
+    Распределение постов по полосам аккаунтов
+
+    Посты одного аккаунта идут последовательно с его паузами,
+    разные аккаунты постят параллельно (не более max_concurrency одновременно).
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self.lanes: Dict[str, AccountLane] = {}
+        self.slots = asyncio.Semaphore(max(1, max_concurrency))
+
+    def lane(self, session_name: str) -> AccountLane:
+        lane = self.lanes.get(session_name)
+        if lane is None:
+            lane = self.lanes[session_name] = AccountLane(session_name)
+        return lane
+
+    def load(self, session_name: str) -> tuple:
+        lane = self.lanes.get(session_name)
+        return lane.load if lane else (0, 0.0)
@@ -45,7 +45,10 @@ async def main():
         batch_size = int(sys.argv[2])
         logger.info(f"🟡 One-shot mode: niche={niche}, batch_size={batch_size}")
         poster = SmartPoster(niche=niche)
-        await poster.run_batch(batch_size=batch_size)
+        try:
+            await poster.run_batch(batch_size=batch_size)
+        finally:
+            await poster.close()
         logger.info("✅ One-shot mode completed")
         return
 
@@ -0,0 +1,128 @@
+"""
+Планировщик батча постинга: выбор аккаунтов в памяти и отложенная запись результатов
+
+Аккаунты и блоклист загружаются один раз на батч, а посты, счетчики групп,
+новые связки блоклиста и изменения групп копятся в буфере и записываются
+короткими транзакциями каждые flush_every постов и в конце батча. Если запись
+не удалась, буфер сохраняется до следующей попытки.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from lexus_db.db_manager import DbManager
+from lexus_db.models import Account
+
+logger = logging.getLogger(__name__)
+
+# Поля группы, которые постер меняет по ходу батча
+TARGET_UPDATE_FIELDS = ('status', 'can_post', 'assigned_account_id', 'updated_at')
+
+
+class BatchPlanner:
+    """Состояние батча: доступные аккаунты, блоклист и буфер результатов"""
+
+    def __init__(
+        self,
+        db_manager: DbManager,
+        allowed_sessions: Optional[List[str]] = None,
+        flush_every: int = 10
+    ):
+        """
+        Args:
+            db_manager: Менеджер БД с сессией батча
+            allowed_sessions: Whitelist session_name (None = все активные аккаунты)
+            flush_every: Через сколько накопленных постов записывать буфер в БД
+        """
+        self.db_manager = db_manager
+        self.allowed_sessions = allowed_sessions
+        self.flush_every = max(1, flush_every)
+        self.accounts: List[Account] = []
+        self.blocked: Dict[int, set] = {}
+        self._pending_posts: List[Dict] = []
+        self._pending_blocks: List[Dict] = []
+        self._pending_targets: Dict[int, Dict] = {}
+        self._flush_lock = asyncio.Lock()
+
+    async def load(self, group_ids: List[int]):
+        """Загрузить аккаунты и блоклист для групп батча (два запроса)"""
+        self.accounts = await self.db_manager.get_posting_accounts(self.allowed_sessions)
+        self.blocked = await self.db_manager.get_blocklist_pairs(group_ids)
+        logger.info(
+            f"🗂️  Planner: {len(self.accounts)} accounts, "
+            f"{sum(len(ids) for ids in self.blocked.values())} blocklist pairs for {len(group_ids)} groups"
+        )
+
+    def candidates(self, group_id: int) -> List[Account]:
+        """Аккаунты, которые не в блоклисте для группы"""
+        blocked = self.blocked.get(group_id, set())
+        return [account for account in self.accounts if account.id not in blocked]
+
+    def block(self, group_id: int, account_id: int, reason: str):
+        """Добавить связку в блоклист (сразу в памяти, в БД - при flush)"""
+        blocked = self.blocked.setdefault(group_id, set())
+        if account_id in blocked:
+            return
+        blocked.add(account_id)
+        self._pending_blocks.append({"group_id": group_id, "account_id": account_id, "reason": reason[:500]})
+
+    def record_post(
+        self,
+        account_id: int,
+        target_id: int,
+        message_content: Optional[str] = None,
+        photo_path: Optional[str] = None,
+        status: str = 'success',
+        error_message: Optional[str] = None
+    ):
+        """Запомнить результат поста (параметры как у DbManager.record_post)"""
+        self._pending_posts.append({
+            "account_id": account_id,
+            "target_id": target_id,
+            "message_content": message_content,
+            "photo_path": photo_path,
+            "status": status,
+            "error_message": error_message,
+            "sent_at": datetime.utcnow(),
+        })
+
+    def update_target(self, target, **fields: Any):
+        """Изменить поля группы (сразу в объекте, в БД - при flush)"""
+        for name, value in fields.items():
+            setattr(target, name, value)
+        self._pending_targets[target.id] = {
+            "target_id": target.id,
+            **{name: getattr(target, name) for name in TARGET_UPDATE_FIELDS},
+        }
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending_posts) + len(self._pending_blocks) + len(self._pending_targets)
+
+    async def maybe_flush(self) -> bool:
+        """Записать буфер, если накопилось flush_every постов"""
+        if len(self._pending_posts) < self.flush_every:
+            return True
+        return await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Записать накопленные посты, счетчики, блоклист и изменения групп одной транзакцией
+
+        При ошибке записи все вернется в буфер и будет записано следующим flush.
+        """
+        async with self._flush_lock:
+            if not self.pending:
+                return True
+            posts, blocks, targets = self._pending_posts, self._pending_blocks, self._pending_targets
+            self._pending_posts, self._pending_blocks, self._pending_targets = [], [], {}
+            if await self.db_manager.record_posts_bulk(posts, blocks, list(targets.values())):
+                return True
+            # Возвращаем в буфер перед тем, что накопилось во время записи
+            self._pending_posts = posts + self._pending_posts
+            self._pending_blocks = blocks + self._pending_blocks
+            for target_id, row in targets.items():
+                self._pending_targets.setdefault(target_id, row)
+            logger.warning(f"⚠️ Planner: запись не удалась, в буфере {self.pending} записей")
+            return False
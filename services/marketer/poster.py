@@ -10,7 +10,7 @@ import os
 import random
 import sys
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set, Tuple
 from pathlib import Path
 
 # Добавляем корень проекта в путь
@@ -29,7 +29,13 @@ from telethon.errors import (
 from lexus_db.session import AsyncSessionLocal
 from lexus_db.models import Account, Target
 from lexus_db.db_manager import DbManager
-from sqlalchemy import select, and_, or_, text
+from shared.telegram.client_manager import TelegramClientManager
+from shared.telegram.client_pool import TelegramClientPool
+from shared.telegram.media_cache import get_media_cache
+from shared.telegram.peer_cache import INVALIDATING_ERRORS as PEER_INVALIDATING_ERRORS, get_peer_cache
+from services.marketer.lanes import LaneScheduler
+from services.marketer.planner import BatchPlanner
+from sqlalchemy import select, and_, or_
 
 logging.basicConfig(
     level=logging.INFO,
@@ -45,11 +51,18 @@ logger = logging.getLogger(__name__)
 class SmartPoster:
     """Класс для публикации рекламных постов в группы"""
     
-    def __init__(self, niche: str, config_path: str = '/app/config/marketing_posts.json'):
+    def __init__(
+        self,
+        niche: str,
+        config_path: str = '/app/config/marketing_posts.json',
+        client_manager: Optional[TelegramClientManager] = None
+    ):
         """
         Args:
             niche: Ниша для постинга (например, 'ukraine_cars', 'bali_rent')
             config_path: Путь к файлу с конфигурацией постов
+            client_manager: Менеджер клиентов, уже подключенные клиенты которого
+                            переиспользуются пулом (если None - создается свой)
         """
         self.niche = niche
         self.config_path = Path(config_path)
@@ -62,6 +75,22 @@ class SmartPoster:
         self.group_niches = self._load_group_niches()
         # Загружаем сообщения с категориями для релевантного выбора
         self.messages_by_category = self._load_messages_by_category()
+        # Пул подключенных клиентов: один handshake на аккаунт вместо одного на пост
+        self.client_pool = TelegramClientPool(client_manager)
+        # Кэш username -> peer по аккаунтам (общий с другими сервисами через sessions/)
+        self.peer_cache = get_peer_cache()
+        # (session_name, группа), куда аккаунт успешно вступил в этом процессе.
+        # Кэш peer общий и наполняется resolve/диалогами, поэтому членство он не подтверждает.
+        self.joined_groups: Set[Tuple[str, str]] = set()
+        # Фото кампании загружается один раз на аккаунт, дальше отправляется по ссылке
+        self.media_cache = get_media_cache()
+        # Полосы аккаунтов пересоздаются на каждый батч (см. run_batch)
+        self.lanes = LaneScheduler()
+    
+    async def close(self):
+        """Отключить все клиенты пула"""
+        logger.info(f"🔌 Closing client pool (stats: {self.client_pool.stats})")
+        await self.client_pool.close()
     
     def _load_posts(self) -> List[Dict]:
         """
@@ -407,7 +436,369 @@ class SmartPoster:
             logger.error(f"❌ Failed to create client for {session_name}: {e}")
             return None
     
-    async def run_batch(self, batch_size: int = 10):
+    def _resolve_image_path(self, image_path: Optional[str]) -> Optional[str]:
+        """Найти файл фото для поста (с учетом путей ассетов ниши)"""
+        if not image_path:
+            return None
+
+        # Bali: никогда не используем lexus_assets (иногда попадали ошибочно в messages.json)
+        if self.niche == "bali" and str(image_path).startswith("lexus_assets/"):
+            logger.warning(f"  ⚠️ Ignoring lexus photo for Bali: {image_path}")
+            return None
+
+        if Path(image_path).exists():
+            return image_path
+
+        # Важно: для Bali ищем только в bali_assets/assets; для Ukraine допускаем lexus_assets.
+        possible_paths = [Path(image_path), Path("/app") / image_path]
+
+        if self.niche == "bali":
+            possible_paths.extend(
+                [
+                    Path("/app/bali_assets") / str(image_path).replace("bali_assets/", ""),
+                    Path("/app/assets") / str(image_path).replace("bali_assets/", ""),
+                ]
+            )
+        else:
+            possible_paths.extend(
+                [
+                    Path("/app/lexus_assets")
+                    / str(image_path).replace("lexus_assets/", ""),
+                    Path("/app/assets")
+                    / str(image_path).replace("lexus_assets/", ""),
+                    Path("/app/data/ukraine/assets")
+                    / str(image_path).replace("lexus_assets/", ""),
+                ]
+            )
+        for pth in possible_paths:
+            if pth.exists():
+                logger.info(f"  🔍 Found photo at: {pth}")
+                return str(pth)
+
+        logger.warning(f"  ⚠️ Photo not found: {image_path}, sending text only")
+        return None
+
+    def _pick_post_content(self, group_username: str) -> Optional[Dict]:
+        """Выбрать текст и фото поста для группы (один раз на все попытки)"""
+        relevant_messages = self._get_relevant_messages(group_username)
+        if not relevant_messages:
+            return None
+
+        post_content = random.choice(relevant_messages)
+        text_msg = post_content.get('text', '')
+        image_path = post_content.get('image') or post_content.get('photo')
+
+        # Для Бали: если сообщение по недвижимости без фото — подставляем дефолтные изображения апартов
+        if not image_path and self.niche == "bali":
+            source_file = post_content.get("source_file", "")
+            if source_file in {
+                "messages_rental_property.txt",
+                "messages_sale_property.txt",
+                "messages_housing.txt",
+            }:
+                default_apartment_photos = [
+                    "/app/bali_assets/apart/apart_investment_collage_ru.jpg",
+                    "/app/bali_assets/apart/apart_investment_variant_1_ru.jpg",
+                    "/app/bali_assets/apart/apart_investment_variant_2_ru.jpg",
+                    "/app/bali_assets/apart/apart_investment_variant_3_ru.jpg",
+                    "/app/bali_assets/apart/apart_investment_variant_4_ru.jpg",
+                ]
+                image_path = random.choice(default_apartment_photos)
+
+        return {'text': text_msg, 'image': image_path}
+
+    def _allowed_sessions(self) -> Optional[List[str]]:
+        """Whitelist аккаунтов ниши (None = все active)"""
+        if self.niche == "bali" and self.bali_allowed_accounts:
+            return sorted(self.bali_allowed_accounts)
+        return None
+
+    def _select_account(self, planner: BatchPlanner, target, tried_ids: set) -> Optional[Account]:
+        """
+        Выбрать аккаунт для группы, исключая блоклист (без запросов к БД)
+
+        Привязанный аккаунт группы в приоритете; иначе берется аккаунт
+        с самой короткой очередью, чтобы посты расходились по полосам.
+        """
+        accounts = planner.candidates(target.id)
+        if not accounts:
+            return None
+
+        preferred_id = getattr(target, "assigned_account_id", None)
+        # Сначала пробуем аккаунты, которые еще не пробовали для этой группы
+        candidates = [account for account in accounts if account.id not in tried_ids] or accounts
+        for account in candidates:
+            if preferred_id is not None and account.id == preferred_id:
+                return account
+        return min(candidates, key=lambda account: (self.lanes.load(account.session_name), account.id))
+
+    async def _send_post(self, account: Account, group_username: str, text_msg: str, image_path: Optional[str]) -> bool:
+        """
+        Отправить пост в полосе аккаунта
+
+        Ждет паузу аккаунта, занимает глобальный слот и отправляет пост.
+        Исключения Telethon пробрасываются вызывающему.
+
+        Returns:
+            False если не удалось получить клиент
+        """
+        lane = self.lanes.lane(account.session_name)
+        lane.pending += 1
+        try:
+            async with lane.lock:
+                await lane.wait_ready()
+                async with self.lanes.slots:
+                    client = await self.client_pool.acquire(
+                        account.session_name,
+                        lambda: self.create_client(account)
+                    )
+                    if not client:
+                        return False
+
+                    try:
+                        username = group_username.lstrip("@")
+
+                        joined_key = (account.session_name, username.lower())
+                        # peer из кэша избавляет от resolve username, но не означает членства
+                        peer = self.peer_cache.get(account.session_name, username)
+                        if joined_key not in self.joined_groups:
+                            # ВАЖНО: сначала вступаем (для участника это no-op)
+                            try:
+                                updates = await client(JoinChannelRequest(peer or username))
+                                self.joined_groups.add(joined_key)
+                                joined_chats = getattr(updates, 'chats', None)
+                                if joined_chats:
+                                    peer = joined_chats[0]
+                                    self.peer_cache.put(account.session_name, username, peer)
+                            except Exception:
+                                pass
+
+                        full_image_path = self._resolve_image_path(image_path)
+                        if full_image_path:
+                            await self.media_cache.send_file(
+                                client, account.session_name, peer or username, full_image_path, caption=text_msg
+                            )
+                        else:
+                            await client.send_message(peer or username, text_msg)
+                    except FloodWaitError as e:
+                        lane.pause(e.seconds)
+                        raise
+                    except PEER_INVALIDATING_ERRORS:
+                        # Группа переименована/стала приватной - следующая попытка разрешит заново
+                        self.peer_cache.invalidate(account.session_name, username)
+                        self.joined_groups.discard((account.session_name, username.lower()))
+                        lane.pause(5)
+                        raise
+                    except Exception:
+                        # Например, аккаунт исключили из группы - в следующий раз вступаем заново
+                        self.joined_groups.discard((account.session_name, username.lower()))
+                        lane.pause(5)
+                        raise
+                    finally:
+                        # Клиент остается подключенным в пуле для следующих постов
+                        self.client_pool.release(account.session_name)
+
+                pause_seconds = random.randint(30, 60)
+                logger.info(
+                    f"  ⏸️  Пауза {pause_seconds} сек перед следующим постом {account.session_name}..."
+                )
+                lane.pause(pause_seconds)
+                return True
+        finally:
+            lane.pending -= 1
+
+    async def _post_to_target(self, planner: BatchPlanner, target, idx: int, total: int) -> Dict[str, int]:
+        """
+        Опубликовать пост в одну группу, перебирая аккаунты до успеха
+
+        Результаты, блоклист и изменения группы копятся в planner и пишутся в БД
+        каждые planner.flush_every постов.
+
+        Returns:
+            Счетчики {'posted': ..., 'errors': ...}
+        """
+        stats = {'posted': 0, 'errors': 0}
+
+        # Получаем username напрямую, чтобы избежать lazy loading
+        group_username = target.username if hasattr(target, 'username') else getattr(target, 'link', 'unknown')
+        logger.info(f"📋 [{idx}/{total}] Группа: {group_username}")
+
+        # Выбираем контент для постинга один раз (для повторных попыток разными аккаунтами)
+        post_content = self._pick_post_content(group_username)
+        if not post_content:
+            logger.error(f"  ❌ Нет релевантных сообщений для группы {target.link}")
+            stats['errors'] += 1
+            return stats
+
+        text_msg = post_content['text']
+        image_path = post_content['image']
+
+        if not text_msg:
+            logger.warning("  ⚠️ Пустой текст поста, пропускаем")
+            stats['errors'] += 1
+            return stats
+
+        logger.info(f"  📝 [{group_username}] Текст поста: {text_msg[:50]}...")
+        if image_path:
+            logger.info(f"  🖼️  [{group_username}] Фото: {image_path}")
+
+        # РОТАЦИЯ ДО ПОБЕДНОГО: пробуем группу разными аккаунтами, пока не получится
+        attempt = 0
+        max_attempts = max(1, len(self.bali_allowed_accounts)) if self.niche == "bali" else 5
+        success_for_group = False
+        tried_ids = set()
+
+        while attempt < max_attempts and not success_for_group:
+            attempt += 1
+
+            account = self._select_account(planner, target, tried_ids)
+            if not account:
+                logger.warning(
+                    f"  ⚠️ Нет доступных аккаунтов для группы {group_username} "
+                    f"(все в блоклисте). Перевожу группу в 'no_accounts_left'."
+                )
+                planner.update_target(target, status="no_accounts_left", updated_at=datetime.utcnow())
+                stats['errors'] += 1
+                break
+            tried_ids.add(account.id)
+
+            logger.info(
+                f"  👤 [{group_username}] Попытка {attempt}/{max_attempts}: "
+                f"аккаунт {account.session_name} (id={account.id})"
+            )
+
+            # Для Ukraine используем только Ukraine аккаунты
+            if self.niche == "ukraine_cars":
+                ukraine_accounts = [
+                    "promotion_dao_bro",
+                    "promotion_alex_ever",
+                    "promotion_rod_shaihutdinov",
+                ]
+                if account.session_name not in ukraine_accounts:
+                    logger.warning(
+                        f"  ⚠️ Аккаунт {account.session_name} не является Ukraine аккаунтом, "
+                        "пробуем следующий"
+                    )
+                    # баним связку, чтобы не выбирать его снова для этой группы
+                    planner.block(target.id, account.id, "ukraine_account_not_allowed")
+                    continue
+
+            try:
+                sent = await self._send_post(account, group_username, text_msg, image_path)
+                if not sent:
+                    logger.error(f"  ❌ Не удалось создать клиент для {account.session_name}")
+                    planner.block(target.id, account.id, "client_create_failed")
+                    stats['errors'] += 1
+                    continue
+
+                logger.info(
+                    f"  ✅ Пост отправлен в {group_username} (account={account.session_name})"
+                )
+
+                planner.record_post(
+                    account_id=account.id,
+                    target_id=target.id,
+                    message_content=text_msg[:1000],
+                    photo_path=image_path,
+                    status="success",
+                )
+
+                # Обновляем "последний успешный" аккаунт для группы
+                planner.update_target(target, assigned_account_id=account.id, updated_at=datetime.utcnow())
+
+                stats['posted'] += 1
+                success_for_group = True
+
+            except FloodWaitError as e:
+                wait_seconds = e.seconds
+                logger.warning(
+                    f"  ⏳ FloodWait {wait_seconds} сек для аккаунта {account.session_name}"
+                )
+                planner.record_post(
+                    account_id=account.id,
+                    target_id=target.id,
+                    message_content=text_msg[:1000] if text_msg else None,
+                    status="flood_wait",
+                    error_message=f"FloodWait: {wait_seconds} seconds",
+                )
+                stats['errors'] += 1
+
+            except (ChatWriteForbiddenError, UserBannedInChannelError) as e:
+                error_msg = f"Запрещено писать в группе: {str(e)}"
+                logger.error(f"  🚫 [{group_username}] {error_msg}")
+
+                planner.block(target.id, account.id, error_msg)
+                planner.record_post(
+                    account_id=account.id,
+                    target_id=target.id,
+                    status="error",
+                    error_message=error_msg,
+                )
+                stats['errors'] += 1
+
+            except RPCError as e:
+                error_msg = f"RPC Error: {str(e)}"
+                logger.error(f"  ❌ [{group_username}] {error_msg}")
+
+                error_str = str(e).lower()
+                
+                # Блокирующие ошибки - группа недоступна для постинга ВООБЩЕ
+                blocking_errors = [
+                    "allow_payment_required",  # Требуется оплата
+                    "chat_send_plain_forbidden",  # Текстовые сообщения запрещены
+                    "topic_closed",  # Топики закрыты (для форумов)
+                ]
+                
+                is_blocking_error = any(
+                    blocking_err in error_str for blocking_err in blocking_errors
+                )
+                
+                # Ошибки для блоклиста аккаунта (можно попробовать другой аккаунт)
+                account_blocklist_errors = [
+                    "can't write" in error_str,
+                    "write forbidden" in error_str,
+                    "chatwriteforbidden" in error_str,
+                    "you're banned" in error_str,
+                ]
+                
+                planner.record_post(
+                    account_id=account.id,
+                    target_id=target.id,
+                    status="error",
+                    error_message=error_msg,
+                )
+                stats['errors'] += 1
+
+                # Если это блокирующая ошибка - помечаем группу как недоступную
+                if is_blocking_error:
+                    logger.warning(
+                        f"  🚫 Блокирующая ошибка для группы {target.username}: "
+                        f"перевожу в статус 'inaccessible'"
+                    )
+                    planner.update_target(
+                        target, status="inaccessible", can_post=False, updated_at=datetime.utcnow()
+                    )
+                    # Прерываем попытки для этой группы
+                    break
+                
+                # Если это ошибка для конкретного аккаунта - добавляем в блоклист
+                if any(account_blocklist_errors):
+                    planner.block(target.id, account.id, error_msg)
+
+            except Exception as e:
+                logger.error(
+                    f"  ❌ Неожиданная ошибка при постинге: {e}", exc_info=True
+                )
+                stats['errors'] += 1
+
+        # Если не получилось ни с одним аккаунтом и незабаненных аккаунтов не осталось — помечаем группу
+        if not success_for_group and target.status == "active" and not planner.candidates(target.id):
+            planner.update_target(target, status="no_accounts_left", updated_at=datetime.utcnow())
+
+        await planner.maybe_flush()
+        return stats
+
+    async def run_batch(self, batch_size: int = 10, max_concurrency: Optional[int] = None):
         """
         Запуск батча постинга
         
@@ -418,19 +809,32 @@ class SmartPoster:
         4. Опубликовать пост (текст + фото)
         5. Обновить время последнего поста
         
+        Группы обрабатываются параллельно: у каждого аккаунта своя полоса
+        с паузами между постами, одновременно постят не более max_concurrency аккаунтов.
+        Аккаунты и блоклист читаются из БД один раз, результаты копятся в BatchPlanner
+        и пишутся короткими транзакциями каждые flush_every постов; остаток пишется
+        в конце батча с повторными попытками.
+        
         Args:
             batch_size: Максимальное количество постов за запуск
+            max_concurrency: Лимит одновременных отправок (по умолчанию MARKETER_MAX_CONCURRENCY или 4)
         """
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('MARKETER_MAX_CONCURRENCY', '4'))
+        self.lanes = LaneScheduler(max_concurrency=max_concurrency)
+
         logger.info("=" * 80)
         logger.info(f"📢 SMART POSTER - БАТЧ ПОСТИНГА")
         logger.info("=" * 80)
         logger.info(f"📋 Проект: {self.project_name}")
         logger.info(f"📋 Ниша: {self.niche}")
         logger.info(f"📊 Размер батча: {batch_size}")
+        logger.info(f"🛣️  Параллельных отправок: {max_concurrency}")
         logger.info("=" * 80)
         
         async with AsyncSessionLocal() as session:
             db_manager = DbManager(session)
+            planner = BatchPlanner(db_manager, allowed_sessions=self._allowed_sessions())
             
             try:
                 # ШАГ 1: Получаем группы, готовые для постинга (НЕ привязываемся к assigned_account_id:
@@ -452,6 +856,15 @@ class SmartPoster:
                 )
                 result = await session.execute(stmt)
                 ready_groups = result.scalars().all()
+                
+                # ШАГ 2: Аккаунты и блоклист для всех групп батча
+                if ready_groups:
+                    await planner.load([target.id for target in ready_groups])
+                # Группы и аккаунты меняются только в памяти, в БД их пишет planner.flush:
+                # отвязываем объекты, чтобы rollback неудачной записи не сбрасывал их,
+                # и закрываем читающую транзакцию, чтобы сессия не висела в ней весь батч
+                session.expunge_all()
+                await session.commit()
             except Exception as e:
                 logger.error(f"❌ Error getting groups ready for posting: {e}", exc_info=True)
                 await session.rollback()
@@ -463,418 +876,41 @@ class SmartPoster:
             
             logger.info(f"📋 Найдено {len(ready_groups)} групп для постинга")
             
-            # ШАГ 2: Цикл постинга
+            # ШАГ 3: Параллельный постинг по полосам аккаунтов
+            try:
+                results = await asyncio.gather(
+                    *(
+                        self._post_to_target(planner, target, idx, len(ready_groups))
+                        for idx, target in enumerate(ready_groups, 1)
+                    ),
+                    return_exceptions=True,
+                )
+            finally:
+                # ШАГ 4: Остаток буфера (посты, счетчики, блоклист, статусы групп)
+                for attempt in range(1, 4):
+                    if await planner.flush():
+                        break
+                    if attempt < 3:
+                        await asyncio.sleep(5 * attempt)
+                else:
+                    logger.error(f"❌ Не удалось записать результаты батча: потеряно {planner.pending} записей")
+
             posted_count = 0
             error_count = 0
-            
-            for idx, target in enumerate(ready_groups, 1):
-                # Получаем username напрямую, чтобы избежать lazy loading
-                group_username = target.username if hasattr(target, 'username') else getattr(target, 'link', 'unknown')
-                logger.info(f"\n{'='*60}")
-                logger.info(f"📋 [{idx}/{len(ready_groups)}] Группа: {group_username}")
-                logger.info(f"{'='*60}")
-
-                # Выбираем контент для постинга один раз (для повторных попыток разными аккаунтами)
-                group_link = group_username
-                relevant_messages = self._get_relevant_messages(group_link)
-                if not relevant_messages:
-                    logger.error(f"  ❌ Нет релевантных сообщений для группы {target.link}")
+            for target_result in results:
+                if isinstance(target_result, Exception):
+                    logger.error(f"❌ Ошибка обработки группы: {target_result}", exc_info=target_result)
                     error_count += 1
                     continue
-
-                post_content = random.choice(relevant_messages)
-                text_msg = post_content.get('text', '')
-                image_path = post_content.get('image') or post_content.get('photo')
-
-                # Для Бали: если сообщение по недвижимости без фото — подставляем дефолтные изображения апартов
-                if not image_path and self.niche == "bali":
-                    source_file = post_content.get("source_file", "")
-                    if source_file in {
-                        "messages_rental_property.txt",
-                        "messages_sale_property.txt",
-                        "messages_housing.txt",
-                    }:
-                        default_apartment_photos = [
-                            "/app/bali_assets/apart/apart_investment_collage_ru.jpg",
-                            "/app/bali_assets/apart/apart_investment_variant_1_ru.jpg",
-                            "/app/bali_assets/apart/apart_investment_variant_2_ru.jpg",
-                            "/app/bali_assets/apart/apart_investment_variant_3_ru.jpg",
-                            "/app/bali_assets/apart/apart_investment_variant_4_ru.jpg",
-                        ]
-                        image_path = random.choice(default_apartment_photos)
-
-                if not text_msg:
-                    logger.warning("  ⚠️ Пустой текст поста, пропускаем")
-                    error_count += 1
-                    continue
-
-                logger.info(f"  📝 Текст поста: {text_msg[:50]}...")
-                if image_path:
-                    logger.info(f"  🖼️  Фото: {image_path}")
-
-                # РОТАЦИЯ ДО ПОБЕДНОГО: пробуем группу разными аккаунтами, пока не получится
-                attempt = 0
-                max_attempts = max(1, len(self.bali_allowed_accounts)) if self.niche == "bali" else 5
-                success_for_group = False
-
-                while attempt < max_attempts and not success_for_group:
-                    attempt += 1
-
-                    # Выбираем аккаунт для этой группы, исключая тех, кто уже в блоклисте
-                    preferred_id = getattr(target, "assigned_account_id", None)
-                    if self.niche == "bali" and self.bali_allowed_accounts:
-                        allowed_sessions = sorted(self.bali_allowed_accounts)
-                    else:
-                        allowed_sessions = None  # все active
-
-                    account_sql = text(
-                        """
-                        SELECT a.id, a.phone, a.string_session, a.session_name, a.status,
-                               a.api_id, a.api_hash, a.proxy, a.nickname, a.bio,
-                               a.created_at, a.updated_at
-                        FROM accounts a
-                        WHERE a.status = 'active'
-                          AND (
-                            :allowed_sessions_is_null
-                            OR a.session_name = ANY(CAST(:allowed_sessions AS TEXT[]))
-                          )
-                          AND NOT EXISTS (
-                            SELECT 1
-                            FROM account_group_blocklist b
-                            WHERE b.group_id = :group_id AND b.account_id = a.id
-                          )
-                        ORDER BY
-                          CASE
-                            WHEN CAST(:preferred_id AS INTEGER) IS NOT NULL
-                              AND a.id = CAST(:preferred_id AS INTEGER)
-                            THEN 0
-                            ELSE 1
-                          END,
-                          a.id
-                        LIMIT 1
-                        """
-                    )
-
-                    params = {
-                        "group_id": target.id,
-                        "preferred_id": preferred_id,
-                        "allowed_sessions_is_null": allowed_sessions is None,
-                        "allowed_sessions": allowed_sessions or [],
-                    }
-                    account_row = (await session.execute(account_sql, params)).fetchone()
-                    if not account_row:
-                        logger.warning(
-                            f"  ⚠️ Нет доступных аккаунтов для группы {group_username} "
-                            f"(все в блоклисте). Перевожу группу в 'no_accounts_left'."
-                        )
-                        target.status = "no_accounts_left"
-                        target.updated_at = datetime.utcnow()
-                        await session.commit()
-                        error_count += 1
-                        break
-
-                    account = Account(
-                        id=account_row[0],
-                        phone=account_row[1],
-                        string_session=account_row[2],
-                        session_name=account_row[3],
-                        status=account_row[4],
-                        api_id=account_row[5],
-                        api_hash=account_row[6],
-                        proxy=account_row[7],
-                        nickname=account_row[8],
-                        bio=account_row[9],
-                        created_at=account_row[10],
-                        updated_at=account_row[11],
-                    )
-
-                    logger.info(
-                        f"  👤 Попытка {attempt}/{max_attempts}: аккаунт {account.session_name} (id={account.id})"
-                    )
-
-                    # Для Ukraine используем только Ukraine аккаунты
-                    if self.niche == "ukraine_cars":
-                        ukraine_accounts = [
-                            "promotion_dao_bro",
-                            "promotion_alex_ever",
-                            "promotion_rod_shaihutdinov",
-                        ]
-                        if account.session_name not in ukraine_accounts:
-                            logger.warning(
-                                f"  ⚠️ Аккаунт {account.session_name} не является Ukraine аккаунтом, "
-                                "пробуем следующий"
-                            )
-                            # баним связку, чтобы не выбирать его снова для этой группы
-                            await session.execute(
-                                text(
-                                    "INSERT INTO account_group_blocklist (group_id, account_id, reason) "
-                                    "VALUES (:gid, :aid, :reason) "
-                                    "ON CONFLICT (group_id, account_id) DO NOTHING"
-                                ),
-                                {"gid": target.id, "aid": account.id, "reason": "ukraine_account_not_allowed"},
-                            )
-                            await session.commit()
-                            continue
-
-                    client = await self.create_client(account)
-                    if not client:
-                        logger.error(f"  ❌ Не удалось создать клиент для {account.session_name}")
-                        await session.execute(
-                            text(
-                                "INSERT INTO account_group_blocklist (group_id, account_id, reason) "
-                                "VALUES (:gid, :aid, :reason) "
-                                "ON CONFLICT (group_id, account_id) DO NOTHING"
-                            ),
-                            {"gid": target.id, "aid": account.id, "reason": "client_create_failed"},
-                        )
-                        await session.commit()
-                        error_count += 1
-                        continue
-
-                    try:
-                        username = group_username.lstrip("@")
-
-                        # ВАЖНО: сначала вступаем (если аккаунт еще не участник)
-                        try:
-                            await client(JoinChannelRequest(username))
-                        except Exception:
-                            pass
-
-                        # Обрабатываем путь к фото
-                        full_image_path = None
-                        if image_path:
-                            # Bali: никогда не используем lexus_assets (иногда попадали ошибочно в messages.json)
-                            if self.niche == "bali" and str(image_path).startswith("lexus_assets/"):
-                                logger.warning(
-                                    f"  ⚠️ Ignoring lexus photo for Bali: {image_path}"
-                                )
-                                image_path = None
-
-                            if Path(image_path).exists():
-                                full_image_path = image_path
-                            else:
-                                # Важно: для Bali ищем только в bali_assets/assets; для Ukraine допускаем lexus_assets.
-                                possible_paths = [Path(image_path), Path("/app") / image_path]
-
-                                if self.niche == "bali":
-                                    possible_paths.extend(
-                                        [
-                                            Path("/app/bali_assets") / str(image_path).replace("bali_assets/", ""),
-                                            Path("/app/assets") / str(image_path).replace("bali_assets/", ""),
-                                        ]
-                                    )
-                                else:
-                                    possible_paths.extend(
-                                        [
-                                            Path("/app/lexus_assets")
-                                            / str(image_path).replace("lexus_assets/", ""),
-                                            Path("/app/assets")
-                                            / str(image_path).replace("lexus_assets/", ""),
-                                            Path("/app/data/ukraine/assets")
-                                            / str(image_path).replace("lexus_assets/", ""),
-                                        ]
-                                    )
-                                for pth in possible_paths:
-                                    if pth.exists():
-                                        full_image_path = str(pth)
-                                        logger.info(f"  🔍 Found photo at: {full_image_path}")
-                                        break
-                                if not full_image_path:
-                                    logger.warning(
-                                        f"  ⚠️ Photo not found: {image_path}, sending text only"
-                                    )
-
-                        if full_image_path:
-                            await client.send_file(username, full_image_path, caption=text_msg)
-                        else:
-                            await client.send_message(username, text_msg)
-
-                        logger.info(
-                            f"  ✅ Пост отправлен в {group_username} (account={account.session_name})"
-                        )
-
-                        await db_manager.record_post(
-                            account_id=account.id,
-                            target_id=target.id,
-                            message_content=text_msg[:1000],
-                            photo_path=image_path,
-                            status="success",
-                        )
-
-                        # Обновляем "последний успешный" аккаунт для группы
-                        target.assigned_account_id = account.id
-                        target.updated_at = datetime.utcnow()
-
-                        await session.commit()
-                        posted_count += 1
-                        success_for_group = True
-
-                        pause_seconds = random.randint(30, 60)
-                        logger.info(
-                            f"  ⏸️  Пауза {pause_seconds} сек перед следующим постом..."
-                        )
-                        await asyncio.sleep(pause_seconds)
-
-                    except FloodWaitError as e:
-                        wait_seconds = e.seconds
-                        logger.warning(
-                            f"  ⏳ FloodWait {wait_seconds} сек для аккаунта {account.session_name}"
-                        )
-                        await db_manager.record_post(
-                            account_id=account.id,
-                            target_id=target.id,
-                            message_content=text_msg[:1000] if text_msg else None,
-                            status="flood_wait",
-                            error_message=f"FloodWait: {wait_seconds} seconds",
-                        )
-                        await session.commit()
-                        error_count += 1
-                        await asyncio.sleep(60)
-
-                    except (ChatWriteForbiddenError, UserBannedInChannelError) as e:
-                        error_msg = f"Запрещено писать в группе: {str(e)}"
-                        logger.error(f"  🚫 {error_msg}")
-
-                        await session.execute(
-                            text(
-                                "INSERT INTO account_group_blocklist (group_id, account_id, reason) "
-                                "VALUES (:gid, :aid, :reason) "
-                                "ON CONFLICT (group_id, account_id) DO NOTHING"
-                            ),
-                            {"gid": target.id, "aid": account.id, "reason": error_msg[:500]},
-                        )
-
-                        await db_manager.record_post(
-                            account_id=account.id,
-                            target_id=target.id,
-                            status="error",
-                            error_message=error_msg,
-                        )
-                        await session.commit()
-                        error_count += 1
-                        await asyncio.sleep(5)
-
-                    except RPCError as e:
-                        error_msg = f"RPC Error: {str(e)}"
-                        logger.error(f"  ❌ {error_msg}")
-
-                        error_str = str(e).lower()
-                        
-                        # Блокирующие ошибки - группа недоступна для постинга ВООБЩЕ
-                        blocking_errors = [
-                            "allow_payment_required",  # Требуется оплата
-                            "chat_send_plain_forbidden",  # Текстовые сообщения запрещены
-                            "topic_closed",  # Топики закрыты (для форумов)
-                        ]
-                        
-                        is_blocking_error = any(
-                            blocking_err in error_str for blocking_err in blocking_errors
-                        )
-                        
-                        # Ошибки для блоклиста аккаунта (можно попробовать другой аккаунт)
-                        account_blocklist_errors = [
-                            "can't write" in error_str,
-                            "write forbidden" in error_str,
-                            "chatwriteforbidden" in error_str,
-                            "you're banned" in error_str,
-                        ]
-                        
-                        # Если это блокирующая ошибка - помечаем группу как недоступную
-                        if is_blocking_error:
-                            logger.warning(
-                                f"  🚫 Блокирующая ошибка для группы {target.username}: "
-                                f"перевожу в статус 'inaccessible'"
-                            )
-                            target.status = "inaccessible"
-                            target.can_post = False
-                            target.updated_at = datetime.utcnow()
-                            await session.commit()
-                            
-                            # Записываем ошибку
-                            await db_manager.record_post(
-                                account_id=account.id,
-                                target_id=target.id,
-                                status="error",
-                                error_message=error_msg,
-                            )
-                            await session.commit()
-                            error_count += 1
-                            # Прерываем попытки для этой группы
-                            success_for_group = False
-                            break
-                        
-                        # Если это ошибка для конкретного аккаунта - добавляем в блоклист
-                        elif any(account_blocklist_errors):
-                            await session.execute(
-                                text(
-                                    "INSERT INTO account_group_blocklist (group_id, account_id, reason) "
-                                    "VALUES (:gid, :aid, :reason) "
-                                    "ON CONFLICT (group_id, account_id) DO NOTHING"
-                                ),
-                                {"gid": target.id, "aid": account.id, "reason": error_msg[:500]},
-                            )
-
-                        await db_manager.record_post(
-                            account_id=account.id,
-                            target_id=target.id,
-                            status="error",
-                            error_message=error_msg,
-                        )
-                        await session.commit()
-                        error_count += 1
-                        await asyncio.sleep(5)
-
-                    except Exception as e:
-                        logger.error(
-                            f"  ❌ Неожиданная ошибка при постинге: {e}", exc_info=True
-                        )
-                        error_count += 1
-                        await asyncio.sleep(5)
-
-                    finally:
-                        try:
-                            if client and client.is_connected():
-                                await client.disconnect()
-                        except Exception:
-                            pass
-
-                # Если не получилось ни с одним аккаунтом — помечаем группу
-                if not success_for_group and target.status == "active":
-                    # Проверяем, есть ли еще незабаненные аккаунты для группы
-                    remain_sql = text(
-                        """
-                        SELECT COUNT(*)
-                        FROM accounts a
-                        WHERE a.status = 'active'
-                          AND (
-                            :allowed_sessions_is_null
-                            OR a.session_name = ANY(CAST(:allowed_sessions AS TEXT[]))
-                          )
-                          AND NOT EXISTS (
-                            SELECT 1 FROM account_group_blocklist b
-                            WHERE b.group_id = :group_id AND b.account_id = a.id
-                          )
-                        """
-                    )
-                    allowed_sessions = sorted(self.bali_allowed_accounts) if (self.niche == "bali" and self.bali_allowed_accounts) else None
-                    remain = (
-                        await session.execute(
-                            remain_sql,
-                            {
-                                "group_id": target.id,
-                                "allowed_sessions_is_null": allowed_sessions is None,
-                                "allowed_sessions": allowed_sessions or [],
-                            },
-                        )
-                    ).scalar_one()
-                    if remain == 0:
-                        target.status = "no_accounts_left"
-                        target.updated_at = datetime.utcnow()
-                        await session.commit()
+                posted_count += target_result['posted']
+                error_count += target_result['errors']
+            
+            await self.client_pool.evict_idle()
             
             logger.info("\n" + "=" * 80)
             logger.info(f"✅ БАТЧ ПОСТИНГА ЗАВЕРШЕН")
             logger.info(f"📊 Статистика: {posted_count} успешно, {error_count} ошибок")
+            logger.info(f"🔌 Пул клиентов: {self.client_pool.stats}")
             logger.info("=" * 80)
 
 
@@ -893,7 +929,10 @@ async def main():
     
     # Запуск
     poster = SmartPoster(niche=niche)
-    await poster.run_batch(batch_size=batch_size)
+    try:
+        await poster.run_batch(batch_size=batch_size)
+    finally:
+        await poster.close()
 
 
 if __name__ == "__main__":
@@ -65,7 +65,8 @@ class MarketerScheduler:
         # Инициализация постера
         # Используем переменную окружения NICHE или имя из конфига
         poster_niche = os.getenv('NICHE') or niche_config.get('name', 'bali')
-        self.poster = Poster(poster_niche)
+        # Постер переиспользует уже подключенные клиенты менеджера через свой пул
+        self.poster = Poster(poster_niche, client_manager=self.client_manager)
         self.niche = poster_niche
         logger.info(f"📝 Poster initialized for niche: {poster_niche}")
         # await self.poster.initialize()  # SmartPoster не имеет метода initialize
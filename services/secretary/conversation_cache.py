@@ -0,0 +1,73 @@
+"""
+Кэш последних сообщений переписок секретаря
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class ConversationCache:
+    """
+    Кольцевой буфер последних сообщений по (account_id, user_id)
+
+    Заполняется из Telegram один раз (hydrate при промахе), дальше
+    поддерживается событиями NewMessage и нашими отправленными ответами,
+    поэтому проверка активной переписки и история для GPT в активных чатах
+    не требуют запросов к Telegram. Сообщения хранятся в хронологическом
+    порядке, дубликаты отсекаются по ID сообщения.
+    """
+
+    def __init__(self, maxlen: int = 20, max_chats: int = 2000, ttl: float = 6 * 3600):
+        """
+        Args:
+            maxlen: Сколько последних сообщений хранить на чат
+            max_chats: Сколько чатов держать в памяти (LRU)
+            ttl: Через сколько секунд без активности чат загружается из Telegram заново
+        """
+        self.maxlen = maxlen
+        self.max_chats = max_chats
+        self.ttl = ttl
+        # (account_id, user_id) -> (сообщения, время последнего обновления)
+        self._chats: "OrderedDict[Tuple[int, int], Tuple[Deque[Dict], float]]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, account_id: int, user_id: int) -> Optional[List[Dict]]:
+        """Сообщения чата от старых к новым ({'id', 'out', 'text'}) или None при промахе"""
+        key = (account_id, user_id)
+        entry = self._chats.get(key)
+        if entry is None or time.time() - entry[1] >= self.ttl:
+            self._chats.pop(key, None)
+            self.stats['misses'] += 1
+            return None
+        self._chats.move_to_end(key)
+        self.stats['hits'] += 1
+        return list(entry[0])
+
+    def hydrate(self, account_id: int, user_id: int, messages: List[Dict]):
+        """Заполнить чат сообщениями из Telegram (от старых к новым)"""
+        key = (account_id, user_id)
+        self._chats[key] = (deque(messages[-self.maxlen:], maxlen=self.maxlen), time.time())
+        self._chats.move_to_end(key)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def append(self, account_id: int, user_id: int, message_id: Optional[int], out: bool, text: str):
+        """
+        Добавить сообщение в загруженный чат
+
+        Если чат еще не загружен, ничего не делает: при первом обращении
+        история все равно будет получена из Telegram целиком.
+        """
+        key = (account_id, user_id)
+        entry = self._chats.get(key)
+        if entry is None:
+            return
+        messages = entry[0]
+        if message_id is not None and any(m['id'] == message_id for m in messages):
+            return
+        messages.append({'id': message_id, 'out': out, 'text': text or ''})
+        self._chats[key] = (messages, time.time())
+        self._chats.move_to_end(key)
+
+    def invalidate(self, account_id: int, user_id: int):
+        self._chats.pop((account_id, user_id), None)
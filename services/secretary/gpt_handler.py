@@ -2,10 +2,13 @@
 Обработчик GPT-4o-mini для генерации ответов
 """
 import os
+import re
 import json
+import time
+import asyncio
 import logging
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 from datetime import datetime
 
 try:
@@ -17,6 +20,9 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Конец предложения: знак препинания перед пробелом или перевод строки
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\s)\]]+|\n+")
+
 
 class GPTHandler:
     """Класс для работы с OpenAI GPT-4o-mini"""
@@ -208,6 +214,125 @@ class GPTHandler:
             logger.error(f"  ❌ Error generating GPT response: {e}", exc_info=True)
             return self._get_default_response()
     
+    def _split_ready_part(self, buffer: str, min_chars: int) -> int:
+        """Позиция, до которой буфер можно отправить (конец последнего предложения не раньше min_chars), или 0"""
+        cut = 0
+        for match in _SENTENCE_END_RE.finditer(buffer):
+            if match.end() >= min_chars:
+                cut = match.end()
+        return cut
+    
+    async def stream_response(
+        self,
+        incoming_message: str,
+        conversation_history: List[Dict],
+        user_info: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа: части отдаются по мере готовности
+        
+        Часть - законченные предложения длиной не меньше stream_min_chunk_chars,
+        остаток отдается в конце. На ожидание OpenAI дается gpt_timeout секунд
+        (паузы потребителя между частями, например имитация набора, не
+        считаются); при таймауте или ошибке недописанный остаток отбрасывается, и если
+        не отдано ни одной части, отдается дефолтный ответ.
+        
+        Args:
+            incoming_message: Текст входящего сообщения
+            conversation_history: История переписки
+            user_info: Информация о пользователе (опционально)
+        
+        Yields:
+            Готовые к отправке части ответа
+        """
+        if not self.client:
+            logger.warning("⚠️ GPT client not available, returning default response")
+            yield self._get_default_response()
+            return
+        
+        formatted_history = self.format_conversation_history(conversation_history, new_messages=incoming_message)
+        max_length = self.config.get('response_style', {}).get('max_length', 500)
+        min_chunk_chars = self.config.get('stream_min_chunk_chars', 80)
+        timeout = self.config.get('gpt_timeout', 30)
+        waited = 0.0  # время ожидания OpenAI, без пауз на yield
+        
+        buffer = ""
+        sent_length = 0
+        started = time.monotonic()
+        first_part_at = None
+        stream = None
+        try:
+            wait_started = time.monotonic()
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=formatted_history,
+                    max_tokens=max_length,
+                    temperature=0.7,
+                    top_p=0.9,
+                    stream=True
+                ),
+                timeout
+            )
+            waited += time.monotonic() - wait_started
+            chunks = stream.__aiter__()
+            while sent_length + len(buffer) < max_length:
+                remaining = timeout - waited
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                wait_started = time.monotonic()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                finally:
+                    waited += time.monotonic() - wait_started
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                buffer += delta
+                
+                cut = self._split_ready_part(buffer, min_chunk_chars)
+                if cut:
+                    part, buffer = buffer[:cut].strip(), buffer[cut:]
+                    if part:
+                        if first_part_at is None:
+                            first_part_at = time.monotonic() - started
+                        sent_length += len(part)
+                        yield part
+        except asyncio.TimeoutError:
+            # Недописанное предложение не отправляем
+            logger.warning(f"  ⏱️ GPT stream timed out after {timeout}s")
+            buffer = ""
+        except Exception as e:
+            logger.error(f"  ❌ Error streaming GPT response: {e}", exc_info=True)
+            buffer = ""
+        finally:
+            # При досрочной остановке (max_length, таймаут, ошибка) закрываем HTTP-ответ сразу
+            if stream is not None:
+                try:
+                    await stream.close()
+                except Exception as e:
+                    logger.debug(f"  ⚠️ Error closing GPT stream: {e}")
+        
+        tail = buffer.strip()
+        if tail:
+            # Обрезаем, если слишком длинный
+            if sent_length + len(tail) > max_length:
+                tail = tail[:max(0, max_length - sent_length)] + "..."
+            sent_length += len(tail)
+            yield tail
+        
+        if not sent_length:
+            yield self._get_default_response()
+            return
+        
+        logger.info(
+            f"  ✅ Streamed response ({sent_length} chars, first part after "
+            f"{first_part_at if first_part_at is not None else time.monotonic() - started:.1f}s, "
+            f"history: {len(conversation_history)} msgs)"
+        )
+    
     def _get_default_response(self) -> str:
         """Получить дефолтный ответ, если GPT недоступен"""
         return "Привет! Спасибо за сообщение. Я сейчас занят, но обязательно отвечу позже! 😊"
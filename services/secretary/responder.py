@@ -3,11 +3,11 @@
 """
 import asyncio
 import random
+import time
 import logging
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, List, Dict
-from sqlalchemy import func, and_
 
 from telethon import TelegramClient
 from telethon.events import NewMessage
@@ -17,6 +17,7 @@ from telethon.errors import FloodWaitError, UserBotError
 from shared.database.session import SessionLocal
 from shared.database.models import Account, DMResponse
 from services.secretary.gpt_handler import GPTHandler
+from services.secretary.conversation_cache import ConversationCache
 
 logger = logging.getLogger(__name__)
 
@@ -39,15 +40,24 @@ class MessageResponder:
         config = gpt_handler.config
         self.typing_delay_min = config.get('typing_delay_min', 5)
         self.typing_delay_max = config.get('typing_delay_max', 15)
+        self.typing_chars_per_second = config.get('typing_chars_per_second', 15)
+        
+        # Потоковый ответ GPT (отключается "streaming": false в конфиге секретаря)
+        self.streaming = config.get('streaming', True)
         
         # Кеш недавно отвеченных сообщений (избежание рекурсии)
+        # Обновляется при записи DMResponse, поэтому входящие сообщения проверяются без запросов к БД
         self.recent_responses = {}  # {(account_id, user_id): timestamp}
         self.recent_response_window = 60  # секунд
+        self._recent_responses_pruned_at = datetime.utcnow()
         
         # Буфер сообщений для debouncing (накопление сообщений перед обработкой)
         # Структура: {(account_id, user_id): {'timer': Task, 'messages': [{'text': str, 'event': Event}], 'sender': User, 'account': Account, 'client': Client}}
         self.message_buffer = {}
         self.buffer_delay = config.get('message_buffer_delay', 7)  # Задержка в секундах
+        
+        # Последние сообщения переписок: история для GPT без запросов к Telegram
+        self.conversations = ConversationCache(maxlen=config.get('conversation_cache_size', 20))
     
     def _load_blacklist(self) -> set:
         """Загрузка черного списка из файла"""
@@ -107,17 +117,35 @@ class MessageResponder:
             if (now - last_response_time).total_seconds() < self.recent_response_window:
                 return True
         
-        # Очищаем старые записи
-        self.recent_responses = {
-            k: v for k, v in self.recent_responses.items()
-            if (now - v).total_seconds() < self.recent_response_window
-        }
+        # Очищаем старые записи (не чаще раза в окно, а не на каждое сообщение)
+        if (now - self._recent_responses_pruned_at).total_seconds() >= self.recent_response_window:
+            self.recent_responses = {
+                k: v for k, v in self.recent_responses.items()
+                if (now - v).total_seconds() < self.recent_response_window
+            }
+            self._recent_responses_pruned_at = now
         
         return False
     
-    def mark_responded(self, account_id: int, user_id: int):
+    def mark_responded(self, account_id: int, user_id: int, sent_at: Optional[datetime] = None):
         """Пометить, что мы ответили пользователю"""
-        self.recent_responses[(account_id, user_id)] = datetime.utcnow()
+        self.recent_responses[(account_id, user_id)] = sent_at or datetime.utcnow()
+    
+    def load_recent_responses(self):
+        """Загрузить ответы за последнее окно из БД (после перезапуска не отвечаем повторно)"""
+        db = SessionLocal()
+        try:
+            since = datetime.utcnow() - timedelta(seconds=self.recent_response_window)
+            rows = db.query(DMResponse.account_id, DMResponse.user_id, DMResponse.sent_at).filter(
+                DMResponse.sent_at >= since
+            ).all()
+            for account_id, user_id, sent_at in rows:
+                self.mark_responded(account_id, user_id, sent_at)
+            logger.info(f"✅ Loaded {len(rows)} recent DM responses")
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to load recent DM responses: {e}")
+        finally:
+            db.close()
     
     def should_forward_to_owner(self, message_text: str) -> bool:
         """
@@ -143,22 +171,50 @@ class MessageResponder:
         
         return False
     
-    async def check_if_active_conversation(self, client: TelegramClient, user: User) -> bool:
+    async def load_conversation(self, client: TelegramClient, user: User, account_id: Optional[int] = None) -> List[Dict]:
+        """
+        Последние сообщения переписки (от старых к новым)
+        
+        Для активных чатов берется из кэша; при промахе загружается из Telegram
+        одним запросом и кладется в кэш.
+        
+        Args:
+            client: Telegram клиент
+            user: Пользователь
+            account_id: ID аккаунта (None - без кэша)
+        
+        Returns:
+            Список сообщений [{"id": ..., "out": bool, "text": "..."}, ...]
+        """
+        if account_id is not None:
+            cached = self.conversations.get(account_id, user.id)
+            if cached is not None:
+                return cached
+        
+        messages = []
+        async for message in client.iter_messages(user, limit=self.conversations.maxlen):
+            messages.append({'id': message.id, 'out': bool(message.out), 'text': message.text or ''})
+        messages.reverse()
+        
+        if account_id is not None:
+            self.conversations.hydrate(account_id, user.id, messages)
+        return messages
+    
+    async def check_if_active_conversation(self, client: TelegramClient, user: User, account_id: Optional[int] = None) -> bool:
         """
         Проверка, идет ли активная переписка (есть ли ответы пользователя после нашего последнего сообщения)
         
         Args:
             client: Telegram клиент
             user: Пользователь
+            account_id: ID аккаунта (для кэша переписок)
         
         Returns:
             True если идет переписка (пользователь уже ответил после нашего последнего сообщения)
         """
         try:
-            # Получаем последние 10 сообщений
-            messages = []
-            async for message in client.iter_messages(user, limit=10):
-                messages.append(message)
+            # Последние 10 сообщений, от новых к старым
+            messages = (await self.load_conversation(client, user, account_id))[-10:][::-1]
             
             if not messages:
                 return False
@@ -166,7 +222,7 @@ class MessageResponder:
             # Ищем наше последнее сообщение (out=True)
             our_last_message_index = None
             for i, msg in enumerate(messages):
-                if msg.out:  # Наше сообщение
+                if msg['out']:  # Наше сообщение
                     our_last_message_index = i
                     break
             
@@ -177,7 +233,7 @@ class MessageResponder:
             # Проверяем, есть ли сообщения от пользователя ПОСЛЕ нашего последнего
             # (сообщения с меньшим индексом = более новые)
             for i in range(our_last_message_index):
-                if not messages[i].out:  # Сообщение от пользователя
+                if not messages[i]['out']:  # Сообщение от пользователя
                     # Есть ответ пользователя после нашего последнего сообщения
                     logger.debug(f"  💬 Found user reply after our last message (message {i} of {len(messages)})")
                     return True
@@ -258,36 +314,31 @@ class MessageResponder:
         except Exception as e:
             logger.error(f"  ❌ Error in forward_message_to_grishkoff: {e}", exc_info=True)
     
-    async def get_conversation_history(self, client: TelegramClient, user: User, limit: int = 15) -> List[Dict]:
+    async def get_conversation_history(self, client: TelegramClient, user: User, limit: int = 15,
+                                       account_id: Optional[int] = None) -> List[Dict]:
         """
         Получить историю переписки с пользователем (расширенная для контекста)
         
         Args:
             client: Telegram клиент
             user: Пользователь
-            limit: Максимум сообщений (по умолчанию 15 для лучшего контекста)
+            limit: Максимум последних сообщений (по умолчанию 15 для лучшего контекста)
+            account_id: ID аккаунта (для кэша переписок)
         
         Returns:
             Список сообщений в формате [{"role": "user", "content": "..."}, ...]
         """
         try:
-            messages = []
-            async for message in client.iter_messages(user, limit=limit, reverse=True):
-                if not message.text:
-                    continue
-                
-                # Определяем роль (user или assistant)
-                if message.out:
-                    role = "assistant"
-                else:
-                    role = "user"
-                
-                messages.append({
-                    "role": role,
-                    "content": message.text
-                })
-            
-            return messages
+            messages = await self.load_conversation(client, user, account_id)
+            return [
+                {
+                    # Определяем роль (user или assistant)
+                    "role": "assistant" if message['out'] else "user",
+                    "content": message['text']
+                }
+                for message in messages[-limit:]
+                if message['text']
+            ]
             
         except Exception as e:
             logger.warning(f"  ⚠️ Error getting conversation history: {e}")
@@ -440,7 +491,7 @@ class MessageResponder:
             username = getattr(sender, 'username', None) or f"ID{user_id}"
             
             # Проверяем, идет ли уже переписка (есть ли ответы пользователя после нашего последнего сообщения)
-            is_active_conversation = await self.check_if_active_conversation(client, sender)
+            is_active_conversation = await self.check_if_active_conversation(client, sender, account_id=account.id)
             
             # ВАЖНО: Мы убрали return, чтобы бот мог вести диалог (квалифицировать лида или продавать)
             # Бот должен отвечать на ВСЕ сообщения, даже если диалог идет.
@@ -488,7 +539,7 @@ class MessageResponder:
             # Получаем расширенную историю переписки (10-15 сообщений для контекста)
             logger.debug(f"📚 [DEBUG] Получаем историю переписки для @{username}...")
             try:
-                conversation_history = await self.get_conversation_history(client, sender, limit=15)
+                conversation_history = await self.get_conversation_history(client, sender, limit=15, account_id=account.id)
                 logger.info(f"📚 [DEBUG] Получена история: {len(conversation_history)} сообщений")
             except Exception as e:
                 logger.error(f"🔥 [ERROR] Ошибка при получении истории для @{username}: {e}")
@@ -496,62 +547,34 @@ class MessageResponder:
                 logger.error(f"🔥 [ERROR] Traceback:\n{traceback.format_exc()}")
                 conversation_history = []  # Продолжаем без истории
             
-            # Генерируем ответ через GPT с учетом истории
-            logger.debug(f"🧠 [DEBUG] Отправляем запрос в GPT для @{username}...")
             try:
-                response_text = await self.gpt_handler.generate_response(
-                    incoming_message=combined_text,
-                    conversation_history=conversation_history,
-                    user_info={"id": user_id, "username": username}
-                )
-                logger.info(f"🧠 [DEBUG] Ответ от GPT получен: {len(response_text)} символов")
-            except Exception as e:
-                logger.error(f"🔥 [ERROR] Ошибка при генерации ответа GPT для @{username}: {e}")
-                import traceback
-                logger.error(f"🔥 [ERROR] Traceback:\n{traceback.format_exc()}")
-                response_text = "Привет! Спасибо за сообщение. Я сейчас занят, но обязательно отвечу позже! 😊"
-            
-            # Имитируем печатание
-            logger.debug(f"⌨️ [DEBUG] Имитируем печатание для @{username}...")
-            await self.simulate_typing(client, sender)
-            
-            # Отправляем ответ (используем последнее событие или отправляем новое сообщение)
-            logger.debug(f"📤 [DEBUG] Отправляем ответ @{username}...")
-            try:
-                if event:
-                    await event.reply(response_text)
-                    logger.debug(f"  ✅ [DEBUG] Ответ отправлен через event.reply")
+                if self.streaming:
+                    # Потоковый режим: "печатает" сразу, части уходят по мере генерации
+                    logger.debug(f"🧠 [DEBUG] Потоковый ответ GPT для @{username}...")
+                    response_text = await self.send_streamed_reply(
+                        client=client,
+                        sender=sender,
+                        account=account,
+                        event=event,
+                        combined_text=combined_text,
+                        conversation_history=conversation_history,
+                        user_id=user_id,
+                        username=username
+                    )
                 else:
-                    await client.send_message(sender, response_text)
-                    logger.debug(f"  ✅ [DEBUG] Ответ отправлен через client.send_message")
-                
-                logger.info(f"  ✅ Replied to @{username}: {response_text[:100]}...")
-                
-                # Сохраняем в БД
-                db = SessionLocal()
-                try:
-                    dm_response = DMResponse(
-                        account_id=account.id,
+                    response_text = await self.send_full_reply(
+                        client=client,
+                        sender=sender,
+                        account=account,
+                        event=event,
+                        combined_text=combined_text,
+                        conversation_history=conversation_history,
                         user_id=user_id,
-                        username=username,
-                        incoming_message=combined_text[:1000],  # Ограничиваем длину
-                        response_text=response_text[:1000],
-                        service_type='gpt-4o-mini',
-                        sent_at=datetime.utcnow()
+                        username=username
                     )
-                    db.add(dm_response)
-                    db.commit()
-                    
-                    # Помечаем, что мы ответили
-                    self.mark_responded(account.id, user_id)
-                    
-                    logger.debug(f"  💾 Saved response to DB")
-                    
-                except Exception as e:
-                    db.rollback()
-                    logger.error(f"  ❌ Error saving to DB: {e}")
-                finally:
-                    db.close()
+                
+                if response_text:
+                    logger.info(f"  ✅ Replied to @{username}: {response_text[:100]}...")
                 
             except FloodWaitError as e:
                 logger.warning(f"  ⏳ FloodWait {e.seconds} seconds for @{username}")
@@ -562,6 +585,158 @@ class MessageResponder:
         except Exception as e:
             logger.error(f"  ❌ Error in _handle_message_internal: {e}", exc_info=True)
     
+    async def send_full_reply(
+        self,
+        client: TelegramClient,
+        sender: User,
+        account: Account,
+        event: Optional[NewMessage.Event],
+        combined_text: str,
+        conversation_history: List[Dict],
+        user_id: int,
+        username: str
+    ) -> str:
+        """
+        Ответ целиком: дождаться GPT, имитировать печатание и отправить одним сообщением
+        
+        Returns:
+            Отправленный текст (уже сохранен через save_response)
+        """
+        # Генерируем ответ через GPT с учетом истории
+        logger.debug(f"🧠 [DEBUG] Отправляем запрос в GPT для @{username}...")
+        try:
+            response_text = await self.gpt_handler.generate_response(
+                incoming_message=combined_text,
+                conversation_history=conversation_history,
+                user_info={"id": user_id, "username": username}
+            )
+            logger.info(f"🧠 [DEBUG] Ответ от GPT получен: {len(response_text)} символов")
+        except Exception as e:
+            logger.error(f"🔥 [ERROR] Ошибка при генерации ответа GPT для @{username}: {e}")
+            import traceback
+            logger.error(f"🔥 [ERROR] Traceback:\n{traceback.format_exc()}")
+            response_text = "Привет! Спасибо за сообщение. Я сейчас занят, но обязательно отвечу позже! 😊"
+        
+        # Имитируем печатание
+        logger.debug(f"⌨️ [DEBUG] Имитируем печатание для @{username}...")
+        await self.simulate_typing(client, sender)
+        
+        # Отправляем ответ (используем последнее событие или отправляем новое сообщение)
+        logger.debug(f"📤 [DEBUG] Отправляем ответ @{username}...")
+        await self._send_reply_part(client, sender, account, event, user_id, response_text)
+        await self.save_response(account, user_id, username, combined_text, response_text)
+        return response_text
+    
+    async def send_streamed_reply(
+        self,
+        client: TelegramClient,
+        sender: User,
+        account: Account,
+        event: Optional[NewMessage.Event],
+        combined_text: str,
+        conversation_history: List[Dict],
+        user_id: int,
+        username: str
+    ) -> str:
+        """
+        Потоковый ответ: статус "печатает" включается сразу, пока GPT генерирует текст,
+        и каждая готовая часть (законченные предложения) отправляется отдельным сообщением
+        
+        Задержка "печатания" отсчитывается от начала генерации, а не после нее,
+        поэтому время ответа - max(генерация, печатание), а не их сумма.
+        
+        Returns:
+            Отправленный текст (части через перевод строки). Все отправленные части
+            сохраняются через save_response, даже если отправка следующей упала.
+        """
+        try:
+            await client.send_read_acknowledge(sender)
+        except Exception as e:
+            logger.debug(f"  ⚠️ Error marking as read: {e}")
+        
+        sent_parts = []
+        typing_started = time.monotonic()
+        # Первая часть - обычная задержка секретаря, следующие - по длине текста
+        typing_time = random.uniform(self.typing_delay_min, self.typing_delay_max)
+        try:
+            async with client.action(sender, 'typing'):
+                async for part in self.gpt_handler.stream_response(
+                    incoming_message=combined_text,
+                    conversation_history=conversation_history,
+                    user_info={"id": user_id, "username": username}
+                ):
+                    wait = typing_time - (time.monotonic() - typing_started)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    
+                    await self._send_reply_part(client, sender, account, event if not sent_parts else None, user_id, part)
+                    sent_parts.append(part)
+                    
+                    typing_started = time.monotonic()
+                    typing_time = min(self.typing_delay_max, len(part) / self.typing_chars_per_second)
+        finally:
+            # Уже доставленные части фиксируем в любом случае
+            if sent_parts:
+                await self.save_response(account, user_id, username, combined_text, '\n'.join(sent_parts))
+        
+        return '\n'.join(sent_parts)
+    
+    async def _send_reply_part(
+        self,
+        client: TelegramClient,
+        sender: User,
+        account: Account,
+        event: Optional[NewMessage.Event],
+        user_id: int,
+        text: str
+    ):
+        """Отправить сообщение (ответом на событие, если оно есть) и записать его в кэш переписки"""
+        if event:
+            sent_message = await event.reply(text)
+            logger.debug(f"  ✅ [DEBUG] Ответ отправлен через event.reply")
+        else:
+            sent_message = await client.send_message(sender, text)
+            logger.debug(f"  ✅ [DEBUG] Ответ отправлен через client.send_message")
+        self.conversations.append(account.id, user_id, getattr(sent_message, 'id', None), True, text)
+    
+    async def save_response(self, account: Account, user_id: int, username: str, combined_text: str, response_text: str):
+        """
+        Пометить пользователя как недавно отвеченного и сохранить ответ в БД
+        
+        Запись в БД синхронная, поэтому выполняется в пуле потоков и не блокирует
+        обработчики сообщений остальных аккаунтов.
+        """
+        sent_at = datetime.utcnow()
+        # Помечаем, что мы ответили (сразу, до записи в БД)
+        self.mark_responded(account.id, user_id, sent_at)
+        await asyncio.to_thread(
+            self._insert_response, account.id, user_id, username, combined_text, response_text, sent_at
+        )
+    
+    def _insert_response(self, account_id: int, user_id: int, username: str, combined_text: str,
+                         response_text: str, sent_at: datetime):
+        db = SessionLocal()
+        try:
+            dm_response = DMResponse(
+                account_id=account_id,
+                user_id=user_id,
+                username=username,
+                incoming_message=combined_text[:1000],  # Ограничиваем длину
+                response_text=response_text[:1000],
+                service_type='gpt-4o-mini',
+                sent_at=sent_at
+            )
+            db.add(dm_response)
+            db.commit()
+            
+            logger.debug(f"  💾 Saved response to DB")
+            
+        except Exception as e:
+            db.rollback()
+            logger.error(f"  ❌ Error saving to DB: {e}")
+        finally:
+            db.close()
+    
     async def handle_message(self, event: NewMessage.Event, account: Account, client: TelegramClient):
         """
         Обработка входящего сообщения с буферизацией (debouncing)
@@ -597,6 +772,9 @@ class MessageResponder:
             username = getattr(sender, 'username', None) or f"ID{user_id}"
             message_text = event.message.text or ""
             
+            # Сообщение уже в чате - дописываем в кэш переписки (даже если отвечать не будем)
+            self.conversations.append(account.id, user_id, event.message.id, False, message_text)
+            
             logger.info(f"📨 [DEBUG] Пришло сообщение от @{username} (ID: {user_id}): {message_text[:50]}...")
             
             # Проверяем черный список
@@ -604,30 +782,13 @@ class MessageResponder:
                 logger.info(f"  🚫 Blocked message from blacklisted user: @{username}")
                 return
             
-            # Проверяем, не отвечали ли мы недавно (избежание рекурсии)
+            # Проверяем, не отвечали ли мы недавно (избежание рекурсии).
+            # Только память: recent_responses пополняется при каждой записи DMResponse
+            # и загружается из БД при старте, запрос к БД на каждое сообщение не нужен.
             if self.recently_responded(account.id, user_id):
                 logger.debug(f"  ⏭️ Skipping - recently responded to @{username}")
                 return
             
-            # Проверяем в БД, не отвечали ли мы совсем недавно (за последнюю секунду)
-            db = SessionLocal()
-            try:
-                one_second_ago = datetime.utcnow() - timedelta(seconds=1)
-                recent_response = db.query(DMResponse).filter(
-                    and_(
-                        DMResponse.account_id == account.id,
-                        DMResponse.user_id == user_id,
-                        DMResponse.sent_at >= one_second_ago
-                    )
-                ).first()
-                
-                if recent_response:
-                    logger.debug(f"  ⏭️ Skipping - responded less than 1 second ago to @{username}")
-                    return
-                
-            finally:
-                db.close()
-            
             logger.debug(f"  📨 Buffering message from @{username}: {message_text[:50]}...")
             
             # БУФЕРИЗАЦИЯ: Добавляем сообщение в буфер
@@ -699,6 +860,8 @@ class MessageResponder:
         """Настройка обработчиков событий для всех клиентов"""
         accounts_map = {}  # {account_name: account}
         
+        self.load_recent_responses()
+        
         # Загружаем аккаунты из БД
         db = SessionLocal()
         try:
@@ -730,6 +893,12 @@ class MessageResponder:
                         logger.error(f"🔥 [HANDLER] Ошибка в handle_message для {acc_name}: {e}")
                         import traceback
                         logger.error(f"🔥 [HANDLER] Traceback:\n{traceback.format_exc()}")
+                
+                # Исходящие из других сессий аккаунта (владелец ответил сам) - в кэш переписки
+                @cli.on(NewMessage(outgoing=True, func=lambda e: e.is_private))
+                async def outgoing_handler(event):
+                    self.conversations.append(acc.id, event.chat_id, event.message.id, True, event.message.text or "")
+                
                 return handler
             
             # Создаем обработчик с правильным замыканием
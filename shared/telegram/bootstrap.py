@@ -0,0 +1,90 @@
+"""
+Параллельное подключение аккаунтов при старте сервисов
+
+Аккаунты подключаются одновременно (не больше concurrency за раз), у каждого
+свой таймаут, поэтому время старта определяется самым медленным аккаунтом,
+а зависший прокси не задерживает остальных.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = int(os.getenv('TELEGRAM_BOOTSTRAP_CONCURRENCY', '8'))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '30'))
+
+
+@dataclass
+class BootstrapReport:
+    """Итог подключения: кто готов, кто не подключился и сколько это заняло"""
+    ready: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)  # session_name -> причина
+    timings: Dict[str, float] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.ready) + len(self.failed)
+
+    def log(self, label: str = "accounts"):
+        slowest = max(self.timings.items(), key=lambda item: item[1], default=None)
+        logger.info(
+            f"✅ Bootstrap {label}: {len(self.ready)}/{self.total} ready in {self.elapsed:.1f}s"
+            + (f" (slowest: {slowest[0]} {slowest[1]:.1f}s)" if slowest else "")
+        )
+        for name, reason in sorted(self.failed.items()):
+            logger.warning(f"⚠️ Bootstrap {label}: {name} not ready - {reason}")
+
+
+async def bootstrap_clients(
+    accounts: Iterable[Any],
+    connect: Callable[[Any], Awaitable[Optional[Any]]],
+    name_of: Callable[[Any], str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    label: str = "accounts",
+) -> BootstrapReport:
+    """
+    Подключить аккаунты параллельно
+
+    Args:
+        accounts: Аккаунты (объекты БД или словари конфига)
+        connect: Корутина подключения одного аккаунта, возвращает клиент или None
+        name_of: Имя аккаунта для отчета (session_name)
+        concurrency: Сколько аккаунтов подключать одновременно
+        timeout: Таймаут подключения одного аккаунта (сек)
+        label: Подпись в логах
+
+    Returns:
+        BootstrapReport (уже записан в лог)
+    """
+    report = BootstrapReport()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.monotonic()
+
+    async def bootstrap_one(account):
+        name = name_of(account)
+        async with semaphore:
+            account_started = time.monotonic()
+            try:
+                client = await asyncio.wait_for(connect(account), timeout=timeout)
+                reason = None if client else "not connected or not authorized"
+            except asyncio.TimeoutError:
+                reason = f"timeout after {timeout:.0f}s"
+            except Exception as e:
+                reason = f"{type(e).__name__}: {e}"
+            report.timings[name] = time.monotonic() - account_started
+
+        if reason is None:
+            report.ready.append(name)
+        else:
+            report.failed[name] = reason
+
+    await asyncio.gather(*(bootstrap_one(account) for account in accounts))
+    report.elapsed = time.monotonic() - started
+    report.log(label)
+    return report
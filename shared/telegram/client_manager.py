@@ -10,6 +10,8 @@ from telethon.sessions import StringSession
 from typing import Dict, Optional
 import logging
 
+from .bootstrap import BootstrapReport, bootstrap_clients
+
 logger = logging.getLogger(__name__)
 
 
@@ -118,6 +120,13 @@ class TelegramClientManager:
             self.clients[session_name] = client
             logger.info(f"✅ Client {session_name} connected and authorized")
             return client
+        except asyncio.CancelledError:
+            # Таймаут параллельного bootstrap: не оставляем висящее соединение
+            try:
+                await asyncio.wait_for(client.disconnect(), timeout=2.0)
+            except Exception:
+                pass
+            raise
         except Exception as e:
             logger.error(f"Failed to connect client {session_name}: {e}")
             # Пытаемся правильно закрыть соединение
@@ -173,7 +182,13 @@ class TelegramClientManager:
                 logger.warning(f"Error disconnecting {name}: {e}")
         self.clients.clear()
     
-    async def load_accounts_from_db(self, db_session, exclude_lexus_accounts: bool = True):
+    async def load_accounts_from_db(
+        self,
+        db_session,
+        exclude_lexus_accounts: bool = True,
+        concurrency: Optional[int] = None,
+        connect_timeout: Optional[float] = None
+    ) -> BootstrapReport:
         """
         Загрузить аккаунты из БД и создать клиенты
         
@@ -181,6 +196,11 @@ class TelegramClientManager:
             db_session: Сессия базы данных
             exclude_lexus_accounts: Если True, исключает аккаунты из lexus_accounts_config.json
                                    (используется в Bali системе для разделения с Lexus)
+            concurrency: Сколько аккаунтов подключать одновременно (None - TELEGRAM_BOOTSTRAP_CONCURRENCY)
+            connect_timeout: Таймаут подключения одного аккаунта (None - TELEGRAM_CONNECT_TIMEOUT)
+        
+        Returns:
+            BootstrapReport с готовыми и неподключившимися аккаунтами
         """
         from ..database.models import Account
         
@@ -234,9 +254,8 @@ class TelegramClientManager:
                         except Exception as e:
                             logger.warning(f"⚠️ Failed to load lexus_accounts_config.json from {path}: {e}")
         
-        loaded_count = 0
-        failed_count = 0
         excluded_count = 0
+        to_load = []
         
         for account in accounts:
             # Фильтруем аккаунты: whitelist или blacklist
@@ -253,25 +272,31 @@ class TelegramClientManager:
                         excluded_count += 1
                         logger.debug(f"Skipping Lexus account: {account.session_name}")
                         continue
-            
-            try:
-                client = await self.create_client(
-                    session_name=account.session_name,
-                    api_id=account.api_id,
-                    api_hash=account.api_hash,
-                    string_session=account.string_session,
-                    proxy=account.proxy
-                )
-                if client:
-                    loaded_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                logger.error(f"Failed to load account {account.session_name}: {e}")
-                failed_count += 1
+            to_load.append(account)
+        
+        def connect(account):
+            return self.create_client(
+                session_name=account.session_name,
+                api_id=account.api_id,
+                api_hash=account.api_hash,
+                string_session=account.string_session,
+                proxy=account.proxy
+            )
+        
+        bootstrap_kwargs = {}
+        if concurrency is not None:
+            bootstrap_kwargs['concurrency'] = concurrency
+        if connect_timeout is not None:
+            bootstrap_kwargs['timeout'] = connect_timeout
+        report = await bootstrap_clients(
+            to_load, connect, name_of=lambda account: account.session_name, **bootstrap_kwargs
+        )
+        loaded_count = len(report.ready)
+        failed_count = len(report.failed)
         
         if exclude_lexus_accounts and excluded_count > 0:
             logger.info(f"✅ Loaded {loaded_count} Bali accounts, {failed_count} failed, {excluded_count} excluded (Lexus)")
         else:
             logger.info(f"✅ Loaded {loaded_count} accounts, {failed_count} failed")
-
+        
+        return report
@@ -0,0 +1,225 @@
+"""
+Пул долгоживущих Telegram клиентов поверх TelegramClientManager
+
+Клиенты хранятся в manager.clients (ключ - session_name) и переиспользуются
+между постами и батчами: проверка здоровья, вытеснение простаивающих
+соединений и экспоненциальный backoff при неудачных подключениях.
+
+Менеджер может быть общим с другими сервисами (например, планировщиком),
+поэтому при простое и закрытии пул отключает только клиентов, которых
+создал сам; уже подключенные клиенты менеджера он только переиспользует.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from telethon import TelegramClient
+
+from .client_manager import TelegramClientManager
+
+logger = logging.getLogger(__name__)
+
+ClientFactory = Callable[[], Awaitable[Optional[TelegramClient]]]
+
+
+class TelegramClientPool:
+    """Пул подключенных клиентов, которые сервисы арендуют по session_name"""
+
+    def __init__(
+        self,
+        manager: Optional[TelegramClientManager] = None,
+        idle_timeout: float = 900.0,
+        health_check_interval: float = 120.0,
+        health_check_timeout: float = 10.0,
+        backoff_base: float = 5.0,
+        backoff_max: float = 300.0,
+    ):
+        """
+        Args:
+            manager: Менеджер клиентов (если None - создается новый)
+            idle_timeout: Через сколько секунд простоя клиент отключается
+            health_check_interval: Как часто (сек) проверять клиента запросом get_me
+            health_check_timeout: Таймаут проверки здоровья
+            backoff_base: Начальная пауза перед повторным подключением после ошибки
+            backoff_max: Максимальная пауза перед повторным подключением
+        """
+        self.manager = manager or TelegramClientManager()
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._last_used: Dict[str, float] = {}
+        self._last_checked: Dict[str, float] = {}
+        self._in_use: Dict[str, int] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._owned: Set[str] = set()  # session_name клиентов, созданных пулом
+        self.stats = {'created': 0, 'reused': 0, 'reconnected': 0, 'evicted': 0, 'failed': 0}
+
+    def _lock(self, session_name: str) -> asyncio.Lock:
+        lock = self._locks.get(session_name)
+        if lock is None:
+            lock = self._locks[session_name] = asyncio.Lock()
+        return lock
+
+    def in_backoff(self, session_name: str) -> bool:
+        """Находится ли аккаунт в паузе после неудачного подключения"""
+        return self._retry_at.get(session_name, 0.0) > time.monotonic()
+
+    def _register_failure(self, session_name: str):
+        failures = self._failures.get(session_name, 0) + 1
+        self._failures[session_name] = failures
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (failures - 1)))
+        self._retry_at[session_name] = time.monotonic() + delay
+        self.stats['failed'] += 1
+        logger.warning(f"⏳ Client {session_name}: connect failed ({failures}x), retry in {delay:.0f}s")
+
+    def _register_success(self, session_name: str):
+        self._failures.pop(session_name, None)
+        self._retry_at.pop(session_name, None)
+
+    async def _is_healthy(self, session_name: str, client: TelegramClient) -> bool:
+        """Проверка клиента: подключен и отвечает на get_me (не чаще health_check_interval)"""
+        now = time.monotonic()
+        if now - self._last_checked.get(session_name, 0.0) < self.health_check_interval:
+            return client.is_connected()
+
+        try:
+            if not client.is_connected():
+                client = await self.manager.ensure_client_connected(session_name)
+                if not client:
+                    return False
+                self.stats['reconnected'] += 1
+            me = await asyncio.wait_for(client.get_me(input_peer=True), timeout=self.health_check_timeout)
+            if me is None:
+                return False
+        except Exception as e:
+            logger.warning(f"⚠️ Health check failed for {session_name}: {e}")
+            return False
+
+        self._last_checked[session_name] = now
+        return True
+
+    async def acquire(self, session_name: str, factory: ClientFactory) -> Optional[TelegramClient]:
+        """
+        Получить подключенный клиент для аккаунта
+
+        Args:
+            session_name: Имя сессии (ключ пула)
+            factory: Корутина-фабрика, создающая подключенный и авторизованный клиент
+
+        Returns:
+            TelegramClient или None (ошибка подключения или аккаунт в backoff).
+            Полученный клиент нужно вернуть через release()
+        """
+        await self.evict_idle()
+
+        async with self._lock(session_name):
+            client = self.manager.clients.get(session_name)
+            if client is not None:
+                if await self._is_healthy(session_name, client):
+                    self.stats['reused'] += 1
+                    self._last_used[session_name] = time.monotonic()
+                    self._mark_in_use(session_name)
+                    return self.manager.clients.get(session_name)
+                logger.info(f"🔄 Client {session_name} is unhealthy, recreating")
+                await self._drop(session_name)
+
+            if self.in_backoff(session_name):
+                logger.debug(f"Client {session_name} is in reconnect backoff, skipping")
+                return None
+
+            try:
+                client = await factory()
+            except Exception as e:
+                logger.error(f"❌ Failed to create client for {session_name}: {e}")
+                client = None
+
+            if client is None:
+                self._register_failure(session_name)
+                return None
+
+            self._register_success(session_name)
+            self.manager.clients[session_name] = client
+            self._owned.add(session_name)
+            now = time.monotonic()
+            self._last_used[session_name] = now
+            self._last_checked[session_name] = now
+            self.stats['created'] += 1
+            self._mark_in_use(session_name)
+            return client
+
+    def _mark_in_use(self, session_name: str):
+        self._in_use[session_name] = self._in_use.get(session_name, 0) + 1
+
+    def release(self, session_name: str):
+        """Вернуть клиента в пул после acquire (соединение остается открытым)"""
+        if self._in_use.get(session_name):
+            self._in_use[session_name] -= 1
+        self._last_used[session_name] = time.monotonic()
+
+    @asynccontextmanager
+    async def lease(self, session_name: str, factory: ClientFactory):
+        """
+        Аренда клиента на время операции
+
+        Usage:
+            async with pool.lease(name, factory) as client:
+                if client:
+                    await client.send_message(...)
+        """
+        client = await self.acquire(session_name, factory)
+        try:
+            yield client
+        finally:
+            if client is not None:
+                self.release(session_name)
+
+    async def _drop(self, session_name: str):
+        client = self.manager.clients.pop(session_name, None)
+        self._owned.discard(session_name)
+        self._last_used.pop(session_name, None)
+        self._last_checked.pop(session_name, None)
+        if client is None:
+            return
+        try:
+            if client.is_connected():
+                await asyncio.wait_for(client.disconnect(), timeout=3.0)
+        except Exception as e:
+            logger.debug(f"Error disconnecting {session_name}: {e}")
+
+    async def discard(self, session_name: str):
+        """Принудительно отключить клиента (например, после AuthKeyError)"""
+        async with self._lock(session_name):
+            await self._drop(session_name)
+
+    async def evict_idle(self):
+        """Отключить созданных пулом клиентов, которые простаивали дольше idle_timeout"""
+        now = time.monotonic()
+        idle = [
+            name for name in list(self._owned)
+            if not self._in_use.get(name)
+            and now - self._last_used.setdefault(name, now) > self.idle_timeout
+        ]
+        for name in idle:
+            lock = self._lock(name)
+            if lock.locked():
+                continue
+            async with lock:
+                await self._drop(name)
+            self.stats['evicted'] += 1
+            logger.info(f"💤 Evicted idle client {name}")
+
+    async def close(self):
+        """Отключить все клиенты, созданные пулом (клиенты общего менеджера остаются)"""
+        for name in list(self._owned):
+            async with self._lock(name):
+                await self._drop(name)
+        self._last_used.clear()
+        self._last_checked.clear()
+        self._in_use.clear()
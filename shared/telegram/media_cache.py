@@ -0,0 +1,131 @@
+"""
+Кэш загруженных медиа: один upload файла на аккаунт
+
+Фото кампании отправляется десятками постов подряд. Вместо повторной загрузки
+файла для каждой группы после первой отправки запоминается InputMedia
+(id + access_hash + file_reference) отправленного фото, и следующие посты
+этого аккаунта ссылаются на уже загруженный файл. Ключ - (аккаунт, sha256
+содержимого), поэтому переименование или замена файла не путают кэш.
+file_reference со временем устаревает: запись живет ttl секунд, а при
+FileReference*/Media*-ошибках удаляется и файл загружается заново.
+"""
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from telethon import utils
+from telethon.errors import (
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+    MediaInvalidError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых закэшированное медиа нужно загрузить заново
+STALE_MEDIA_ERRORS = (
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+    MediaInvalidError,
+)
+
+DEFAULT_MEDIA_CACHE_TTL = float(os.getenv('TELEGRAM_MEDIA_CACHE_TTL', str(6 * 3600)))
+
+
+class MediaCache:
+    """Кэш InputMedia по (session_name, хэш файла) с временем жизни"""
+
+    def __init__(self, ttl: float = DEFAULT_MEDIA_CACHE_TTL):
+        """
+        Args:
+            ttl: Сколько секунд переиспользовать загруженное медиа
+        """
+        self.ttl = ttl
+        self._media: Dict[Tuple[str, str], Tuple[object, float]] = {}  # (аккаунт, хэш) -> (InputMedia, expires_at)
+        self._hashes: Dict[str, Tuple[float, int, str]] = {}            # путь -> (mtime, size, sha256)
+        self.stats = {'hits': 0, 'uploads': 0, 'expired': 0}
+
+    def file_hash(self, path: str) -> str:
+        """sha256 содержимого файла (пересчитывается только при изменении mtime/размера)"""
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()
+        self._hashes[path] = (st.st_mtime, st.st_size, file_hash)
+        return file_hash
+
+    def get(self, account: str, file_hash: str):
+        entry = self._media.get((account, file_hash))
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self._media[(account, file_hash)]
+            return None
+        return entry[0]
+
+    def put(self, account: str, file_hash: str, message):
+        """Запомнить медиа отправленного сообщения"""
+        media = getattr(message, 'media', None)
+        if media is None:
+            return
+        try:
+            input_media = utils.get_input_media(media)
+        except (TypeError, ValueError):
+            return
+        self._media[(account, file_hash)] = (input_media, time.time() + self.ttl)
+
+    def invalidate(self, account: str, file_hash: str):
+        self._media.pop((account, file_hash), None)
+
+    async def send_file(self, client, account: str, entity, path: str, **kwargs):
+        """
+        client.send_file с переиспользованием уже загруженного файла
+
+        Args:
+            client: Telegram клиент аккаунта
+            account: session_name аккаунта (медиа привязано к аккаунту)
+            entity: Получатель
+            path: Путь к файлу
+            **kwargs: Параметры send_file (caption, ...)
+
+        Returns:
+            Отправленное сообщение
+        """
+        file_hash = self.file_hash(path)
+        input_media = self.get(account, file_hash)
+        if input_media is not None:
+            try:
+                message = await client.send_file(entity, input_media, **kwargs)
+                self.stats['hits'] += 1
+                return message
+            except STALE_MEDIA_ERRORS as e:
+                self.stats['expired'] += 1
+                self.invalidate(account, file_hash)
+                logger.info(f"♻️ Cached media for {account} is stale ({type(e).__name__}), re-uploading {path}")
+
+        message = await client.send_file(entity, path, **kwargs)
+        self.stats['uploads'] += 1
+        self.put(account, file_hash, message)
+        return message
+
+
+_media_cache: Optional[MediaCache] = None
+
+
+def get_media_cache() -> MediaCache:
+    """Общий экземпляр кэша для процесса"""
+    global _media_cache
+    if _media_cache is None:
+        _media_cache = MediaCache()
+    return _media_cache
@@ -0,0 +1,199 @@
+"""
+Кэш разрешения username/ID -> peer (id + access_hash) для каждого аккаунта
+
+access_hash у каждого аккаунта свой, поэтому ключ кэша - (аккаунт, цель).
+Кэш хранится в SQLite рядом с сессиями (общий для сервисов, переживает
+перезапуск) и проверяется до сетевого запроса, поэтому повторные батчи
+разрешают цели без ResolveUsernameRequest. Запись удаляется по TTL
+и при UsernameInvalid/ChannelPrivate.
+"""
+import logging
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from telethon import utils
+from telethon.errors import (
+    ChannelInvalidError,
+    ChannelPrivateError,
+    UsernameInvalidError,
+    UsernameNotOccupiedError,
+)
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых закэшированный peer больше не годится
+INVALIDATING_ERRORS = (ChannelInvalidError, ChannelPrivateError, UsernameInvalidError, UsernameNotOccupiedError)
+
+DEFAULT_PEER_CACHE_PATH = os.getenv('TELEGRAM_PEER_CACHE_PATH', 'sessions/peer_cache.db')
+DEFAULT_PEER_CACHE_TTL = 7 * 24 * 3600
+
+_LINK_PREFIX_RE = re.compile(r"^(?:https?://)?(?:www\.)?(?:t|telegram)\.(?:me|dog)/", re.IGNORECASE)
+
+
+def normalize_target(target: Any) -> Optional[str]:
+    """
+    Ключ кэша для цели: 'username' (нижний регистр, без @ и t.me/) или числовой ID строкой.
+    Инвайт-ссылки не кэшируются (None).
+    """
+    if isinstance(target, int):
+        return str(target)
+    if not isinstance(target, str):
+        return None
+    key = _LINK_PREFIX_RE.sub('', target.strip()).lstrip('@').split('/')[0].split('?')[0]
+    if not key or key.startswith('+') or key.lower() == 'joinchat':
+        return None
+    return key if key.lstrip('-').isdigit() else key.lower()
+
+
+class PeerCache:
+    """Персистентный кэш InputPeer по (session_name, цель)"""
+
+    def __init__(self, db_path: str = DEFAULT_PEER_CACHE_PATH, ttl: float = DEFAULT_PEER_CACHE_TTL):
+        """
+        Args:
+            db_path: Путь к SQLite-файлу кэша
+            ttl: Сколько секунд запись считается действительной
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+        try:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = self._open(db_path)
+        except (OSError, sqlite3.Error) as e:
+            # Например, sessions/ смонтирован только для чтения - кэшируем в памяти процесса
+            logger.warning(f"⚠️ Peer cache {db_path} unavailable ({e}), using in-memory cache")
+            self._conn = self._open(':memory:')
+
+    @staticmethod
+    def _open(db_path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(db_path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS peers (
+                account TEXT NOT NULL,
+                target TEXT NOT NULL,
+                peer_type TEXT NOT NULL,
+                peer_id INTEGER NOT NULL,
+                access_hash INTEGER,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (account, target)
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    def get(self, account: str, target: Any):
+        """InputPeer из кэша или None"""
+        key = normalize_target(target)
+        if key is None:
+            return None
+        try:
+            row = self._conn.execute(
+                'SELECT peer_type, peer_id, access_hash FROM peers WHERE account = ? AND target = ? AND updated_at > ?',
+                (account, key, time.time() - self.ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Peer cache read failed: {e}")
+            return None
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        peer_type, peer_id, access_hash = row
+        if peer_type == 'user':
+            return InputPeerUser(peer_id, access_hash)
+        if peer_type == 'channel':
+            return InputPeerChannel(peer_id, access_hash)
+        return InputPeerChat(peer_id)
+
+    def put(self, account: str, target: Any, entity):
+        """Запомнить peer сущности под ключом цели и под её маркированным ID"""
+        self.put_many(account, [(target, entity)])
+
+    def put_many(self, account: str, items: Iterable):
+        """Запомнить несколько (цель, сущность) одной транзакцией (например, все диалоги аккаунта)"""
+        now = time.time()
+        rows = []
+        for target, entity in items:
+            try:
+                peer = utils.get_input_peer(entity)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(peer, InputPeerUser):
+                peer_type, peer_id, access_hash = 'user', peer.user_id, peer.access_hash
+            elif isinstance(peer, InputPeerChannel):
+                peer_type, peer_id, access_hash = 'channel', peer.channel_id, peer.access_hash
+            elif isinstance(peer, InputPeerChat):
+                peer_type, peer_id, access_hash = 'chat', peer.chat_id, None
+            else:
+                continue
+            # Голый peer_id не используем: у пользователя и канала он может совпадать
+            keys = {normalize_target(target), str(utils.get_peer_id(peer))}
+            if peer_type == 'channel':
+                keys.add(f"100{peer_id}")  # полный ID канала без минуса, как в targets-конфигах
+            username = getattr(entity, 'username', None)
+            if username:
+                keys.add(username.lower())
+            rows.extend((account, key, peer_type, peer_id, access_hash, now) for key in keys if key)
+        if not rows:
+            return
+        try:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO peers (account, target, peer_type, peer_id, access_hash, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Peer cache write failed: {e}")
+
+    def invalidate(self, account: str, target: Any):
+        """Удалить запись (цель переименована, стала приватной, аккаунт забанен)"""
+        key = normalize_target(target)
+        if key is None:
+            return
+        try:
+            self._conn.execute('DELETE FROM peers WHERE account = ? AND target = ?', (account, key))
+            self._conn.commit()
+            self.stats['invalidated'] += 1
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Peer cache invalidate failed: {e}")
+
+    async def resolve(self, client, account: str, target: Any):
+        """
+        Разрешить цель: сначала кэш (без запросов к API), затем client.get_entity
+
+        Returns:
+            InputPeer из кэша или полученная сущность
+
+        Raises:
+            Ошибки get_entity (для INVALIDATING_ERRORS запись предварительно удаляется)
+        """
+        peer = self.get(account, target)
+        if peer is not None:
+            return peer
+        try:
+            entity = await client.get_entity(target)
+        except INVALIDATING_ERRORS:
+            self.invalidate(account, target)
+            raise
+        self.put(account, target, entity)
+        return entity
+
+
+_peer_cache: Optional[PeerCache] = None
+
+
+def get_peer_cache() -> PeerCache:
+    """Общий экземпляр кэша для процесса"""
+    global _peer_cache
+    if _peer_cache is None:
+        _peer_cache = PeerCache()
+    return _peer_cache
@@ -0,0 +1,146 @@
+"""
+Кэш списков участников групп по (аккаунт, группа)
+
+Состав группы за час почти не меняется, поэтому полный get_participants
+нужен редко (раз в ttl). Между полными загрузками список дополняется
+недавно вступившими (один небольшой запрос раз в refresh_interval), а в
+остальное время отдается из памяти без запросов к API. Снимок сохраняется
+в JSON и загружается при старте, поэтому рестарт сервиса не обнуляет кэш.
+
+Хранятся только стабильные поля (id, access_hash, bot). Метаданные stories
+меняются постоянно, поэтому их нужно получать заново (users.GetUsers по
+списку из кэша), а не брать из снимка.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+from telethon.tl.types import User
+
+logger = logging.getLogger(__name__)
+
+
+def story_max_id(user) -> Optional[int]:
+    """ID последней живой story пользователя из метаданных User (None - stories нет)"""
+    value = getattr(user, 'stories_max_id', None)
+    if value is None or isinstance(value, int):
+        return value
+    # В новых слоях API это RecentStory(max_id=...)
+    return getattr(value, 'max_id', None)
+
+
+class ParticipantRosterCache:
+    """Участники групп (id, access_hash) по аккаунту и группе"""
+
+    def __init__(self, persist_path: Optional[str] = None, ttl: float = 12 * 3600,
+                 refresh_interval: float = 3600, max_members: int = 500):
+        """
+        Args:
+            persist_path: JSON-файл снимка (None - только в памяти)
+            ttl: Через сколько секунд список загружается полностью заново
+            refresh_interval: Как часто дополнять список недавно вступившими
+            max_members: Сколько последних увиденных участников хранить на группу
+        """
+        self.persist_path = persist_path
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.max_members = max_members
+        # "account:group" -> {'loaded_at', 'refreshed_at', 'members': {user_id: {...}}}
+        self._rosters: Dict[str, Dict] = {}
+        self._dirty = False
+        self.stats = {'hits': 0, 'refreshes': 0, 'full_loads': 0}
+        self._load()
+
+    @staticmethod
+    def _key(account: str, group: str) -> str:
+        return f"{account}:{group.lstrip('@').lower()}"
+
+    def needs_full_load(self, account: str, group: str) -> bool:
+        roster = self._rosters.get(self._key(account, group))
+        return roster is None or time.time() - roster['loaded_at'] >= self.ttl
+
+    def needs_refresh(self, account: str, group: str) -> bool:
+        roster = self._rosters.get(self._key(account, group))
+        return roster is None or time.time() - roster['refreshed_at'] >= self.refresh_interval
+
+    def get(self, account: str, group: str) -> List[User]:
+        """Участники из кэша (объекты User без метаданных stories, пригодные как peer для запросов)"""
+        roster = self._rosters.get(self._key(account, group))
+        if roster is None:
+            return []
+        self.stats['hits'] += 1
+        return [
+            User(
+                id=member['id'],
+                access_hash=member['access_hash'],
+                bot=member.get('bot'),
+            )
+            for member in roster['members'].values()
+        ]
+
+    def replace(self, account: str, group: str, users: Iterable):
+        """Полная загрузка: список заменяется целиком"""
+        now = time.time()
+        self._rosters[self._key(account, group)] = {'loaded_at': now, 'refreshed_at': now, 'members': {}}
+        self._merge(account, group, users, now)
+        self.stats['full_loads'] += 1
+
+    def merge(self, account: str, group: str, users: Iterable):
+        """Инкрементальное обновление: новые участники добавляются, известные - обновляются"""
+        now = time.time()
+        roster = self._rosters.setdefault(
+            self._key(account, group), {'loaded_at': now, 'refreshed_at': now, 'members': {}}
+        )
+        roster['refreshed_at'] = now
+        self._merge(account, group, users, now)
+        self.stats['refreshes'] += 1
+
+    def _merge(self, account: str, group: str, users: Iterable, now: float):
+        members = self._rosters[self._key(account, group)]['members']
+        for user in users:
+            access_hash = getattr(user, 'access_hash', None)
+            if access_hash is None or not hasattr(user, 'id'):
+                continue
+            key = str(user.id)
+            members.pop(key, None)  # перемещаем в конец - самые свежие последними
+            members[key] = {
+                'id': user.id,
+                'access_hash': access_hash,
+                'bot': bool(getattr(user, 'bot', False)),
+                'seen_at': now,
+            }
+        while len(members) > self.max_members:
+            members.pop(next(iter(members)))
+        self._dirty = True
+
+    def invalidate(self, account: str, group: str):
+        if self._rosters.pop(self._key(account, group), None) is not None:
+            self._dirty = True
+
+    def _load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            self._rosters = {key: roster for key, roster in data.items() if now - roster['loaded_at'] < self.ttl}
+            logger.info(f"📦 Loaded {len(self._rosters)} participant rosters from {self.persist_path}")
+        except Exception as e:
+            logger.error(f"❌ Failed to load participant rosters from {self.persist_path}: {e}")
+
+    def save(self):
+        """Сохранить снимок (атомарно через временный файл), если были изменения"""
+        if not self.persist_path or not self._dirty:
+            return
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.persist_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._rosters, f)
+            os.replace(tmp_path, self.persist_path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"❌ Failed to save participant rosters to {self.persist_path}: {e}")